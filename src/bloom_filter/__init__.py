@@ -1,10 +1,19 @@
 #!/usr/bin/env python
 # coding=utf-8
 
-from .bloom_filter import BloomFilter
+from .bloom_filter import BloomFilter, Array_backend, Numpy_backend, Mmap_backend
+from .blocked_bloom_filter import BlockedBloomFilter
+from .counting_bloom_filter import CountingBloomFilter
+from .scalable_bloom_filter import ScalableBloomFilter
 
 __version__ = '1.0.0'
 
 __all__ = [
-    'BloomFilter'
+    'BloomFilter',
+    'BlockedBloomFilter',
+    'CountingBloomFilter',
+    'ScalableBloomFilter',
+    'Array_backend',
+    'Numpy_backend',
+    'Mmap_backend'
 ]
@@ -1,12 +1,37 @@
 """Bloom Filter: Probabilistic set membership testing for large sets"""
 
 import array
+import copy
 import math
+import mmap
 import os
 import random
-import mmh3
+import struct
+import numpy as np
+import utils
 from filter import Filter
 
+# Number of bits set in every byte value
+_POPCOUNTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+# Bytes of every filter combined at a time by an n-way merge, so the chunks
+# being merged stay in cache
+MERGE_CHUNK_BYTES = 1 << 20
+
+def _count_set_bits(words):
+    """Number of bits set in a NumPy array of unsigned integers"""
+    if hasattr(np, 'bitwise_count'):  # NumPy >= 2.0
+        return int(np.bitwise_count(words).sum(dtype=np.int64))
+    return int(_POPCOUNTS[words.view(np.uint8)].sum(dtype=np.int64))
+
+def _union_into(words, others):
+    """OR every array in others into the array words, one chunk at a time"""
+    chunk = max(1, MERGE_CHUNK_BYTES // words.itemsize)
+    for start in range(0, len(words), chunk):
+        block = words[start:start + chunk]
+        for other in others:
+            np.bitwise_or(block, other[start:start + chunk], out=block)
+
 class Array_backend(object):
     """
     Backend storage for our "array of bits" using a python array of integers
@@ -36,60 +61,269 @@ class Array_backend(object):
         mask = Array_backend.effs - (1 << bit_within_wordno)
         self.array_[wordno] &= mask
 
-    # It'd be nice to do __iand__ and __ior__ in a base class, but
-    # that'd be Much slower
+    def set_many(self, bitnos):
+        """set every bit number in the array bitnos to true"""
+        # Bits are 32 to a word, whatever the width of the array's words
+        bitnos = bitnos.ravel()
+        words = self.words()
+        masks = np.left_shift(words.dtype.type(1), (bitnos & 31).astype(words.dtype))
+        np.bitwise_or.at(words, bitnos >> 5, masks)
+
+    def are_set(self, bitnos):
+        """Return a boolean array, true where the bit number in bitnos is set"""
+        words = self.words()
+        bits = words[bitnos >> 5] >> (bitnos & 31).astype(words.dtype)
+        return (bits & 1).astype(bool)
+
+    def words(self):
+        """NumPy view of the words of the array, without copying"""
+        return np.frombuffer(self.array_, dtype=np.dtype(self.array_.typecode))
+
+    def count_set_bits(self):
+        """Return the number of bits set"""
+        return _count_set_bits(self.words())
+
+    def copy(self):
+        """Return a new backend holding the same bits"""
+        backend = Array_backend(self.num_bits)
+        backend.array_[:] = self.array_
+        return backend
+
+    def union_many(self, others):
+        """Set every bit that is set in any of the backends in others"""
+        _union_into(self.words(), [other.words() for other in others])
 
     def __iand__(self, other):
         assert self.num_bits == other.num_bits
 
-        for wordno in range(self.num_words):
-            self.array_[wordno] &= other.array_[wordno]
+        words = self.words()
+        np.bitwise_and(words, other.words(), out=words)
 
         return self
 
     def __ior__(self, other):
         assert self.num_bits == other.num_bits
 
-        for wordno in range(self.num_words):
-            self.array_[wordno] |= other.array_[wordno]
+        words = self.words()
+        np.bitwise_or(words, other.words(), out=words)
 
         return self
 
-def get_filter_bitno_probes(bloom_filter, key):
+class Numpy_backend(object):
     """
-    Apply num_probes_k hash functions to key.
+    Backend storage for our "array of bits" using a NumPy array of bytes.
 
-    Generate the array index and bitmask corresponding to each result
+    Whole arrays of bit numbers can be set or tested at once.
     """
 
-    # Convert the key to bytes if it's a string, integer, or float
-    if isinstance(key, (str, int, float)):
-        key = str(key).encode()
-    else:
-        raise TypeError('Sorry, I do not know how to hash this type')
+    def __init__(self, num_bits):
+        self.num_bits = num_bits
+        self.num_bytes = (self.num_bits + 7) // 8
+        self.array_ = np.zeros(self.num_bytes, dtype=np.uint8)
+
+    def is_set(self, bitno):
+        """Return true iff bit number bitno is set"""
+        byteno, bit_within_byteno = divmod(bitno, 8)
+        return (int(self.array_[byteno]) >> bit_within_byteno) & 1
+
+    def set(self, bitno):
+        """set bit number bitno to true"""
+        byteno, bit_within_byteno = divmod(bitno, 8)
+        self.array_[byteno] |= 1 << bit_within_byteno
+
+    def clear(self, bitno):
+        """clear bit number bitno - set it to false"""
+        byteno, bit_within_byteno = divmod(bitno, 8)
+        self.array_[byteno] &= 0xff ^ (1 << bit_within_byteno)
+
+    def set_many(self, bitnos):
+        """set every bit number in the array bitnos to true"""
+        bitnos = bitnos.ravel()
+        masks = np.left_shift(np.uint8(1), (bitnos & 7).astype(np.uint8))
+        np.bitwise_or.at(self.array_, bitnos >> 3, masks)
+
+    def are_set(self, bitnos):
+        """Return a boolean array, true where the bit number in bitnos is set"""
+        bits = self.array_[bitnos >> 3] >> (bitnos & 7).astype(np.uint8)
+        return (bits & 1).astype(bool)
+
+    def words(self):
+        """The bytes of the array"""
+        return self.array_
+
+    def count_set_bits(self):
+        """Return the number of bits set"""
+        return _count_set_bits(self.array_)
+
+    def copy(self):
+        """Return a new in-memory backend holding the same bits"""
+        backend = Numpy_backend(self.num_bits)
+        backend.array_[:] = self.array_
+        return backend
+
+    def union_many(self, others):
+        """Set every bit that is set in any of the backends in others"""
+        _union_into(self.array_, [other.words() for other in others])
+
+    def __iand__(self, other):
+        assert self.num_bits == other.num_bits
+
+        self.array_ &= other.array_
+
+        return self
+
+    def __ior__(self, other):
+        assert self.num_bits == other.num_bits
+
+        self.array_ |= other.array_
+
+        return self
+
+class Mmap_backend(Numpy_backend):
+    """
+    Backend storage for our "array of bits" using an mmap'd file.
+
+    The file starts with a 64-byte header holding the filter's parameters,
+    followed by the bits in the same layout as Numpy_backend. Every process
+    that opens the file maps the same pages of the OS page cache, so opening
+    is close to instant and nothing is copied. Bits set through one mapping
+    opened with mode 'r+' are visible through every other mapping; writers in
+    different processes must coordinate, since setting a bit rewrites its
+    whole byte.
+    """
+    magic = b'AMQBLOOM'
+    # magic, ideal_num_elements_n, error_rate_p, num_bits_m, num_probes_k,
+    # hasher name, hasher seed
+    header = struct.Struct('<8sQdQQ16sQ')
+
+    def __init__(self, num_bits, filename, mode='r+'):
+        if mode not in ('r', 'r+'):
+            raise ValueError("mode must be 'r' or 'r+'")
+        self.num_bits = num_bits
+        self.num_bytes = (self.num_bits + 7) // 8
+        self.mode = mode
+        self.file_ = open(filename, 'rb' if mode == 'r' else 'r+b')
+        try:
+            access = mmap.ACCESS_READ if mode == 'r' else mmap.ACCESS_WRITE
+            self.mmap = mmap.mmap(self.file_.fileno(), 0, access=access)
+        except (ValueError, OSError):
+            self.file_.close()
+            raise
+        if len(self.mmap) != self.header.size + self.num_bytes:
+            self.close()
+            raise ValueError('%s does not hold %d bits' % (filename, num_bits))
+        self.array_ = np.frombuffer(self.mmap, dtype=np.uint8,
+                                    count=self.num_bytes,
+                                    offset=self.header.size)
+
+    @classmethod
+    def create(cls, filename, bloom_filter):
+        """
+        Create (or overwrite) filename with an empty filter for bloom_filter
+        and return a read-write backend for it
+        """
+        hasher = bloom_filter.hasher
+        if utils.HASHERS.get(hasher.name) is not type(hasher):
+            raise ValueError('Only hashers registered in utils.HASHERS can be saved')
+        header = cls.header.pack(
+            cls.magic,
+            bloom_filter.ideal_num_elements_n,
+            bloom_filter.error_rate_p,
+            bloom_filter.num_bits_m,
+            bloom_filter.num_probes_k,
+            hasher.name.encode(),
+            hasher.seed,
+        )
+        with open(filename, 'wb') as file_:
+            file_.write(header)
+            # Extend with zeros; most file systems keep them sparse
+            file_.truncate(cls.header.size + (bloom_filter.num_bits_m + 7) // 8)
+        return cls(bloom_filter.num_bits_m, filename, mode='r+')
+
+    @classmethod
+    def read_header(cls, filename):
+        """Return the filter parameters stored at the start of filename"""
+        with open(filename, 'rb') as file_:
+            data = file_.read(cls.header.size)
+        if len(data) != cls.header.size or not data.startswith(cls.magic):
+            raise ValueError('%s is not a bloom filter file' % filename)
+        (_, ideal_num_elements_n, error_rate_p, num_bits_m, num_probes_k,
+         hasher_name, hasher_seed) = cls.header.unpack(data)
+        return {
+            'ideal_num_elements_n': ideal_num_elements_n,
+            'error_rate_p': error_rate_p,
+            'num_bits_m': num_bits_m,
+            'num_probes_k': num_probes_k,
+            'hasher': utils.HASHERS[hasher_name.rstrip(b'\0').decode()](hasher_seed),
+        }
+
+    def flush(self):
+        """Write modified pages back to the file"""
+        if self.mmap.closed or self.mode == 'r':
+            return
+        self.mmap.flush()
+
+    def close(self):
+        """Flush and unmap the file"""
+        if self.mmap.closed:
+            return
+        self.flush()
+        # The mapping can only be closed once no array refers to it
+        self.array_ = None
+        self.mmap.close()
+        self.file_.close()
 
-    seed1 = 42
-    seed2 = 97
+def get_filter_bitno_probes(bloom_filter, key):
+    """
+    Apply num_probes_k hash functions to key.
 
-    hash_value1 = mmh3.hash_bytes(key, seed=seed1)
-    hash_value2 = mmh3.hash_bytes(key, seed=seed2)
-    hash_int1 = int.from_bytes(hash_value1, byteorder='big', signed=True)
-    hash_int2 = int.from_bytes(hash_value2, byteorder='big', signed=True)
+    All probes are derived from a single 128-bit digest of the key by double
+    hashing its two 64-bit halves.
+    """
+    hashed_key = bloom_filter.hasher.hash(key)
 
     # Generate k hash functions by combining the two hash values
     for probeno in range(1, bloom_filter.num_probes_k + 1):
-        combined_hash = hash_int1 + probeno * hash_int2
-        bit_index = combined_hash % bloom_filter.num_bits_m
-        yield bit_index
+        yield hashed_key.probe(probeno, bloom_filter.num_bits_m)
+
+def get_filter_bitno_probes_many(bloom_filter, keys):
+    """
+    Vectorized counterpart of get_filter_bitno_probes.
+
+    Return a uint64 array of shape (len(keys), num_probes_k) holding the bit
+    numbers of every probe for every key.
+    """
+    return get_hashed_bitno_probes_many(bloom_filter, bloom_filter.hasher.hash_many(keys))
+
+def get_hashed_bitno_probes_many(bloom_filter, hashed_keys):
+    """
+    Probes of get_filter_bitno_probes_many for keys that are already hashed,
+    so filters sharing a hasher can share the hashing work.
+    """
+    # Broadcast the keys along the rows and the probes along the columns
+    hashed_keys = utils.HashedKey(hashed_keys.low[:, None], hashed_keys.high[:, None])
+    probenos = np.arange(1, bloom_filter.num_probes_k + 1, dtype=np.uint64)
+    return hashed_keys.probe(probenos, bloom_filter.num_bits_m)
 
 class BloomFilter(Filter):
     """Probabilistic set membership testing for large sets"""
+    # Number of keys hashed and probed together by add_many and contains_many
+    batch_size = 1 << 16
+
     def __init__(self,
                  max_elements=10000,
                  error_rate=0.1,
-                 probe_bitnoer=get_filter_bitno_probes):
+                 probe_bitnoer=get_filter_bitno_probes,
+                 hasher=None,
+                 backend=None,
+                 filename=None):
         # pylint: disable=R0913
         # R0913: We want a few arguments
+        # backend defaults to Array_backend; a filter with a filename always
+        # lives in an Mmap_backend, so the two cannot be combined
+        if backend is not None and filename is not None:
+            raise ValueError('backend and filename are mutually exclusive: '
+                             'a file-backed filter uses Mmap_backend')
         if max_elements <= 0:
             raise ValueError('ideal_num_elements_n must be > 0')
         if not (0 < error_rate < 1):
@@ -100,6 +334,38 @@ class BloomFilter(Filter):
         # error rate "guarantee" drops rapidly.
         self.ideal_num_elements_n = int(max_elements)
 
+        self._size_filter()
+        self.probe_bitnoer = probe_bitnoer
+        self.hasher = utils.get_hasher(hasher)
+        if filename is None:
+            self.backend = (backend or Array_backend)(self.num_bits_m)
+        else:
+            # Stored in a file that other processes can open
+            self.backend = Mmap_backend.create(filename, self)
+
+    @classmethod
+    def open(cls, filename, mode='r'):
+        """
+        Open a filter created with filename=..., without copying its bits.
+
+        mode 'r' maps the file read-only and 'r+' maps it read-write. The
+        filter uses the default probe_bitnoer of cls.
+        """
+        header = Mmap_backend.read_header(filename)
+        bloom_filter = cls(
+            max_elements=header['ideal_num_elements_n'],
+            error_rate=header['error_rate_p'],
+            hasher=header['hasher'],
+            backend=lambda num_bits: Mmap_backend(num_bits, filename, mode),
+        )
+        if (bloom_filter.num_bits_m != header['num_bits_m']
+                or bloom_filter.num_probes_k != header['num_probes_k']):
+            bloom_filter.close()
+            raise ValueError('%s was not created by %s' % (filename, cls.__name__))
+        return bloom_filter
+
+    def _size_filter(self):
+        """Set num_bits_m and num_probes_k for the target error rate"""
         numerator = (
             -1
             * self.ideal_num_elements_n
@@ -109,8 +375,6 @@ class BloomFilter(Filter):
         real_num_bits_m = numerator / denominator
         self.num_bits_m = int(math.ceil(real_num_bits_m))
 
-        self.backend = Array_backend(self.num_bits_m)
-
         # AKA num_offsetters
         # Verified against
         # https://en.wikipedia.org/wiki/Bloom_filter#Probability_of_false_positives
@@ -119,13 +383,13 @@ class BloomFilter(Filter):
             * math.log(2)
         )
         self.num_probes_k = int(math.ceil(real_num_probes_k))
-        self.probe_bitnoer = probe_bitnoer
 
     def __repr__(self):
         return (
-            'BloomFilter(ideal_num_elements_n=%d, error_rate_p=%f, '
+            '%s(ideal_num_elements_n=%d, error_rate_p=%f, '
             + 'num_bits_m=%d)'
         ) % (
+            type(self).__name__,
             self.ideal_num_elements_n,
             self.error_rate_p,
             self.num_bits_m,
@@ -136,6 +400,20 @@ class BloomFilter(Filter):
         for bitno in self.probe_bitnoer(self, key):
             self.backend.set(bitno)
 
+    def _get_bitno_probes_many(self, keys):
+        if self.probe_bitnoer is get_filter_bitno_probes:
+            return get_filter_bitno_probes_many(self, keys)
+        bitnos = [list(self.probe_bitnoer(self, key)) for key in keys]
+        return np.array(bitnos, dtype=np.uint64).reshape(-1, self.num_probes_k)
+
+    def add_many(self, keys):
+        """
+        Add a sequence or NumPy array of elements to the filter. Every backend
+        sets the bits of a whole batch in one vectorized pass.
+        """
+        for batch in utils.batches(keys, self.batch_size):
+            self.backend.set_many(self._get_bitno_probes_many(batch))
+
     def __iadd__(self, key):
         self.add(key)
         return self
@@ -146,12 +424,59 @@ class BloomFilter(Filter):
 
         Used in preparation for binary operations
         """
+        # Mmap_backend shares Numpy_backend's layout, hence the subclass test
+        backend, other_backend = type(self.backend), type(bloom_filter.backend)
         return (self.num_bits_m == bloom_filter.num_bits_m
                 and self.num_probes_k == bloom_filter.num_probes_k
-                and self.probe_bitnoer == bloom_filter.probe_bitnoer)
+                and self.probe_bitnoer == bloom_filter.probe_bitnoer
+                and self.hasher == bloom_filter.hasher
+                and (issubclass(backend, other_backend)
+                     or issubclass(other_backend, backend)))
+
+    def _check_template(self, bloom_filter):
+        if not self._match_template(bloom_filter):
+            raise ValueError('Mismatched bloom filters: %r and %r' % (self, bloom_filter))
+
+    def copy(self):
+        """Return an in-memory copy of the filter"""
+        bloom_filter = copy.copy(self)
+        bloom_filter.backend = self.backend.copy()
+        return bloom_filter
+
+    @classmethod
+    def merge(cls, bloom_filters):
+        """
+        Return the union of many bloom filters built with the same template,
+        computed in one pass over all of them
+        """
+        bloom_filters = list(bloom_filters)
+        if not bloom_filters:
+            raise ValueError('merge needs at least one bloom filter')
+        first = bloom_filters[0]
+        for bloom_filter in bloom_filters[1:]:
+            first._check_template(bloom_filter)
+        merged = first.copy()
+        merged.backend.union_many([bloom_filter.backend for bloom_filter in bloom_filters[1:]])
+        return merged
+
+    def fill_ratio(self):
+        """Fraction of the bits that are set"""
+        return self.backend.count_set_bits() / self.num_bits_m
+
+    def approx_len(self):
+        """
+        Estimate the number of distinct elements added, from the number of
+        bits set (Swamidass & Baldi, https://doi.org/10.1021/ci600358f)
+        """
+        num_set = self.backend.count_set_bits()
+        if num_set >= self.num_bits_m:
+            return math.inf
+        return (-self.num_bits_m / self.num_probes_k
+                * math.log(1 - num_set / self.num_bits_m))
 
     def union(self, bloom_filter):
         """Compute the set union of two bloom filters"""
+        self._check_template(bloom_filter)
         self.backend |= bloom_filter.backend
 
     def __ior__(self, bloom_filter):
@@ -160,6 +485,7 @@ class BloomFilter(Filter):
 
     def intersection(self, bloom_filter):
         """Compute the set intersection of two bloom filters"""
+        self._check_template(bloom_filter)
         self.backend &= bloom_filter.backend
 
     def __iand__(self, bloom_filter):
@@ -172,9 +498,35 @@ class BloomFilter(Filter):
                 return False
         return True
 
+    def contains_many(self, keys):
+        """
+        Test a sequence or NumPy array of elements for membership.
+
+        Return a boolean array with one entry per key.
+        """
+        results = [self.backend.are_set(self._get_bitno_probes_many(batch)).all(axis=1)
+                   for batch in utils.batches(keys, self.batch_size)]
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def flush(self):
+        """Write a file-backed filter's changes back to its file"""
+        if hasattr(self.backend, 'flush'):
+            self.backend.flush()
+
+    def close(self):
+        """Release a file-backed filter's file"""
+        if hasattr(self.backend, 'close'):
+            self.backend.close()
+
+    def __enter__(self):
+        return self
+
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
         self.backend = None
 
     def __del__(self):
-        if self.backend is not None:
+        if getattr(self, 'backend', None) is not None:
             self.backend = None
\ No newline at end of file
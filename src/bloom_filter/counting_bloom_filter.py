@@ -0,0 +1,229 @@
+"""
+Counting Bloom Filter: a Bloom filter with small counters instead of bits,
+so elements can be deleted
+"""
+
+import numpy as np
+import utils
+from .bloom_filter import BloomFilter, Numpy_backend, get_filter_bitno_probes
+
+# Largest value of a 4-bit counter. A counter that reaches it is saturated:
+# the true count is unknown, so it is never decremented again.
+MAX_COUNT = 15
+
+# Mmap_backend stores bits, so the file-backed API of BloomFilter is refused
+FILE_BACKED_MESSAGE = 'CountingBloomFilter cannot be file-backed: Mmap_backend stores bits, not counters'
+
+
+class Counter_backend(object):
+    """
+    Backend storage for an array of 4-bit saturating counters, packed two per
+    byte in a NumPy array. Counter number c lives in the low nibble of byte
+    c // 2 when c is even and in the high nibble when c is odd.
+
+    set and is_set make it a drop-in replacement for a bit array.
+    """
+
+    def __init__(self, num_counters):
+        self.num_bits = num_counters
+        self.num_bytes = (num_counters + 1) // 2
+        self.array_ = np.zeros(self.num_bytes, dtype=np.uint8)
+
+    def count(self, counterno):
+        """Return the value of counter number counterno"""
+        byteno, nibbleno = divmod(counterno, 2)
+        return (int(self.array_[byteno]) >> (4 * nibbleno)) & 0xf
+
+    def is_set(self, counterno):
+        """Return true iff counter number counterno is not zero"""
+        return self.count(counterno) != 0
+
+    def increment(self, counterno):
+        """Add one to counter number counterno, saturating at MAX_COUNT"""
+        if self.count(counterno) < MAX_COUNT:
+            byteno, nibbleno = divmod(counterno, 2)
+            self.array_[byteno] += 1 << (4 * nibbleno)
+
+    def decrement(self, counterno):
+        """Subtract one from counter number counterno unless it is zero or saturated"""
+        count = self.count(counterno)
+        if 0 < count < MAX_COUNT:
+            byteno, nibbleno = divmod(counterno, 2)
+            self.array_[byteno] -= 1 << (4 * nibbleno)
+
+    set = increment
+
+    def counts(self, counternos=None):
+        """
+        Return the values of the counters in the array counternos, or of
+        every counter if counternos is None
+        """
+        if counternos is None:
+            counts = np.empty(2 * self.num_bytes, dtype=np.uint8)
+            counts[0::2] = self.array_ & 0xf
+            counts[1::2] = self.array_ >> 4
+            return counts[:self.num_bits]
+        shifts = ((counternos & 1) * 4).astype(np.uint8)
+        return (self.array_[counternos >> 1] >> shifts) & 0xf
+
+    def are_set(self, counternos):
+        """Return a boolean array, true where the counter in counternos is not zero"""
+        return self.counts(counternos) != 0
+
+    def _add_many(self, counternos, sign):
+        counternos, occurrences = np.unique(counternos.ravel(), return_counts=True)
+        counts = self.counts(counternos).astype(np.int64)
+        if sign > 0:
+            deltas = np.minimum(counts + occurrences, MAX_COUNT) - counts
+        else:
+            deltas = np.where(counts == MAX_COUNT, 0, np.minimum(counts, occurrences))
+        shifts = ((counternos & 1) * 4).astype(np.int64)
+        # Two counters may share a byte; ufunc.at applies both updates
+        ufunc = np.add if sign > 0 else np.subtract
+        ufunc.at(self.array_, counternos >> 1, (deltas << shifts).astype(np.uint8))
+
+    def increment_many(self, counternos):
+        """Add one to every counter in the array counternos, once per occurrence"""
+        self._add_many(counternos, 1)
+
+    def decrement_many(self, counternos):
+        """Subtract one from every counter in the array counternos, once per occurrence"""
+        self._add_many(counternos, -1)
+
+    set_many = increment_many
+
+    def count_set_bits(self):
+        """Return the number of counters that are not zero"""
+        return int(np.count_nonzero(self.counts()))
+
+    def copy(self):
+        """Return a new backend holding the same counters"""
+        backend = Counter_backend(self.num_bits)
+        backend.array_[:] = self.array_
+        return backend
+
+    def union_many(self, others):
+        """Add the counters of every backend in others"""
+        for other in others:
+            self |= other
+
+    def _store(self, counts):
+        self.array_[:] = 0
+        self.array_ |= counts[0::2]
+        self.array_[:len(counts[1::2])] |= counts[1::2] << 4
+
+    def __iand__(self, other):
+        assert self.num_bits == other.num_bits
+
+        self._store(np.minimum(self.counts(), other.counts()))
+
+        return self
+
+    def __ior__(self, other):
+        assert self.num_bits == other.num_bits
+
+        counts = self.counts().astype(np.int64) + other.counts()
+        self._store(np.minimum(counts, MAX_COUNT).astype(np.uint8))
+
+        return self
+
+
+class CountingBloomFilter(BloomFilter):
+    """
+    Bloom filter that supports deleting elements.
+
+    Every bit of a BloomFilter becomes a 4-bit counter, so the filter takes
+    four times the memory of a BloomFilter with the same parameters. Union
+    adds counters and intersection takes their minimum.
+    """
+
+    def __init__(self,
+                 max_elements=10000,
+                 error_rate=0.1,
+                 probe_bitnoer=get_filter_bitno_probes,
+                 hasher=None,
+                 filename=None):
+        # pylint: disable=R0913
+        if filename is not None:
+            raise NotImplementedError(FILE_BACKED_MESSAGE)
+        super().__init__(max_elements=max_elements,
+                         error_rate=error_rate,
+                         probe_bitnoer=probe_bitnoer,
+                         hasher=hasher,
+                         backend=Counter_backend)
+
+    @classmethod
+    def open(cls, filename, mode='r'):
+        """Not supported: counting filters cannot be file-backed"""
+        raise NotImplementedError(FILE_BACKED_MESSAGE)
+
+    def delete(self, key):
+        """
+        Delete an element from the filter.
+
+        Only delete elements that were added: deleting an element that
+        merely looks present decrements counters of other elements.
+
+        :return: True, if key was found and deleted; False, otherwise.
+        """
+        bitnos = list(self.probe_bitnoer(self, key))
+        if not all(self.backend.is_set(bitno) for bitno in bitnos):
+            return False
+        for bitno in bitnos:
+            self.backend.decrement(bitno)
+        return True
+
+    def delete_many(self, keys):
+        """
+        Delete a sequence or NumPy array of elements from the filter.
+
+        A key repeated in a batch is deleted only as many times as its
+        counters allow, as repeated calls to delete would.
+
+        :return: Boolean array, true where the key was found and deleted.
+        """
+        deleted = []
+        for batch in utils.batches(keys, self.batch_size):
+            bitnos = self._get_bitno_probes_many(batch)
+            found = self._deletable(bitnos)
+            self.backend.decrement_many(bitnos[found])
+            deleted.append(found)
+        if not deleted:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(deleted)
+
+    def _deletable(self, bitnos):
+        """
+        Boolean array, true where the key with the counters in that row of
+        bitnos would be found by delete after the earlier rows were deleted.
+        Each occurrence of a key decrements its counters, so the n-th copy of
+        a key is found only if every counter holds more than n - 1 decrements.
+        """
+        key_bitnos, inverse = np.unique(np.sort(bitnos, axis=1), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        # A counter probed twice by one key is decremented twice per delete
+        multiplicity = (key_bitnos[:, :, None] == key_bitnos[:, None, :]).sum(axis=2)
+        counts = self.backend.counts(key_bitnos).astype(np.int64)
+        deletions = np.where(counts == MAX_COUNT, len(bitnos), -(-counts // multiplicity))
+        allowed = deletions.min(axis=1)
+        # Rank of every occurrence among the copies of its key in the batch
+        order = np.argsort(inverse, kind='stable')
+        grouped = inverse[order]
+        ranks = np.empty(len(inverse), dtype=np.int64)
+        ranks[order] = np.arange(len(inverse)) - np.searchsorted(grouped, grouped)
+        return ranks < allowed[inverse]
+
+    def to_bloom_filter(self):
+        """
+        Return a plain BloomFilter holding the same elements, with a bit set
+        wherever a counter is not zero. It uses a quarter of the memory but
+        does not support deletion.
+        """
+        bloom_filter = BloomFilter(max_elements=self.ideal_num_elements_n,
+                                   error_rate=self.error_rate_p,
+                                   probe_bitnoer=self.probe_bitnoer,
+                                   hasher=self.hasher,
+                                   backend=Numpy_backend)
+        bits = np.packbits(self.backend.counts() != 0, bitorder='little')
+        bloom_filter.backend.array_[:] = bits
+        return bloom_filter
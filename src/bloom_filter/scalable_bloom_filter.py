@@ -0,0 +1,185 @@
+"""
+Scalable Bloom Filter: a Bloom filter that grows with the number of elements,
+from https://doi.org/10.1016/j.ipl.2006.10.007
+"""
+
+import math
+import numpy as np
+import utils
+from filter import Filter
+from .bloom_filter import BloomFilter, Array_backend, get_hashed_bitno_probes_many
+
+
+class ScalableBloomFilter(Filter):
+    """
+    Chain of BloomFilter stages that grows as elements are added.
+
+    Each stage holds growth_factor times as many elements as the one before
+    it, with an error rate tightening_ratio times lower. Stage i is built with
+    error_rate * (1 - tightening_ratio) * tightening_ratio ** i, so the
+    compound error rate stays below error_rate however many stages are added.
+    """
+
+    def __init__(self,
+                 max_elements=10000,
+                 error_rate=0.1,
+                 growth_factor=2,
+                 tightening_ratio=0.9,
+                 hasher=None,
+                 backend=Array_backend):
+        """
+        Initialize ScalableBloomFilter object.
+
+        :param max_elements: Number of elements of the first stage
+        :param error_rate: Bound on the compound error rate
+        :param growth_factor: Capacity of a stage relative to the previous one
+        :param tightening_ratio: Error rate of a stage relative to the previous one
+        :param hasher: Hasher for the keys, shared by every stage
+        :param backend: Backend class of the stages
+        """
+        # pylint: disable=R0913
+        if max_elements <= 0:
+            raise ValueError('max_elements must be > 0')
+        if not (0 < error_rate < 1):
+            raise ValueError('error_rate must be between 0 and 1 exclusive')
+        if growth_factor < 1:
+            raise ValueError('growth_factor must be >= 1')
+        if not (0 < tightening_ratio < 1):
+            raise ValueError('tightening_ratio must be between 0 and 1 exclusive')
+
+        self.initial_capacity = int(max_elements)
+        self.error_rate = error_rate
+        self.growth_factor = growth_factor
+        self.tightening_ratio = tightening_ratio
+        self.hasher = utils.get_hasher(hasher)
+        self.backend_class = backend
+        self.filters = []
+        # Number of elements added to each stage
+        self.stage_counts = []
+        self._add_stage()
+
+    def __repr__(self):
+        return ('<ScalableBloomFilter: initial_capacity=%d, error_rate=%f, '
+                'stages=%d, size=%d>') % (
+            self.initial_capacity,
+            self.error_rate,
+            len(self.filters),
+            len(self),
+        )
+
+    def __len__(self):
+        return sum(self.stage_counts)
+
+    def _add_stage(self):
+        stageno = len(self.filters)
+        capacity = math.ceil(self.initial_capacity * self.growth_factor ** stageno)
+        stage_error_rate = (self.error_rate * (1 - self.tightening_ratio)
+                            * self.tightening_ratio ** stageno)
+        self.filters.append(BloomFilter(max_elements=capacity,
+                                        error_rate=stage_error_rate,
+                                        hasher=self.hasher,
+                                        backend=self.backend_class))
+        self.stage_counts.append(0)
+
+    def _capacity_left(self):
+        """Number of elements the newest stage can still take"""
+        return self.filters[-1].ideal_num_elements_n - self.stage_counts[-1]
+
+    def compound_error_rate(self):
+        """Upper bound on the false positive rate of the current stages"""
+        correct = 1.0
+        for stage in self.filters:
+            correct *= 1 - stage.error_rate_p
+        return 1 - correct
+
+    @staticmethod
+    def _stage_contains(stage, hashed_key):
+        for probeno in range(1, stage.num_probes_k + 1):
+            if not stage.backend.is_set(hashed_key.probe(probeno, stage.num_bits_m)):
+                return False
+        return True
+
+    def _contains_hashed(self, hashed_key):
+        # Newest stages first: they are the largest and hold the latest keys
+        for stage in reversed(self.filters):
+            if self._stage_contains(stage, hashed_key):
+                return True
+        return False
+
+    def add(self, key):
+        """
+        Add an element to the filter, adding a stage when the newest is full.
+
+        :return: True if the key was added; False if it was already present.
+        """
+        hashed_key = self.hasher.hash(key)
+        if self._contains_hashed(hashed_key):
+            return False
+        if self._capacity_left() <= 0:
+            self._add_stage()
+        stage = self.filters[-1]
+        for probeno in range(1, stage.num_probes_k + 1):
+            stage.backend.set(hashed_key.probe(probeno, stage.num_bits_m))
+        self.stage_counts[-1] += 1
+        return True
+
+    def __iadd__(self, key):
+        self.add(key)
+        return self
+
+    def _contains_hashed_many(self, hashed_keys):
+        found = np.zeros(len(hashed_keys), dtype=bool)
+        for stage in reversed(self.filters):
+            unknown = np.flatnonzero(~found)
+            if len(unknown) == 0:
+                break
+            remaining = utils.HashedKey(hashed_keys.low[unknown], hashed_keys.high[unknown])
+            bitnos = get_hashed_bitno_probes_many(stage, remaining)
+            found[unknown] = stage.backend.are_set(bitnos).all(axis=1)
+        return found
+
+    def add_many(self, keys):
+        """
+        Add a sequence or NumPy array of elements to the filter.
+
+        Keys that are already present, or repeated within the batch, are
+        skipped, and the rest fill the newest stage before a new one is added.
+        """
+        for batch in utils.batches(keys, BloomFilter.batch_size):
+            hashed_keys = self.hasher.hash_many(batch)
+            # First occurrence of every distinct digest, in batch order
+            _, first = np.unique(np.stack((hashed_keys.low, hashed_keys.high), axis=1),
+                                 axis=0, return_index=True)
+            first = np.sort(first)
+            new = first[~self._contains_hashed_many(
+                utils.HashedKey(hashed_keys.low[first], hashed_keys.high[first]))]
+            while len(new):
+                if self._capacity_left() <= 0:
+                    self._add_stage()
+                taken, new = new[:self._capacity_left()], new[self._capacity_left():]
+                stage = self.filters[-1]
+                stage_keys = utils.HashedKey(hashed_keys.low[taken], hashed_keys.high[taken])
+                stage.backend.set_many(get_hashed_bitno_probes_many(stage, stage_keys))
+                self.stage_counts[-1] += len(taken)
+
+    def __contains__(self, key):
+        return self._contains_hashed(self.hasher.hash(key))
+
+    def contains(self, key):
+        """
+        Check whether the given element is contained in the filter.
+        """
+        return key in self
+
+    def contains_many(self, keys):
+        """
+        Test a sequence or NumPy array of elements for membership.
+
+        Every key is hashed once; each stage, newest first, only tests the
+        keys no newer stage contains.
+        """
+        results = [self._contains_hashed_many(self.hasher.hash_many(batch))
+                   for batch in utils.batches(keys, BloomFilter.batch_size)]
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
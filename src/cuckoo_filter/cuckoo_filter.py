@@ -1,37 +1,93 @@
 """
 Cuckoo Filter
 """
+import collections
 import os
 import random
 import math
+import numpy as np
 import utils
 from filter import Filter
 
+# Fewest fingerprint bits an auto-growing filter keeps out of the bucket
+# index. With fewer, fingerprints sharing a bucket have too few distinct
+# alternate buckets and inserts fail at low load.
+MIN_FINGERPRINT_BITS = 4
+
 class CuckooFilter(Filter):
     """
     Cuckoo Filter class.
 
     Implements insert, delete and contains operations for the filter.
+
+    When an insert runs out of displacements, the fingerprint left without a
+    bucket goes to a small victim stash instead of being lost. With
+    auto_grow, the filter doubles its number of buckets instead of filling
+    up. Each doubling moves one fingerprint bit into the bucket index, so
+    stored fingerprints are redistributed without the original keys, at the
+    price of doubling the false positive rate.
     """
-    
-    def __init__(self, max_elements, error_rate = 0.01, bucket_size=4, max_displacements=500):
+    # Number of keys hashed and looked up together by the batch operations
+    batch_size = 1 << 16
+    # Load factor at which an auto-growing filter starts to double
+    growth_load_factor = 0.9
+    # Number of buckets moved to the doubled table by every insert while
+    # the filter grows
+    growth_step = 16
+    # Longest chain of moves the breadth-first eviction looks for
+    bfs_max_depth = 5
+
+    def __init__(self, max_elements, error_rate = 0.01, bucket_size=4, max_displacements=500, hasher=None,
+                 semi_sort=False, stash_size=4, auto_grow=False, eviction='random'):
         """
         Initialize CuckooFilter object.
 
         :param max_elements: Size of the Cuckoo Filter
         :param error_rate: Maximum desired error rate
         :param bucket_size: Number of entries in a bucket
+        :param max_displacements: Maximum number of evictions per insert
+        :param hasher: Hasher for the keys, see utils.get_hasher
+        :param semi_sort: Compress the buckets with semi-sorting, saving one
+        bit per fingerprint at some lookup cost. Requires bucket_size=4.
+        :param stash_size: Number of fingerprints the victim stash holds
+        :param auto_grow: Double the number of buckets when the filter fills
+        up instead of failing inserts
+        :param eviction: 'random' to make room with a random walk of at most
+        max_displacements swaps, or 'bfs' to search for the shortest chain
+        of at most bfs_max_depth moves before moving anything
         """
+        if eviction not in ('random', 'bfs'):
+            raise ValueError('eviction must be random or bfs')
 
         self.max_elements = math.ceil(max_elements)
         # set self.num_buckets to the nearest power of 2 greater than or equal to self.max_elements/bucket_size
         self.num_buckets = 2 ** math.ceil(math.log2(math.ceil(max_elements / bucket_size)))
+        self.initial_num_buckets = self.num_buckets
+        self.num_doublings = 0
         self.bucket_size = bucket_size
         # fingerprint_size in bits, pg 8 of https://www.cs.cmu.edu/~dga/papers/cuckoo-conext2014.pdf
         self.fingerprint_size = math.ceil(math.log2(1/error_rate) + math.log2(2 * bucket_size))
+        # Offset to the alternate bucket for every possible fingerprint, so
+        # finding it is one table read instead of hashing the fingerprint.
+        # Offsets stay below the initial number of buckets, so a fingerprint
+        # and its alternate agree on every index bit added by doubling.
+        self.alternate_offsets = utils.alternate_offset_table(self.fingerprint_size, self.num_buckets)
         self.max_displacements = max_displacements
-        self.buckets = [utils.Bucket(size=bucket_size)
-                        for _ in range(self.num_buckets)]
+        self.eviction = eviction
+        # Number of inserts by number of fingerprints moved to make room
+        self.eviction_path_lengths = collections.Counter()
+        self.hasher = utils.get_hasher(hasher)
+        # Fingerprints live in one contiguous array, semi-sorted on request
+        self.semi_sort = semi_sort
+        self.buckets = self._new_buckets(self.num_buckets)
+        # (bucket index, fingerprint) pairs that found no room in the table
+        self.stash = []
+        self.stash_size = stash_size
+        self.auto_grow = auto_grow
+        # Table of twice as many buckets while the filter grows, and the
+        # number of buckets already moved into it
+        self._next_buckets = None
+        self._num_migrated = 0
         self.size = 0
         self.error_rate = error_rate
 
@@ -46,14 +102,99 @@ class CuckooFilter(Filter):
     def __contains__(self, item):
         return self.contains(item)
 
-    def _get_index(self, item):
-        index = utils.hash_code(item, self.num_buckets)
-        return index
+    def _new_buckets(self, num_buckets):
+        bucket_array = utils.SemiSortedBucketArray if self.semi_sort else utils.BucketArray
+        return bucket_array(num_buckets, self.bucket_size, self.fingerprint_size)
+
+    def _get_index(self, index, fingerprint):
+        """
+        First bucket index of a key, from its index among the initial buckets
+        and one fingerprint bit per doubling.
+        """
+        if not self.num_doublings:
+            return index
+        return index + self.initial_num_buckets * (fingerprint & ((1 << self.num_doublings) - 1))
+
+    def _get_fingerprint_and_indices(self, item):
+        """
+        Hash the item once and derive its fingerprint and both candidate
+        bucket indices from the digest.
+        """
+        hashed_key = self.hasher.hash(item)
+        fingerprint = hashed_key.nonzero_fingerprint(self.fingerprint_size)
+        i = self._get_index(hashed_key.index(self.initial_num_buckets), fingerprint)
+        j = self._get_alternate_index(i, fingerprint)
+        return fingerprint, i, j
 
     def _get_alternate_index(self, index, fingerprint):
-        alt_index = (index ^ utils.hash_code(fingerprint, self.num_buckets)) 
+        if self.alternate_offsets is None:
+            return index ^ utils.alternate_offset(fingerprint, self.initial_num_buckets)
+        alt_index = index ^ int(self.alternate_offsets[fingerprint])
         return alt_index
 
+    def _get_fingerprints_and_indices_many(self, items):
+        """
+        Vectorized counterpart of _get_fingerprint_and_indices.
+        :return: uint64 arrays of fingerprints, first and alternate indices
+        """
+        hashed_keys = self.hasher.hash_many(items)
+        fingerprints = hashed_keys.nonzero_fingerprint(self.fingerprint_size)
+        i = self._get_index(hashed_keys.index(self.initial_num_buckets), fingerprints)
+        if self.alternate_offsets is None:
+            offsets = utils.alternate_offset_many(fingerprints, self.initial_num_buckets)
+        else:
+            offsets = self.alternate_offsets[fingerprints].astype(np.uint64)
+        return fingerprints, i, i ^ offsets
+
+    def _locate(self, index, fingerprint):
+        """
+        Bucket array and bucket number that hold bucket index for this
+        fingerprint: while the filter grows, buckets already moved live in
+        the doubled table.
+        """
+        if self._next_buckets is not None and index < self._num_migrated:
+            return self._next_buckets, index + self.num_buckets * ((fingerprint >> self.num_doublings) & 1)
+        return self.buckets, index
+
+    def _locate_many(self, indices, fingerprints):
+        """
+        Vectorized counterpart of _locate.
+        :return: Boolean array, true where the bucket was already moved to
+        the doubled table, and the bucket numbers in the doubled table
+        """
+        moved = indices < self._num_migrated
+        high = (fingerprints >> np.uint64(self.num_doublings)) & np.uint64(1)
+        return moved, indices + np.uint64(self.num_buckets) * high
+
+    def _apply_many(self, operation, indices, fingerprints):
+        """
+        Call the bucket array method named operation for every bucket index
+        and fingerprint, in whichever table holds the bucket while the
+        filter grows.
+        :return: Boolean array returned by operation
+        """
+        if self._next_buckets is None:
+            return getattr(self.buckets, operation)(indices, fingerprints)
+        moved, doubled = self._locate_many(indices, fingerprints)
+        results = np.zeros(len(indices), dtype=bool)
+        rest = np.flatnonzero(~moved)
+        results[rest] = getattr(self.buckets, operation)(indices[rest], fingerprints[rest])
+        moved = np.flatnonzero(moved)
+        results[moved] = getattr(self._next_buckets, operation)(doubled[moved], fingerprints[moved])
+        return results
+
+    def _insert_into(self, index, fingerprint):
+        buckets, index = self._locate(index, fingerprint)
+        return buckets.insert(index, fingerprint)
+
+    def _contained_in(self, index, fingerprint):
+        buckets, index = self._locate(index, fingerprint)
+        return buckets.contains(index, fingerprint)
+
+    def _delete_from(self, index, fingerprint):
+        buckets, index = self._locate(index, fingerprint)
+        return buckets.delete(index, fingerprint)
+
     def add(self, item):
         """
         Add an item into the filter.
@@ -62,25 +203,75 @@ class CuckooFilter(Filter):
         :return: True if insert is successful; CuckooFilterFullException if
         filter is full.
         """
-        fingerprint = utils.fingerprint(item, self.fingerprint_size)
-        i = self._get_index(item)
-        j = self._get_alternate_index(i, fingerprint)
+        if self.auto_grow:
+            self._grow_step()
+        fingerprint, i, j = self._get_fingerprint_and_indices(item)
+        return self._insert(fingerprint, i, j)
 
-        if self.buckets[i].insert(fingerprint) or self.buckets[j].insert(fingerprint):
+    def _insert(self, fingerprint, i, j):
+        if self._insert_into(i, fingerprint) or self._insert_into(j, fingerprint):
             self.size += 1
+            self.eviction_path_lengths[0] += 1
             return True
 
+        # Evicting could leave a fingerprint with nowhere to go
+        if len(self.stash) >= self.stash_size:
+            raise Exception('Insert operation failed. Filter is full.')
+
+        # The search runs on a single table, so it waits while the filter grows
+        if self.eviction == 'bfs' and self._next_buckets is None:
+            homeless = self._evict_bfs(fingerprint, i, j)
+        else:
+            homeless = self._evict_random_walk(fingerprint, i, j)
+        if homeless is not None:
+            # Keep the fingerprint left without a bucket instead of losing it
+            self.stash.append(homeless)
+        self.size += 1
+        return True
+
+    def _evict_random_walk(self, fingerprint, i, j):
+        """
+        Swap fingerprints along a random walk until the evicted one fits in
+        its alternate bucket.
+        :return: (bucket index, fingerprint) left without a bucket after
+        max_displacements swaps, or None
+        """
         eviction_index = random.choice([i, j])
         f = fingerprint
-        for _ in range(self.max_displacements):
-            f = self.buckets[eviction_index].swap(f)
+        for num_moves in range(1, self.max_displacements + 1):
+            buckets, index = self._locate(eviction_index, f)
+            f = buckets.swap(index, f)
             eviction_index = self._get_alternate_index(eviction_index, f)
-            if self.buckets[eviction_index].insert(f):
-                self.size += 1
-                return True
+            if self._insert_into(eviction_index, f):
+                self.eviction_path_lengths[num_moves] += 1
+                return None
+        return eviction_index, f
 
-        # Filter is full
-        raise Exception('Insert operation failed. Filter is full.')
+    def _evict_bfs(self, fingerprint, i, j):
+        """
+        Search breadth first for the shortest chain of at most bfs_max_depth
+        moves that frees a slot in bucket i or j, then apply it.
+        :return: (bucket index, fingerprint) if there is no such chain, or None
+        """
+        buckets = self.buckets
+        path = utils.find_eviction_path([i, j], buckets.bucket, self._get_alternate_index,
+                                        lambda index: not buckets.is_full(index),
+                                        self.bfs_max_depth)
+        if path is None:
+            return i, fingerprint
+        for index, f, alternate in reversed(path):
+            buckets.delete(index, f)
+            buckets.insert(alternate, f)
+        buckets.insert(path[0][0], fingerprint)
+        self.eviction_path_lengths[len(path)] += 1
+        return None
+
+    def _drain_stash(self):
+        """Move stashed fingerprints back into the table where there is room"""
+        for index, fingerprint in list(self.stash):
+            if self._insert_into(index, fingerprint) or \
+                    self._insert_into(self._get_alternate_index(index, fingerprint), fingerprint):
+                self.stash.remove((index, fingerprint))
 
     def contains(self, item):
         """
@@ -89,11 +280,11 @@ class CuckooFilter(Filter):
         :param item: Item to check its presence in the filter.
         :return: True, if item is in the filter; False, otherwise.
         """
-        fingerprint = utils.fingerprint(item, self.fingerprint_size)
-        i = self._get_index(item)
-        j = self._get_alternate_index(i, fingerprint)
+        fingerprint, i, j = self._get_fingerprint_and_indices(item)
 
-        return fingerprint in self.buckets[i] or fingerprint in self.buckets[j]
+        if self._contained_in(i, fingerprint) or self._contained_in(j, fingerprint):
+            return True
+        return bool(self.stash) and ((i, fingerprint) in self.stash or (j, fingerprint) in self.stash)
 
     def delete(self, item):
         """
@@ -106,10 +297,164 @@ class CuckooFilter(Filter):
         :param item: Item to delete from the filter.
         :return: True, if item is found and deleted; False, otherwise.
         """
-        fingerprint = utils.fingerprint(item, size=self.fingerprint_size)
-        i = self._get_index(item)
-        j = self._get_alternate_index(i, fingerprint)
-        if self.buckets[i].delete(fingerprint) or self.buckets[j].delete(fingerprint):
+        fingerprint, i, j = self._get_fingerprint_and_indices(item)
+        if self._delete_from(i, fingerprint) or self._delete_from(j, fingerprint):
             self.size -= 1
+            if self.stash:
+                self._drain_stash()
             return True
-        return False
\ No newline at end of file
+        for entry in ((i, fingerprint), (j, fingerprint)):
+            if entry in self.stash:
+                self.stash.remove(entry)
+                self.size -= 1
+                return True
+        return False
+
+    def _can_grow(self):
+        return self.fingerprint_size - self.num_doublings > MIN_FINGERPRINT_BITS
+
+    def _grow_step(self, num_inserts=1):
+        """
+        Amortized growth ahead of num_inserts inserts: start doubling when
+        the load factor would reach growth_load_factor and move growth_step
+        buckets per insert until done, doubling again if the inserts still
+        do not fit. A full stash finishes the doubling at once.
+        """
+        budget = self.growth_step * num_inserts
+        while budget > 0:
+            if self._next_buckets is None:
+                if len(self.stash) >= self.stash_size:
+                    if self._can_grow():
+                        self.grow()
+                    return
+                if self.size + num_inserts - 1 < self.growth_load_factor * self.num_buckets * self.bucket_size \
+                        or not self._can_grow():
+                    return
+                self._next_buckets = self._new_buckets(2 * self.num_buckets)
+                self._num_migrated = 0
+            moved = self.num_buckets - self._num_migrated
+            if len(self.stash) < self.stash_size:
+                moved = min(budget, moved)
+            self._migrate(moved)
+            budget -= moved
+
+    def grow(self):
+        """
+        Double the number of buckets now, rehashing the stored fingerprints
+        into the larger table.
+
+        Bucket b of the current table splits into buckets b and
+        b + num_buckets, depending on the next unused fingerprint bit.
+        """
+        if self._next_buckets is None:
+            if not self._can_grow():
+                raise ValueError('No fingerprint bits left to grow the filter')
+            self._next_buckets = self._new_buckets(2 * self.num_buckets)
+            self._num_migrated = 0
+        self._migrate(self.num_buckets)
+
+    def _migrate(self, num_buckets):
+        """Move the next num_buckets buckets into the doubled table"""
+        start = self._num_migrated
+        stop = min(start + num_buckets, self.num_buckets)
+        indices = np.arange(start, stop)
+        slots = self.buckets.slots_many(indices)
+        high = ((slots >> self.num_doublings) & 1).astype(bool)
+        self._next_buckets.store_many(indices, np.where(high, 0, slots))
+        self._next_buckets.store_many(indices + self.num_buckets, np.where(high, slots, 0))
+        self._num_migrated = stop
+        if stop == self.num_buckets:
+            self._finish_growth()
+
+    def _finish_growth(self):
+        num_buckets = self.num_buckets
+        self.stash = [(index + num_buckets * ((fingerprint >> self.num_doublings) & 1), fingerprint)
+                      for index, fingerprint in self.stash]
+        self.buckets = self._next_buckets
+        self._next_buckets = None
+        self.num_buckets *= 2
+        self.num_doublings += 1
+        self.max_elements *= 2
+        self._drain_stash()
+
+    def add_many(self, items):
+        """
+        Add a sequence or NumPy array of items into the filter.
+
+        Items whose first or alternate bucket has room are placed in one
+        vectorized pass; only the rest go through the eviction loop.
+        """
+        for batch in utils.batches(items, self.batch_size):
+            if self.auto_grow:
+                # Growth advances as far as len(batch) calls to add would take it
+                self._grow_step(len(batch))
+            fingerprints, i, j = self._get_fingerprints_and_indices_many(batch)
+            inserted = self._apply_many('insert_many', i, fingerprints)
+            rest = np.flatnonzero(~inserted)
+            inserted[rest] = self._apply_many('insert_many', j[rest], fingerprints[rest])
+            self.size += int(np.count_nonzero(inserted))
+            self.eviction_path_lengths[0] += int(np.count_nonzero(inserted))
+            rest = np.flatnonzero(~inserted)
+            # Indices of the leftovers change if the filter grows meanwhile
+            initial_indices = (i[rest] % self.initial_num_buckets).tolist()
+            for fingerprint, index in zip(fingerprints[rest].tolist(), initial_indices):
+                if self.auto_grow:
+                    self._grow_step()
+                first = self._get_index(index, fingerprint)
+                self._insert(fingerprint, first, self._get_alternate_index(first, fingerprint))
+
+    def _stash_matches(self, fingerprints, i, j):
+        """Boolean array, true where the stash holds the fingerprint for bucket i or j"""
+        matches = np.zeros(len(fingerprints), dtype=bool)
+        for index, fingerprint in self.stash:
+            matches |= (fingerprints == fingerprint) & ((i == index) | (j == index))
+        return matches
+
+    def contains_many(self, items):
+        """
+        Check a sequence or NumPy array of items for membership.
+
+        :return: Boolean array, true where the item is in the filter.
+        """
+        results = []
+        for batch in utils.batches(items, self.batch_size):
+            fingerprints, i, j = self._get_fingerprints_and_indices_many(batch)
+            found = self._apply_many('contains_many', i, fingerprints)
+            rest = np.flatnonzero(~found)
+            found[rest] = self._apply_many('contains_many', j[rest], fingerprints[rest])
+            if self.stash:
+                found |= self._stash_matches(fingerprints, i, j)
+            results.append(found)
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def delete_many(self, items):
+        """
+        Delete a sequence or NumPy array of items from the filter. The same
+        caveat as for delete applies to every item.
+
+        :return: Boolean array, true where the item was found and deleted.
+        """
+        results = []
+        for batch in utils.batches(items, self.batch_size):
+            fingerprints, i, j = self._get_fingerprints_and_indices_many(batch)
+            deleted = self._apply_many('delete_many', i, fingerprints)
+            rest = np.flatnonzero(~deleted)
+            deleted[rest] = self._apply_many('delete_many', j[rest], fingerprints[rest])
+            if self.stash:
+                rest = np.flatnonzero(~deleted & self._stash_matches(fingerprints, i, j))
+                for n, fingerprint, first, alternate in zip(rest.tolist(), fingerprints[rest].tolist(),
+                                                            i[rest].tolist(), j[rest].tolist()):
+                    for entry in ((first, fingerprint), (alternate, fingerprint)):
+                        if entry in self.stash:
+                            self.stash.remove(entry)
+                            deleted[n] = True
+                            break
+            self.size -= int(np.count_nonzero(deleted))
+            if self.stash and deleted.any():
+                self._drain_stash()
+            results.append(deleted)
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from .quotient_filter import QuotientFilter
+
+__version__ = '1.0.0'
+
+__all__ = [
+    'QuotientFilter'
+]
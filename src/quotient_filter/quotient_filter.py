@@ -0,0 +1,411 @@
+"""
+Quotient Filter
+"""
+import copy
+import math
+import numpy as np
+import utils
+from filter import Filter
+
+# Metadata bits in the low bits of every slot, below the remainder
+OCCUPIED = 1
+CONTINUATION = 2
+SHIFTED = 4
+METADATA_BITS = 3
+METADATA_MASK = (1 << METADATA_BITS) - 1
+
+
+class QuotientFilter(Filter):
+    """
+    Quotient filter from https://www.vldb.org/pvldb/vol5/p1627_michaelabender_vldb2012.pdf
+
+    The fingerprint of a key is split into a quotient, the key's canonical
+    slot, and a remainder stored in the table. The remainders of a quotient
+    form a sorted run, runs are stored in quotient order, and a run pushed
+    past its canonical slot by earlier runs is shifted to the right, so a
+    lookup scans a short cluster of consecutive slots. Three metadata bits
+    per slot tell the runs apart:
+    - occupied: some stored fingerprint has this slot as quotient
+    - continuation: the slot continues the run of the previous slot
+    - shifted: the remainder is not in its canonical slot
+
+    Slots are packed in a NumPy array, remainder above the metadata bits.
+    Reading the table in slot order gives the stored fingerprints sorted,
+    so two filters merge in a linear scan over both, and a filter doubles
+    without the original keys by moving the top remainder bit into the
+    quotient, at the price of doubling the false positive rate.
+    """
+    # Number of keys hashed and looked up together by the batch operations
+    batch_size = 1 << 16
+    # Load factor the filter is sized for, and at which an auto-growing
+    # filter doubles
+    growth_load_factor = 0.75
+
+    def __init__(self, max_elements, error_rate=0.01, hasher=None, auto_grow=False, fingerprint_size=None):
+        """
+        :param max_elements: Number of keys the filter holds below
+        growth_load_factor
+        :param error_rate: Maximum desired error rate
+        :param hasher: Hasher for the keys, see utils.get_hasher
+        :param auto_grow: Double the number of slots when the filter reaches
+        growth_load_factor instead of failing inserts once full
+        :param fingerprint_size: Quotient and remainder bits together, only
+        filters of equal fingerprint size merge; defaults to the quotient bits
+        for max_elements plus the remainder bits for error_rate
+        """
+        self.max_elements = math.ceil(max_elements)
+        self.error_rate = error_rate
+        self.quotient_bits = max(1, math.ceil(math.log2(max(max_elements, 1) / self.growth_load_factor)))
+        if fingerprint_size is None:
+            # A lookup matches a stranger with probability load * 2^-remainder_bits
+            fingerprint_size = self.quotient_bits + max(1, math.ceil(math.log2(1 / error_rate)))
+        if not self.quotient_bits < fingerprint_size <= 64:
+            raise ValueError('Fingerprint size must be between %d and 64 bits, not %d' % (
+                self.quotient_bits + 1, fingerprint_size))
+        self.remainder_bits = fingerprint_size - self.quotient_bits
+        # Kept when the filter doubles, a remainder bit becoming a quotient bit
+        self.fingerprint_size = fingerprint_size
+        self.hasher = utils.get_hasher(hasher)
+        self.auto_grow = auto_grow
+        self.slots = self._new_slots(1 << self.quotient_bits, self.remainder_bits)
+        self.size = 0
+
+    def __repr__(self):
+        return '<QuotientFilter: num_slots=%d, size=%d, remainder_bits=%d>' % (
+            self.num_slots, self.size, self.remainder_bits)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, item):
+        return self.contains(item)
+
+    @property
+    def num_slots(self):
+        return len(self.slots)
+
+    @staticmethod
+    def _new_slots(num_slots, remainder_bits):
+        return np.zeros(num_slots, dtype=utils.fingerprint_dtype(remainder_bits + METADATA_BITS))
+
+    def _get_quotient_and_remainder(self, item):
+        fingerprint = self.hasher.hash(item).fingerprint(self.fingerprint_size)
+        return fingerprint >> self.remainder_bits, fingerprint & ((1 << self.remainder_bits) - 1)
+
+    def _get_fingerprints_many(self, items):
+        return self.hasher.hash_many(items).fingerprint(self.fingerprint_size)
+
+    def _find_run_start(self, quotient):
+        """
+        Slot where the run of quotient starts, or would start: walk back to
+        the start of the cluster, then forward one run per occupied slot.
+        """
+        slots = self.slots
+        num_slots = len(slots)
+        slot = quotient
+        while slots.item(slot) & SHIFTED:
+            slot = (slot - 1) % num_slots
+        run_start = slot
+        while slot != quotient:
+            run_start = (run_start + 1) % num_slots
+            while slots.item(run_start) & CONTINUATION:
+                run_start = (run_start + 1) % num_slots
+            slot = (slot + 1) % num_slots
+            while not slots.item(slot) & OCCUPIED:
+                slot = (slot + 1) % num_slots
+        return run_start
+
+    def add(self, item):
+        """
+        Add an item into the filter.
+
+        :param item: Item to be inserted.
+        :return: True if insert is successful; Exception if the filter is
+        full.
+        """
+        self._add_fingerprint(self.hasher.hash(item).fingerprint(self.fingerprint_size))
+        return True
+
+    def _add_fingerprint(self, fingerprint):
+        if self.auto_grow and self.size + 1 > self.growth_load_factor * self.num_slots \
+                and self._can_grow():
+            self.grow()
+        self._insert(fingerprint >> self.remainder_bits, fingerprint & ((1 << self.remainder_bits) - 1))
+
+    def _insert(self, quotient, remainder):
+        if self.size >= self.num_slots:
+            raise Exception('Insert operation failed. Filter is full.')
+        slots = self.slots
+        num_slots = len(slots)
+        entry = slots.item(quotient)
+        if not entry & METADATA_MASK:
+            slots[quotient] = (remainder << METADATA_BITS) | OCCUPIED
+            self.size += 1
+            return
+        was_occupied = entry & OCCUPIED
+        slots[quotient] = entry | OCCUPIED
+        slot = self._find_run_start(quotient)
+        metadata = 0
+        if was_occupied:
+            # Keep the run sorted; a new first remainder pushes the old one
+            # into continuing the run
+            run_start = slot
+            while slots.item(slot) >> METADATA_BITS < remainder:
+                slot = (slot + 1) % num_slots
+                if not slots.item(slot) & CONTINUATION:
+                    break
+            if slot != run_start:
+                metadata |= CONTINUATION
+        if slot != quotient:
+            metadata |= SHIFTED
+        carry = (remainder << METADATA_BITS) | metadata
+        pushes_run_start = was_occupied and not metadata & CONTINUATION
+        # Shift the rest of the cluster right by one slot; occupied bits
+        # belong to the slots and stay in place
+        while True:
+            entry = slots.item(slot)
+            slots[slot] = carry | (entry & OCCUPIED)
+            if not entry & METADATA_MASK:
+                break
+            carry = (entry & ~OCCUPIED) | SHIFTED
+            if pushes_run_start:
+                carry |= CONTINUATION
+                pushes_run_start = False
+            slot = (slot + 1) % num_slots
+        self.size += 1
+
+    def _find(self, quotient, remainder):
+        """Slot holding remainder in the run of quotient, or None"""
+        slots = self.slots
+        if not slots.item(quotient) & OCCUPIED:
+            return None
+        num_slots = len(slots)
+        slot = self._find_run_start(quotient)
+        while True:
+            stored = slots.item(slot) >> METADATA_BITS
+            if stored == remainder:
+                return slot
+            if stored > remainder:
+                return None
+            slot = (slot + 1) % num_slots
+            if not slots.item(slot) & CONTINUATION:
+                return None
+
+    def contains(self, item):
+        """
+        Check if the filter contains the item.
+
+        :param item: Item to check its presence in the filter.
+        :return: True, if item is in the filter; False, otherwise.
+        """
+        return self._find(*self._get_quotient_and_remainder(item)) is not None
+
+    def delete(self, item):
+        """
+        Delete an item from the filter.
+
+        To delete an item safely, it must have been previously inserted.
+        Otherwise, deleting a non-inserted item might unintentionally remove
+        a real, different item that happens to share the same fingerprint.
+
+        :param item: Item to delete from the filter.
+        :return: True, if item is found and deleted; False, otherwise.
+        """
+        quotient, remainder = self._get_quotient_and_remainder(item)
+        slot = self._find(quotient, remainder)
+        if slot is None:
+            return False
+        slots = self.slots
+        num_slots = len(slots)
+        next_slot = (slot + 1) % num_slots
+        was_run_start = not slots.item(slot) & CONTINUATION
+        run_continues = bool(slots.item(next_slot) & CONTINUATION)
+        if was_run_start and not run_continues:
+            slots[quotient] = slots.item(quotient) & ~OCCUPIED
+        # Shift the rest of the cluster left by one slot, tracking the
+        # quotient of every run to clear the shifted bit of the run that
+        # lands on its canonical slot
+        run_quotient = quotient
+        promotes_run_start = was_run_start and run_continues
+        while True:
+            entry = slots.item(next_slot)
+            if not entry & SHIFTED:
+                # Empty slot or start of the next cluster
+                slots[slot] = slots.item(slot) & OCCUPIED
+                break
+            if not entry & CONTINUATION:
+                run_quotient = (run_quotient + 1) % num_slots
+                while not slots.item(run_quotient) & OCCUPIED:
+                    run_quotient = (run_quotient + 1) % num_slots
+            moved = entry & ~OCCUPIED
+            if promotes_run_start:
+                moved &= ~CONTINUATION
+                promotes_run_start = False
+            if slot == run_quotient:
+                moved &= ~SHIFTED
+            slots[slot] = moved | (slots.item(slot) & OCCUPIED)
+            slot = next_slot
+            next_slot = (slot + 1) % num_slots
+        self.size -= 1
+        return True
+
+    def _fingerprints(self):
+        """
+        Every stored fingerprint in sorted order, from one pass over the
+        slots: the i-th run belongs to the i-th occupied slot counting from
+        the start of a cluster.
+        :return: uint64 array of quotient << remainder_bits | remainder
+        """
+        slots = self.slots.astype(np.uint64)
+        metadata = slots & np.uint64(METADATA_MASK)
+        cluster_starts = np.flatnonzero((metadata != 0) & ((metadata & np.uint64(SHIFTED)) == 0))
+        if not len(cluster_starts):
+            return np.zeros(0, dtype=np.uint64)
+        # Start reading at a cluster start, so no cluster is cut in two
+        first = cluster_starts[0]
+        slots = np.concatenate((slots[first:], slots[:first]))
+        entries = slots[(slots & np.uint64(METADATA_MASK)) != 0]
+        quotients = (np.flatnonzero(slots & np.uint64(OCCUPIED)) + first) % len(slots)
+        run_numbers = np.cumsum((entries & np.uint64(CONTINUATION)) == 0) - 1
+        quotients = quotients[run_numbers].astype(np.uint64)
+        fingerprints = (quotients << np.uint64(self.remainder_bits)) | (entries >> np.uint64(METADATA_BITS))
+        # A cluster wrapping around the end holds the smallest quotients last
+        wrap = np.flatnonzero(np.diff(quotients.astype(np.int64)) < 0)
+        if len(wrap):
+            fingerprints = np.concatenate((fingerprints[wrap[0] + 1:], fingerprints[:wrap[0] + 1]))
+        return fingerprints
+
+    def _store(self, fingerprints):
+        """
+        Rebuild the table from sorted fingerprints. Fingerprint i lands on
+        the later of its quotient and the slot after fingerprint i - 1;
+        fingerprints pushed past the last slot wrap around and push the
+        first ones in turn.
+        """
+        num_slots = self.num_slots
+        if len(fingerprints) > num_slots:
+            raise Exception('Insert operation failed. Filter is full.')
+        slots = self._new_slots(num_slots, self.remainder_bits)
+        if len(fingerprints):
+            quotients = (fingerprints >> np.uint64(self.remainder_bits)).astype(np.int64)
+            remainders = fingerprints & np.uint64((1 << self.remainder_bits) - 1)
+            offsets = np.arange(len(fingerprints))
+            num_wrapped = 0
+            while True:
+                positions = offsets + np.maximum.accumulate(np.maximum(quotients - offsets, num_wrapped))
+                overflow = max(0, int(positions[-1]) - num_slots + 1)
+                if overflow == num_wrapped:
+                    break
+                num_wrapped = overflow
+            continuation = np.zeros(len(fingerprints), dtype=bool)
+            continuation[1:] = quotients[1:] == quotients[:-1]
+            entries = (remainders << np.uint64(METADATA_BITS)) \
+                | (continuation.astype(np.uint64) * np.uint64(CONTINUATION)) \
+                | ((positions != quotients).astype(np.uint64) * np.uint64(SHIFTED))
+            slots[positions % num_slots] = entries
+            slots[quotients] |= slots.dtype.type(OCCUPIED)
+        self.slots = slots
+        self.size = len(fingerprints)
+
+    def _can_grow(self):
+        return self.remainder_bits > 1
+
+    def grow(self):
+        """
+        Double the number of slots, moving the top bit of every remainder
+        into its quotient. Fingerprints keep their value, so the table is
+        rebuilt from its own contents without the original keys.
+        """
+        if not self._can_grow():
+            raise ValueError('No remainder bits left to grow the filter')
+        fingerprints = self._fingerprints()
+        self._double()
+        self._store(fingerprints)
+
+    def _double(self):
+        """Move a remainder bit into the quotient, leaving the slots empty"""
+        self.quotient_bits += 1
+        self.remainder_bits -= 1
+        self.max_elements *= 2
+        self.slots = self._new_slots(2 * self.num_slots, self.remainder_bits)
+
+    def _store_growing(self, fingerprints):
+        """Store sorted fingerprints, doubling first to keep the load below
+        growth_load_factor"""
+        while len(fingerprints) > self.growth_load_factor * self.num_slots and self._can_grow():
+            self._double()
+        self._store(fingerprints)
+
+    def copy(self):
+        """Return a copy of the filter"""
+        quotient_filter = copy.copy(self)
+        quotient_filter.slots = self.slots.copy()
+        return quotient_filter
+
+    def _check_template(self, quotient_filter):
+        if self.fingerprint_size != quotient_filter.fingerprint_size \
+                or self.hasher != quotient_filter.hasher:
+            raise ValueError('Mismatched quotient filters: %r and %r' % (self, quotient_filter))
+
+    @classmethod
+    def merge(cls, quotient_filters):
+        """
+        Return a filter holding the fingerprints of all quotient_filters,
+        which must share their hasher and fingerprint size but may differ in
+        number of slots. The sorted fingerprints of every filter are merged
+        in a linear scan: a stable sort of sorted runs merges them.
+        """
+        quotient_filters = list(quotient_filters)
+        if not quotient_filters:
+            raise ValueError('merge needs at least one quotient filter')
+        largest = max(quotient_filters, key=lambda quotient_filter: quotient_filter.num_slots)
+        for quotient_filter in quotient_filters:
+            largest._check_template(quotient_filter)
+        fingerprints = np.sort(np.concatenate([quotient_filter._fingerprints()
+                                               for quotient_filter in quotient_filters]),
+                               kind='stable')
+        merged = largest.copy()
+        merged._store_growing(fingerprints)
+        return merged
+
+    def add_many(self, items):
+        """
+        Add a sequence or NumPy array of items into the filter.
+
+        The new fingerprints are merged with the stored ones and the table
+        rebuilt in one vectorized pass; a few items added to a large filter
+        are inserted one by one instead.
+        """
+        fingerprints = [self._get_fingerprints_many(batch)
+                        for batch in utils.batches(items, self.batch_size)]
+        if not fingerprints:
+            return
+        fingerprints = np.sort(np.concatenate(fingerprints))
+        if len(fingerprints) * 64 < self.size:
+            for fingerprint in fingerprints.tolist():
+                self._add_fingerprint(fingerprint)
+            return
+        fingerprints = np.sort(np.concatenate((self._fingerprints(), fingerprints)), kind='stable')
+        if self.auto_grow:
+            self._store_growing(fingerprints)
+        else:
+            self._store(fingerprints)
+
+    def contains_many(self, items):
+        """
+        Check a sequence or NumPy array of items for membership, by binary
+        search in the sorted fingerprints.
+
+        :return: Boolean array, true where the item is in the filter.
+        """
+        stored = self._fingerprints()
+        results = []
+        for batch in utils.batches(items, self.batch_size):
+            fingerprints = self._get_fingerprints_many(batch)
+            positions = np.searchsorted(stored, fingerprints)
+            found = positions < len(stored)
+            found[found] = stored[positions[found]] == fingerprints[found]
+            results.append(found)
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
@@ -0,0 +1,9 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from .ribbon_filter import RibbonFilter
+
+__version__ = '1.0.0'
+__all__ = [
+    'RibbonFilter'
+]
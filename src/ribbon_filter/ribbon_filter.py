@@ -0,0 +1,348 @@
+import math
+import random
+import numpy as np
+import utils
+from utils.hashers import GOLDEN_GAMMA, _splitmix64, _splitmix64_many
+
+# Bits per word of the solution
+WORD_BITS = 64
+
+
+# Narrowest and widest bands. Narrower bands need too many extra slots to be
+# solved at scale
+MIN_BAND_WIDTH = 32
+MAX_BAND_WIDTH = 2 * WORD_BITS
+
+
+def default_overhead(band_width, num_keys):
+    """
+    Extra slots per key, as a fraction of the number of keys, with which a
+    system of num_keys keys and the given band width is solved at the first
+    attempt most of the time. The overhead a standard Ribbon filter needs
+    grows with log(num_keys) / band_width, faster for bands below 64 bits.
+    """
+    return 0.6 * max(1, 64 / band_width) * math.log(max(num_keys, 2)) / band_width
+
+
+# Multiplier gathering the lowest bits of the 8 bytes of a word into its
+# top byte
+GATHER_BYTES = 0x0102040810204080
+
+
+def _parity_many(words):
+    """Parity of the bits of every value of the uint64 array words, as uint8"""
+    if hasattr(np, 'bitwise_count'):  # NumPy >= 2.0
+        return np.bitwise_count(words) & np.uint8(1)
+    for shift in (32, 16, 8, 4, 2, 1):
+        words = words ^ (words >> np.uint64(shift))
+    return (words & np.uint64(1)).astype(np.uint8)
+
+
+def _pack_bits_many(bits):
+    """
+    Pack the rows of the 2-D uint8 array bits, all 0 or 1, into uint64
+    values with the bit of column b at position b.
+    """
+    num_bytes = -(-bits.shape[1] // 8) * 8
+    if bits.shape[1] != num_bytes:
+        bits = np.concatenate(
+            [bits, np.zeros((len(bits), num_bytes - bits.shape[1]), dtype=np.uint8)], axis=1)
+    groups = np.ascontiguousarray(bits).view('<u8')
+    gathered = (groups * np.uint64(GATHER_BYTES)) >> np.uint64(56)
+    packed = gathered[:, 0].astype(np.uint64)
+    for group in range(1, groups.shape[1]):
+        packed |= gathered[:, group] << np.uint64(8 * group)
+    return packed
+
+
+class RibbonFilter:
+    """
+    Standard Ribbon filter from https://arxiv.org/abs/2103.02515
+
+    A static filter built from all its keys at once, like XorFilter. Every
+    key has a start slot and band_width random coefficient bits covering the
+    slots from its start on. The table is a solution Z of the linear system
+    over GF(2) in which, for every key, the XOR of the slots of Z picked by
+    its coefficients equals its fingerprint. Keys enter the system one at a
+    time by on-the-fly Gaussian elimination: the row of a key is reduced by
+    the rows already stored until its first coefficient lands on a free
+    slot, which becomes its pivot. Back-substitution from the last slot then
+    gives Z.
+
+    A wider band solves the system with fewer extra slots per key, at the
+    cost of more bits read per lookup. Z is stored interleaved: for every
+    fingerprint bit, one bit per slot packed in 64-bit words, so a lookup
+    reads a window of band_width bits per fingerprint bit and takes the
+    parity of its AND with the coefficients.
+    """
+    # Number of keys hashed together
+    batch_size = 1 << 16
+    # Number of seeds tried before the overhead is deemed too small
+    max_attempts = 16
+
+    def __init__(self, max_elements, error_rate, keys, hasher=None, num_bits=None, band_width=64,
+                 overhead=None):
+        """
+        :param num_bits: Size of the fingerprints in bits, derived from
+        error_rate if None
+        :param band_width: Number of coefficient bits per key, from 32 to 128
+        :param overhead: Extra slots per key, as a fraction of the number of
+        keys, default_overhead(band_width, len(keys)) if None
+        """
+        if not MIN_BAND_WIDTH <= band_width <= MAX_BAND_WIDTH:
+            raise ValueError('band_width must be between %d and %d' % (MIN_BAND_WIDTH, MAX_BAND_WIDTH))
+        self.max_elements = max_elements
+        self.error_rate = error_rate
+        self.num_keys = len(keys)
+        if num_bits is None:
+            num_bits = 1 + math.ceil(-math.log2(self.error_rate))
+        self.num_bits = num_bits
+        self.band_width = band_width
+        if overhead is None:
+            overhead = default_overhead(band_width, self.num_keys)
+        self.overhead = overhead
+        # Every key starts in one of num_starts slots and covers band_width
+        self.num_starts = max(1, math.ceil(self.num_keys * (1 + overhead)))
+        self.size = self.num_starts + band_width - 1
+        self.num_chunks = math.ceil(band_width / WORD_BITS)
+        self.hasher = utils.get_hasher(hasher)
+        # Bit 0 of a 64-bit lane per fingerprint bit, and the multiplier
+        # moving those bits next to each other
+        self._lane_starts = sum(1 << (WORD_BITS * bit) for bit in range(num_bits))
+        self._lane_gather = sum(1 << (63 * bit) for bit in range(num_bits))
+
+        key_hashes, fingerprints = self._hash_keys(keys)
+        for _ in range(self.max_attempts):
+            self.seed_hasher = utils.IntHasher(seed=random.randrange(1 << 63))
+            system = self._eliminate(key_hashes, fingerprints)
+            if system is not None:
+                break
+        else:
+            raise ValueError('No solution found for %d keys in %d slots; increase overhead or '
+                             'band_width' % (self.num_keys, self.size))
+        self.solution = self._back_substitute(*system)
+
+    def fingerprint(self, hashed_key):
+        return hashed_key.fingerprint(self.num_bits)
+
+    def _hash_keys(self, keys):
+        """
+        Hash all keys, batch by batch.
+        :return: uint64 array of 64-bit hashes and uint64 array of fingerprints
+        """
+        key_hashes = np.empty(len(keys), dtype=np.uint64)
+        fingerprints = np.empty(len(keys), dtype=np.uint64)
+        start = 0
+        for batch in utils.batches(keys, self.batch_size):
+            hashed_keys = self.hasher.hash_many(batch)
+            key_hashes[start:start + len(batch)] = hashed_keys.low
+            fingerprints[start:start + len(batch)] = self.fingerprint(hashed_keys)
+            start += len(batch)
+        return key_hashes, fingerprints
+
+    def _start(self, hash64):
+        """Start slot of the key with the mixed 64-bit hash hash64"""
+        return ((hash64 >> 32) * self.num_starts) >> 32
+
+    def _coefficients(self, hash64):
+        """
+        band_width coefficient bits of the key with the mixed 64-bit hash
+        hash64, drawn from the splitmix64 sequence after hash64. The first
+        one is always set, so every key has a pivot.
+        """
+        coefficients = 0
+        for chunk in range(self.num_chunks):
+            word = _splitmix64((hash64 + (chunk + 1) * GOLDEN_GAMMA) & utils.hashutils.MASK_64)
+            coefficients |= word << (chunk * WORD_BITS)
+        return (coefficients & ((1 << self.band_width) - 1)) | 1
+
+    def _rows_many(self, hash64s):
+        """
+        Vectorized counterpart of _start and _coefficients.
+        :return: uint64 array of start slots and list of num_chunks uint64
+        arrays holding 64 coefficient bits each, lowest first
+        """
+        starts = ((hash64s >> np.uint64(32)) * np.uint64(self.num_starts)) >> np.uint64(32)
+        chunks = []
+        for chunk in range(self.num_chunks):
+            offset = np.uint64(((chunk + 1) * GOLDEN_GAMMA) & utils.hashutils.MASK_64)
+            chunks.append(_splitmix64_many(hash64s + offset))
+        last_bits = self.band_width - (self.num_chunks - 1) * WORD_BITS
+        if last_bits < WORD_BITS:
+            chunks[-1] &= np.uint64((1 << last_bits) - 1)
+        chunks[0] |= np.uint64(1)
+        return starts, chunks
+
+    def _eliminate(self, key_hashes, fingerprints):
+        """
+        Add the keys to the system one at a time. The row of a key is XORed
+        with the row stored at its current first coefficient and shifted to
+        the next set coefficient, until it reaches a slot without a row.
+        :return: Lists of the coefficients and fingerprints stored at every
+        slot, 0 for free slots, or None if a key contradicts the others
+        """
+        rows = [0] * self.size
+        results = [0] * self.size
+        for start in range(0, len(key_hashes), self.batch_size):
+            starts, chunks = self._rows_many(self.seed_hasher.hash64_many(key_hashes[start:start + self.batch_size]))
+            coefficient_lists = [chunk.tolist() for chunk in chunks]
+            if len(coefficient_lists) == 1:
+                all_coefficients = coefficient_lists[0]
+            else:
+                all_coefficients = [low | (high << WORD_BITS) for low, high in zip(*coefficient_lists)]
+            for slot, coefficients, result in zip(starts.tolist(), all_coefficients,
+                                                  fingerprints[start:start + self.batch_size].tolist()):
+                while True:
+                    row = rows[slot]
+                    if not row:
+                        rows[slot] = coefficients
+                        results[slot] = result
+                        break
+                    coefficients ^= row
+                    result ^= results[slot]
+                    if not coefficients:
+                        # Equal keys cancel out, other dependent rows only
+                        # fit if their fingerprints agree
+                        if result:
+                            return None
+                        break
+                    shift = (coefficients & -coefficients).bit_length() - 1
+                    slot += shift
+                    coefficients >>= shift
+        return rows, results
+
+    def _back_substitute(self, rows, results):
+        """
+        Solve the system from the last slot to the first, all fingerprint
+        bits at once. state is an int with one lane of lane_width bits per
+        fingerprint bit, holding the solution bits of the slots from the
+        current one on. Multiplying a row by lane_starts copies it to every
+        lane, and folding the AND of the copies with state leaves the parity
+        of every lane in its first bit. Every lane_width slots, the lanes
+        are whole words of the solution.
+        :return: uint64 array of shape (number of words, num_bits), the
+        solution bits of fingerprint bit b in column b
+        """
+        num_bits = self.num_bits
+        lane_width = WORD_BITS * self.num_chunks
+        lane_starts = sum(1 << (bit * lane_width) for bit in range(num_bits))
+        shift_mask = ((1 << (num_bits * lane_width)) - 1) ^ lane_starts
+        folds = [1 << exponent for exponent in reversed(range(lane_width.bit_length() - 1))]
+        # Lanes with the bits of every byte of a fingerprint
+        spread = [sum(((byte >> bit) & 1) << (bit * lane_width) for bit in range(8))
+                  for byte in range(256)]
+        num_blocks = -(-self.size // lane_width)
+        blocks = []
+        state = 0
+        for slot in range(num_blocks * lane_width - 1, -1, -1):
+            state = (state << 1) & shift_mask
+            if slot < self.size and rows[slot]:
+                parities = (rows[slot] * lane_starts) & state
+                for fold in folds:
+                    parities ^= parities >> fold
+                result = results[slot]
+                offset = 0
+                while result:
+                    parities ^= spread[result & 0xff] << (offset * lane_width)
+                    result >>= 8
+                    offset += 8
+                state |= parities & lane_starts
+            if slot % lane_width == 0:
+                blocks.append(state.to_bytes(num_bits * lane_width // 8, 'little'))
+        blocks.reverse()
+        words = np.frombuffer(b''.join(blocks), dtype='<u8').reshape(num_blocks, num_bits, self.num_chunks)
+        # Room for the words after the window of the last start
+        num_words = (self.num_starts - 1) // WORD_BITS + self.num_chunks + 1
+        solution = np.zeros((max(num_words, num_blocks * self.num_chunks), num_bits), dtype=np.uint64)
+        solution[:num_blocks * self.num_chunks] = words.transpose(0, 2, 1).reshape(-1, num_bits)
+        return solution
+
+    def _expected_fingerprint(self, start, coefficients):
+        """
+        Fingerprint given by the solution to the key with the start slot
+        start and the coefficients coefficients. The words covering the band
+        are read as one int with a 64-bit lane per word and fingerprint bit,
+        masked by copies of the shifted coefficients, and folded to the
+        parity of every lane; the parities are then gathered into the
+        fingerprint with one multiplication.
+        """
+        num_bits = self.num_bits
+        index, offset = divmod(start, WORD_BITS)
+        words = int.from_bytes(self.solution[index:index + self.num_chunks + 1].tobytes(), 'little')
+        coefficients <<= offset
+        masked = 0
+        while coefficients:
+            masked ^= words & ((coefficients & utils.hashutils.MASK_64) * self._lane_starts)
+            words >>= WORD_BITS * num_bits
+            coefficients >>= WORD_BITS
+        for fold in (32, 16, 8, 4, 2, 1):
+            masked ^= masked >> fold
+        if num_bits < WORD_BITS:
+            # The parity of lane b lands on bit 63 * (num_bits - 1) + b
+            gathered = (masked & self._lane_starts) * self._lane_gather
+            return (gathered >> (63 * (num_bits - 1))) & ((1 << num_bits) - 1)
+        return sum(((masked >> (WORD_BITS * bit)) & 1) << bit for bit in range(num_bits))
+
+    def _expected_fingerprints(self, starts, chunks):
+        """
+        Vectorized counterpart of _expected_fingerprint. The coefficients
+        are shifted to the words they cover, rather than the words of every
+        fingerprint bit to the coefficients.
+        """
+        index = (starts >> np.uint64(6)).astype(np.intp)
+        offset = starts & np.uint64(WORD_BITS - 1)
+        # Two shifts, since shifting a uint64 by 64 bits is undefined
+        carry_shift = np.uint64(WORD_BITS - 1) - offset
+        masked = np.zeros((len(starts), self.num_bits), dtype=np.uint64)
+        previous = np.zeros(len(starts), dtype=np.uint64)
+        for word in range(self.num_chunks + 1):
+            chunk = chunks[word] if word < self.num_chunks else np.zeros_like(previous)
+            shifted = (chunk << offset) | ((previous >> carry_shift) >> np.uint64(1))
+            words = np.take(self.solution, index + word, axis=0)
+            np.bitwise_and(words, shifted[:, None], out=words)
+            masked ^= words
+            previous = chunk
+        return _pack_bits_many(_parity_many(masked))
+
+    def contains(self, key):
+        """
+        Check whether the given element is contained in the filter.
+        """
+        return key in self
+
+    def __contains__(self, key):
+        hashed_key = self.hasher.hash(key)
+        hash64 = self.seed_hasher.hash64(hashed_key.low)
+        expected = self._expected_fingerprint(self._start(hash64), self._coefficients(hash64))
+        return self.fingerprint(hashed_key) == expected
+
+    def contains_many(self, keys):
+        """
+        Batch counterpart of __contains__.
+        :return: Boolean NumPy array telling for every key whether it may be
+        in the filter
+        """
+        results = []
+        for batch in utils.batches(keys, self.batch_size):
+            hashed_keys = self.hasher.hash_many(batch)
+            starts, chunks = self._rows_many(self.seed_hasher.hash64_many(hashed_keys.low))
+            results.append(self._expected_fingerprints(starts, chunks) == self.fingerprint(hashed_keys))
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def bits_per_key(self):
+        """Bits of solution per key, about (1 + overhead) * num_bits"""
+        return self.solution.nbytes * 8 / max(self.num_keys, 1)
+
+    def __repr__(self):
+        return "<RibbonFilter: n=%d, error_rate=%f, num_bits=%d, band_width=%d>" % (
+            self.size,
+            self.error_rate,
+            self.num_bits,
+            self.band_width,
+        )
@@ -1,3 +1,14 @@
-from .hashutils import fingerprint, hash_code
+from .hashutils import HashedKey, hash_key, hash_keys, fingerprint, hash_code, \
+    hash_many, fingerprint_many, hash_code_many
+from .hashers import Hasher, MurmurHasher, IntHasher, HASHERS, get_hasher, \
+    alternate_offset, alternate_offset_many, alternate_offset_table
+from .batching import batches
 from .bucket import Bucket
-__all__ = ['fingerprint', 'hash_code', 'Bucket']
\ No newline at end of file
+from .bucket_array import BucketArray, SemiSortedBucketArray, fingerprint_dtype
+from .eviction import find_eviction_path
+__all__ = ['HashedKey', 'hash_key', 'hash_keys', 'fingerprint', 'hash_code',
+           'hash_many', 'fingerprint_many', 'hash_code_many', 'Hasher',
+           'MurmurHasher', 'IntHasher', 'HASHERS', 'get_hasher',
+           'alternate_offset', 'alternate_offset_many', 'alternate_offset_table',
+           'batches', 'Bucket', 'BucketArray',
+           'SemiSortedBucketArray', 'fingerprint_dtype', 'find_eviction_path']
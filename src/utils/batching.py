@@ -0,0 +1,20 @@
+import itertools
+import numpy as np
+
+
+def batches(keys, batch_size):
+    """
+    Split a sequence or NumPy array of keys into slices of batch_size. Other
+    iterables are read lazily, one list of batch_size keys at a time, so a
+    stream of keys is never held in memory at once.
+    """
+    if isinstance(keys, (list, tuple, np.ndarray)):
+        for start in range(0, len(keys), batch_size):
+            yield keys[start:start + batch_size]
+        return
+    iterator = iter(keys)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
@@ -15,16 +15,7 @@ class Bucket(object):
         return len(self.bucket)
 
     def __iter__(self):
-        self.index = 0
-        return self
-
-    def __next__(self):
-        if self.index < len(self):
-            value = self.bucket[self.index]
-            self.index += 1
-            return value
-        else:
-            raise StopIteration
+        return iter(self.bucket)
 
     def insert(self, item):
         """
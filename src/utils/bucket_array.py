@@ -0,0 +1,395 @@
+import itertools
+import random
+import numpy as np
+
+
+def fingerprint_dtype(size_bits):
+    """
+    Narrowest unsigned NumPy dtype that holds a 'size_bits'-bit fingerprint.
+    :param size_bits: Size of the fingerprints in bits
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if size_bits <= np.iinfo(dtype).bits:
+            return np.dtype(dtype)
+    raise ValueError('Fingerprints of more than 64 bits are not supported')
+
+
+def _group_ranks(groups):
+    """
+    Rank of every element of the integer array groups among the elements
+    equal to it, in order of appearance: [5, 3, 5, 5] gives [0, 0, 1, 2].
+    """
+    order = np.argsort(groups, kind='stable')
+    sorted_groups = groups[order]
+    ranks = np.empty(len(groups), dtype=np.intp)
+    ranks[order] = np.arange(len(groups)) - np.searchsorted(sorted_groups, sorted_groups)
+    return ranks
+
+
+class BucketArray(object):
+    """
+    Fixed-size table of buckets of fingerprints, stored in one contiguous
+    NumPy array of shape (num_buckets, bucket_size).
+
+    Every slot takes the narrowest unsigned dtype that holds a fingerprint.
+    0 marks an empty slot, so stored fingerprints must not be 0.
+    """
+
+    def __init__(self, num_buckets, bucket_size, fingerprint_size):
+        self.num_buckets = num_buckets
+        self.bucket_size = bucket_size
+        self.fingerprint_size = fingerprint_size
+        self.table = np.zeros((num_buckets, bucket_size),
+                              dtype=fingerprint_dtype(fingerprint_size))
+
+    def __repr__(self):
+        return '<BucketArray: num_buckets=' + str(self.num_buckets) + \
+               ', bucket_size=' + str(self.bucket_size) + ', dtype=' + \
+               str(self.table.dtype) + '>'
+
+    def __len__(self):
+        return self.num_buckets
+
+    @property
+    def nbytes(self):
+        """Number of bytes taken by the fingerprints"""
+        return self.table.nbytes
+
+    def bucket(self, index):
+        """
+        Fingerprints stored in bucket number index.
+        :param index: Bucket index
+        :return: List of the non-empty slots
+        """
+        return [f for f in self.table[index].tolist() if f]
+
+    def count(self, index):
+        """Number of fingerprints in bucket number index"""
+        return self.bucket_size - self.table[index].tolist().count(0)
+
+    def is_full(self, index):
+        return 0 not in self.table[index].tolist()
+
+    def contains(self, index, fingerprint):
+        """
+        Check whether bucket number index holds fingerprint.
+        """
+        return fingerprint in self.table[index].tolist()
+
+    def insert(self, index, fingerprint):
+        """
+        Insert a fingerprint into the first empty slot of bucket number index.
+        :return: True if the bucket had room; False otherwise.
+        """
+        try:
+            slot = self.table[index].tolist().index(0)
+        except ValueError:
+            return False
+        self.table[index, slot] = fingerprint
+        return True
+
+    def delete(self, index, fingerprint):
+        """
+        Delete one copy of a fingerprint from bucket number index.
+        :return: True if the fingerprint was found; False otherwise.
+        """
+        try:
+            slot = self.table[index].tolist().index(fingerprint)
+        except ValueError:
+            return False
+        self.table[index, slot] = 0
+        return True
+
+    def place(self, index, fingerprint, old_fingerprint):
+        """
+        Put a fingerprint into bucket number index in the slot of one copy
+        of old_fingerprint.
+        :return: True if old_fingerprint was found; False otherwise.
+        """
+        try:
+            slot = self.table[index].tolist().index(old_fingerprint)
+        except ValueError:
+            return False
+        self.table[index, slot] = fingerprint
+        return True
+
+    def swap(self, index, fingerprint):
+        """
+        Swap a fingerprint with a random entry of the full bucket number index
+        and return the swapped fingerprint.
+        """
+        slot = random.randrange(self.bucket_size)
+        swapped = int(self.table[index, slot])
+        self.table[index, slot] = fingerprint
+        return swapped
+
+    def slots_many(self, indices):
+        """
+        Slots of the buckets in the array indices.
+        :return: Array of shape (len(indices), bucket_size), 0 where empty
+        """
+        return self.table[indices]
+
+    def store_many(self, indices, slots):
+        """
+        Overwrite the buckets in the array indices, which must be distinct,
+        with the rows of slots.
+        """
+        self.table[indices] = slots
+
+    def contains_many(self, indices, fingerprints):
+        """
+        Vectorized counterpart of contains.
+        :return: Boolean array, true where bucket indices[n] holds fingerprints[n]
+        """
+        return (self.slots_many(indices) == fingerprints[:, None]).any(axis=1)
+
+    def insert_many(self, indices, fingerprints):
+        """
+        Vectorized counterpart of insert. When several fingerprints go to the
+        same bucket, the first ones fill its empty slots.
+        :return: Boolean array, true where the fingerprint was inserted
+        """
+        buckets, rows = np.unique(indices, return_inverse=True)
+        slots = self.slots_many(buckets)
+        empty = slots == 0
+        ranks = _group_ranks(rows)
+        inserted = ranks < empty.sum(axis=1)[rows]
+        # Empty slots first, in order, in every row
+        empty_slots = np.argsort(~empty, axis=1, kind='stable')
+        rows, ranks = rows[inserted], ranks[inserted]
+        slots[rows, empty_slots[rows, ranks]] = fingerprints[inserted]
+        self.store_many(buckets, slots)
+        return inserted
+
+    def delete_many(self, indices, fingerprints):
+        """
+        Vectorized counterpart of delete. A fingerprint given n times for the
+        same bucket deletes up to n copies.
+        :return: Boolean array, true where the fingerprint was found and deleted
+        """
+        buckets, rows = np.unique(indices, return_inverse=True)
+        slots = self.slots_many(buckets)
+        matches = slots[rows] == fingerprints[:, None]
+        _, pairs = np.unique(np.stack((rows, fingerprints.astype(np.int64)), axis=1),
+                             axis=0, return_inverse=True)
+        ranks = _group_ranks(pairs.ravel())
+        deleted = ranks < matches.sum(axis=1)
+        # Matching slots first, in order, in every row
+        match_slots = np.argsort(~matches, axis=1, kind='stable')
+        slots[rows[deleted], match_slots[deleted, ranks[deleted]]] = 0
+        self.store_many(buckets, slots)
+        return deleted
+
+
+# Semi-sorting, from section 5.2 of
+# https://www.cs.cmu.edu/~dga/papers/cuckoo-conext2014.pdf: the fingerprints
+# of a 4-slot bucket are kept sorted, so their 4-bit prefixes form a sorted
+# 4-tuple. There are only 3876 of those, so the four prefixes are stored as
+# a 12-bit index into SEMI_SORT_DECODE instead of 16 bits.
+SEMI_SORT_BUCKET_SIZE = 4
+SEMI_SORT_PREFIX_BITS = 4
+SEMI_SORT_INDEX_BITS = 12
+
+# Row i holds the sorted prefixes encoded by index i
+SEMI_SORT_DECODE = np.array(list(itertools.combinations_with_replacement(
+    range(1 << SEMI_SORT_PREFIX_BITS), SEMI_SORT_BUCKET_SIZE)), dtype=np.uint8)
+# Index of the sorted prefixes (p0, p1, p2, p3), looked up at
+# p0 << 12 | p1 << 8 | p2 << 4 | p3
+SEMI_SORT_ENCODE = np.zeros(1 << 16, dtype=np.uint16)
+SEMI_SORT_ENCODE[(SEMI_SORT_DECODE.astype(np.int64) << [12, 8, 4, 0]).sum(axis=1)] = \
+    np.arange(len(SEMI_SORT_DECODE))
+
+_decode_prefixes = [tuple(row) for row in SEMI_SORT_DECODE.tolist()]
+_encode_prefixes = SEMI_SORT_ENCODE.tolist()
+
+
+class SemiSortedBucketArray(BucketArray):
+    """
+    Table of 4-slot buckets of fingerprints, compressed with semi-sorting.
+
+    A bucket is stored as one (4 * fingerprint_size - 4)-bit code: the 12-bit
+    index of its sorted fingerprint prefixes, followed by the four remaining
+    fingerprint suffixes. Codes are packed back to back in a byte array, so
+    each fingerprint takes one bit less than it would uncompressed, at the
+    price of decoding the bucket on every access. 0 marks an empty slot.
+
+    Batches of buckets are decoded and encoded with vectorized arithmetic
+    when a code and its bit offset fit in a 64-bit word, which holds for
+    fingerprints of up to 15 bits, and one at a time otherwise.
+    """
+
+    def __init__(self, num_buckets, bucket_size, fingerprint_size):
+        if bucket_size != SEMI_SORT_BUCKET_SIZE:
+            raise ValueError('Semi-sorted buckets must have 4 slots')
+        if fingerprint_size < SEMI_SORT_PREFIX_BITS:
+            raise ValueError('Semi-sorted fingerprints must have at least 4 bits')
+        self.num_buckets = num_buckets
+        self.bucket_size = bucket_size
+        self.fingerprint_size = fingerprint_size
+        self.suffix_bits = fingerprint_size - SEMI_SORT_PREFIX_BITS
+        self.bits_per_bucket = SEMI_SORT_INDEX_BITS + bucket_size * self.suffix_bits
+        # A code starts anywhere within its first byte
+        self._span = (7 + self.bits_per_bucket + 7) // 8
+        self._mask = (1 << self.bits_per_bucket) - 1
+        num_bytes = (num_buckets * self.bits_per_bucket + 7) // 8
+        # Padding so every code can be read as a whole 64-bit word
+        self.array_ = np.zeros(num_bytes + max(self._span, 8), dtype=np.uint8)
+        self._bytes = memoryview(self.array_)
+        self._vectorized = self.bits_per_bucket + 7 <= 64
+
+    def __repr__(self):
+        return '<SemiSortedBucketArray: num_buckets=' + str(self.num_buckets) + \
+               ', bits_per_bucket=' + str(self.bits_per_bucket) + '>'
+
+    def __len__(self):
+        return self.num_buckets
+
+    @property
+    def nbytes(self):
+        """Number of bytes taken by the fingerprints"""
+        return self.array_.nbytes
+
+    def _read(self, index):
+        """Decode bucket number index into its four sorted slots"""
+        bitno = index * self.bits_per_bucket
+        start = bitno >> 3
+        code = int.from_bytes(self._bytes[start:start + self._span], 'little')
+        code = (code >> (bitno & 7)) & self._mask
+        suffix_bits = self.suffix_bits
+        suffix_mask = (1 << suffix_bits) - 1
+        suffixes = code >> SEMI_SORT_INDEX_BITS
+        return [(prefix << suffix_bits) | ((suffixes >> (suffix_bits * slot)) & suffix_mask)
+                for slot, prefix in enumerate(_decode_prefixes[code & 0xfff])]
+
+    def _write(self, index, fingerprints):
+        """Sort four slots and encode them into bucket number index"""
+        fingerprints = sorted(fingerprints)
+        suffix_bits = self.suffix_bits
+        suffix_mask = (1 << suffix_bits) - 1
+        prefixes = 0
+        code = 0
+        for slot, fingerprint in enumerate(fingerprints):
+            prefixes = (prefixes << SEMI_SORT_PREFIX_BITS) | (fingerprint >> suffix_bits)
+            code |= (fingerprint & suffix_mask) << (suffix_bits * slot)
+        code = (code << SEMI_SORT_INDEX_BITS) | _encode_prefixes[prefixes]
+
+        bitno = index * self.bits_per_bucket
+        start = bitno >> 3
+        shift = bitno & 7
+        word = int.from_bytes(self._bytes[start:start + self._span], 'little')
+        word = (word & ~(self._mask << shift)) | (code << shift)
+        self._bytes[start:start + self._span] = word.to_bytes(self._span, 'little')
+
+    def bucket(self, index):
+        """
+        Fingerprints stored in bucket number index.
+        :param index: Bucket index
+        :return: List of the non-empty slots
+        """
+        return [f for f in self._read(index) if f]
+
+    def count(self, index):
+        """Number of fingerprints in bucket number index"""
+        return self.bucket_size - self._read(index).count(0)
+
+    def is_full(self, index):
+        return 0 not in self._read(index)
+
+    def contains(self, index, fingerprint):
+        """
+        Check whether bucket number index holds fingerprint.
+        """
+        return fingerprint in self._read(index)
+
+    def insert(self, index, fingerprint):
+        """
+        Insert a fingerprint into an empty slot of bucket number index.
+        :return: True if the bucket had room; False otherwise.
+        """
+        fingerprints = self._read(index)
+        try:
+            fingerprints[fingerprints.index(0)] = fingerprint
+        except ValueError:
+            return False
+        self._write(index, fingerprints)
+        return True
+
+    def delete(self, index, fingerprint):
+        """
+        Delete one copy of a fingerprint from bucket number index.
+        :return: True if the fingerprint was found; False otherwise.
+        """
+        fingerprints = self._read(index)
+        try:
+            fingerprints[fingerprints.index(fingerprint)] = 0
+        except ValueError:
+            return False
+        self._write(index, fingerprints)
+        return True
+
+    def place(self, index, fingerprint, old_fingerprint):
+        """
+        Put a fingerprint into bucket number index in the slot of one copy
+        of old_fingerprint.
+        :return: True if old_fingerprint was found; False otherwise.
+        """
+        fingerprints = self._read(index)
+        try:
+            fingerprints[fingerprints.index(old_fingerprint)] = fingerprint
+        except ValueError:
+            return False
+        self._write(index, fingerprints)
+        return True
+
+    def swap(self, index, fingerprint):
+        """
+        Swap a fingerprint with a random entry of the full bucket number index
+        and return the swapped fingerprint.
+        """
+        fingerprints = self._read(index)
+        slot = random.randrange(self.bucket_size)
+        swapped = fingerprints[slot]
+        fingerprints[slot] = fingerprint
+        self._write(index, fingerprints)
+        return swapped
+
+    def slots_many(self, indices):
+        if not self._vectorized:
+            return np.array([self._read(index) for index in indices.tolist()],
+                            dtype=np.uint64).reshape(-1, self.bucket_size)
+        bitnos = indices.astype(np.uint64) * np.uint64(self.bits_per_bucket)
+        starts = (bitnos >> np.uint64(3)).astype(np.intp)
+        words = np.lib.stride_tricks.sliding_window_view(self.array_, 8)[starts]
+        words = words.view('<u8').ravel().astype(np.uint64)
+        codes = (words >> (bitnos & np.uint64(7))) & np.uint64(self._mask)
+
+        suffix_bits = np.uint64(self.suffix_bits)
+        suffix_shifts = suffix_bits * np.arange(self.bucket_size, dtype=np.uint64)
+        suffixes = (codes >> np.uint64(SEMI_SORT_INDEX_BITS))[:, None] >> suffix_shifts
+        suffixes &= np.uint64((1 << self.suffix_bits) - 1)
+        prefixes = SEMI_SORT_DECODE[codes & np.uint64(0xfff)].astype(np.uint64)
+        return (prefixes << suffix_bits) | suffixes
+
+    def store_many(self, indices, slots):
+        if not self._vectorized:
+            for index, fingerprints in zip(indices.tolist(), slots.tolist()):
+                self._write(index, fingerprints)
+            return
+        slots = np.sort(slots, axis=1).astype(np.uint64)
+        suffix_bits = np.uint64(self.suffix_bits)
+        suffix_shifts = suffix_bits * np.arange(self.bucket_size, dtype=np.uint64)
+        prefix_shifts = np.array([12, 8, 4, 0], dtype=np.uint64)
+        prefixes = np.bitwise_or.reduce((slots >> suffix_bits) << prefix_shifts, axis=1)
+        suffixes = slots & np.uint64((1 << self.suffix_bits) - 1)
+        codes = np.bitwise_or.reduce(suffixes << suffix_shifts, axis=1)
+        codes = (codes << np.uint64(SEMI_SORT_INDEX_BITS)) | SEMI_SORT_ENCODE[prefixes]
+
+        bitnos = indices.astype(np.uint64) * np.uint64(self.bits_per_bucket)
+        shifts = bitnos & np.uint64(7)
+        byte_indices = (bitnos >> np.uint64(3)).astype(np.intp)[:, None] + np.arange(8)
+        values = (codes << shifts).astype('<u8').view(np.uint8).reshape(-1, 8)
+        masks = (np.uint64(self._mask) << shifts).astype('<u8').view(np.uint8).reshape(-1, 8)
+        # Neighbouring codes can share a byte; ufunc.at applies both updates
+        np.bitwise_and.at(self.array_, byte_indices, ~masks)
+        np.bitwise_or.at(self.array_, byte_indices, values)
@@ -0,0 +1,42 @@
+from collections import deque
+
+
+def find_eviction_path(start_buckets, bucket_contents, alternate_index, has_room, max_depth):
+    """
+    Breadth-first search for the shortest chain of fingerprint moves that
+    frees a slot in one of start_buckets, for cuckoo-style inserts.
+
+    Nothing is moved: the caller applies the moves in reverse order, so every
+    fingerprint lands in a slot freed by the move after it.
+    :param start_buckets: Candidate buckets of the fingerprint to insert
+    :param bucket_contents: Function returning the fingerprints in a bucket
+    :param alternate_index: Function mapping a bucket and a fingerprint in it
+    to the fingerprint's other bucket
+    :param has_room: Function telling whether a bucket has an empty slot
+    :param max_depth: Largest number of moves in the chain
+    :return: List of (bucket, fingerprint, alternate bucket) moves from a
+    start bucket to a bucket with room, or None if there is no such chain
+    of at most max_depth moves
+    """
+    # Bucket -> (bucket, fingerprint) move that reaches it, and its depth
+    parents = {bucket: None for bucket in start_buckets}
+    queue = deque((bucket, 0) for bucket in parents)
+    while queue:
+        bucket, depth = queue.popleft()
+        if depth == max_depth:
+            continue
+        for fingerprint in bucket_contents(bucket):
+            alternate = alternate_index(bucket, fingerprint)
+            if alternate in parents:
+                continue
+            parents[alternate] = (bucket, fingerprint)
+            if has_room(alternate):
+                path = []
+                while parents[alternate] is not None:
+                    bucket, fingerprint = parents[alternate]
+                    path.append((bucket, fingerprint, alternate))
+                    alternate = bucket
+                path.reverse()
+                return path
+            queue.append((alternate, depth + 1))
+    return None
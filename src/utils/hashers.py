@@ -0,0 +1,215 @@
+import operator
+import numpy as np
+from .hashutils import DEFAULT_SEED, MASK_64, HashedKey, hash_key, hash_keys
+
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+_MIX_1 = 0xBF58476D1CE4E5B9
+_MIX_2 = 0x94D049BB133111EB
+
+
+def _splitmix64(x):
+    """
+    splitmix64 finalizer on a python int holding a 64-bit value.
+    """
+    x = ((x ^ (x >> 30)) * _MIX_1) & MASK_64
+    x = ((x ^ (x >> 27)) * _MIX_2) & MASK_64
+    return x ^ (x >> 31)
+
+
+def _splitmix64_many(x):
+    """
+    splitmix64 finalizer on a uint64 NumPy array. Multiplication wraps
+    around modulo 2^64, matching _splitmix64.
+    """
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(_MIX_1)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(_MIX_2)
+    return x ^ (x >> np.uint64(31))
+
+
+class Hasher(object):
+    """
+    Turns keys into HashedKeys.
+
+    A filter keeps the hasher it was built with, so every operation on it
+    (and every filter it is combined with) hashes keys the same way.
+    """
+    name = None
+
+    def __init__(self, seed=DEFAULT_SEED):
+        self.seed = seed
+
+    def __repr__(self):
+        return '<' + type(self).__name__ + ': seed=' + str(self.seed) + '>'
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.seed == other.seed
+
+    def __hash__(self):
+        return hash((self.name, self.seed))
+
+    def with_seed(self, seed):
+        """Return a hasher of the same kind with a different seed"""
+        return type(self)(seed)
+
+    def hash(self, key):
+        """
+        Hash a single key.
+        :param key: Key to hash
+        :return: HashedKey holding python ints
+        """
+        raise NotImplementedError(
+            "The 'hash' method must be implemented in the subclass"
+        )
+
+    def hash_many(self, keys):
+        """
+        Hash a batch of keys.
+        :param keys: Sequence or NumPy array of keys
+        :return: HashedKey holding uint64 arrays
+        """
+        raise NotImplementedError(
+            "The 'hash_many' method must be implemented in the subclass"
+        )
+
+
+class MurmurHasher(Hasher):
+    """
+    Hash keys with 128-bit MurmurHash3.
+
+    bytes, bytearray and memoryview keys are hashed in place. str keys are
+    UTF-8 encoded, and ints and floats are hashed through their decimal
+    string, so 1 and '1' are the same key.
+    """
+    name = 'murmur'
+
+    def hash(self, key):
+        return hash_key(key, self.seed)
+
+    def hash_many(self, keys):
+        return hash_keys(keys, self.seed)
+
+
+class IntHasher(Hasher):
+    """
+    Hash 64-bit integer keys with splitmix64, without encoding them.
+
+    The low and high halves are the first two splitmix64 outputs for a state
+    of key XOR seed. Negative keys are taken modulo 2^64. NumPy integer
+    arrays are hashed with vectorized arithmetic.
+    """
+    name = 'int'
+
+    def __init__(self, seed=DEFAULT_SEED):
+        super().__init__(seed)
+        self._state = _splitmix64((seed + GOLDEN_GAMMA) & MASK_64)
+
+    def hash(self, key):
+        try:
+            x = operator.index(key) & MASK_64
+        except TypeError:
+            raise TypeError("IntHasher keys must be integers") from None
+        x ^= self._state
+        low = _splitmix64((x + GOLDEN_GAMMA) & MASK_64)
+        high = _splitmix64((x + 2 * GOLDEN_GAMMA) & MASK_64)
+        return HashedKey(low, high)
+
+    def hash_many(self, keys):
+        x = self._as_uint64(keys) ^ np.uint64(self._state)
+        low = _splitmix64_many(x + np.uint64(GOLDEN_GAMMA))
+        high = _splitmix64_many(x + np.uint64((2 * GOLDEN_GAMMA) & MASK_64))
+        return HashedKey(low, high)
+
+    def hash64(self, key):
+        """
+        64-bit hash of an integer key: the low half of hash(key), without
+        computing the high half.
+        """
+        x = (operator.index(key) & MASK_64) ^ self._state
+        return _splitmix64((x + GOLDEN_GAMMA) & MASK_64)
+
+    def hash64_many(self, keys):
+        """
+        Vectorized counterpart of hash64.
+        :return: uint64 array, the low half of hash_many(keys)
+        """
+        x = self._as_uint64(keys) ^ np.uint64(self._state)
+        return _splitmix64_many(x + np.uint64(GOLDEN_GAMMA))
+
+    @staticmethod
+    def _as_uint64(keys):
+        array = np.asarray(keys)
+        if array.dtype.kind in 'iu':
+            return array.astype(np.uint64).reshape(-1)
+        # Mixed, boolean or very large python ints go one at a time
+        try:
+            return np.fromiter((operator.index(key) & MASK_64 for key in keys),
+                               dtype=np.uint64, count=len(array))
+        except TypeError:
+            raise TypeError("IntHasher keys must be integers") from None
+
+
+# Fingerprints are hashed with their own fixed hasher, independent of the
+# hasher a filter uses for its keys, so alternate indices only depend on the
+# stored fingerprint.
+_fingerprint_hasher = IntHasher(seed=97)
+
+# Largest fingerprint size (in bits) that gets a precomputed offset table
+MAX_OFFSET_TABLE_BITS = 22
+
+
+def alternate_offset(fingerprint, modulus):
+    """
+    Hash a fingerprint into range(modulus). Cuckoo-style filters combine this
+    offset with a bucket index to find the fingerprint's alternate bucket.
+    :param fingerprint: Fingerprint to hash
+    :param modulus: Size of the range of offsets
+    """
+    return _fingerprint_hasher.hash(fingerprint).index(modulus)
+
+
+def alternate_offset_many(fingerprints, modulus):
+    """
+    Vectorized counterpart of alternate_offset.
+    :param fingerprints: NumPy array of fingerprints
+    :param modulus: Size of the range of offsets
+    :return: uint64 array of offsets
+    """
+    return _fingerprint_hasher.hash_many(fingerprints).index(modulus)
+
+
+def alternate_offset_table(size_bits, modulus):
+    """
+    Precompute alternate_offset for every 'size_bits'-bit fingerprint.
+    :param size_bits: Size of the fingerprints in bits
+    :param modulus: Size of the range of offsets
+    :return: NumPy array indexed by fingerprint, using the narrowest unsigned
+    dtype that holds modulus - 1, or None if 'size_bits' exceeds
+    MAX_OFFSET_TABLE_BITS
+    """
+    if size_bits > MAX_OFFSET_TABLE_BITS:
+        return None
+    fingerprints = np.arange(1 << size_bits, dtype=np.uint64)
+    offsets = _fingerprint_hasher.hash_many(fingerprints).index(modulus)
+    return offsets.astype(np.min_scalar_type(modulus - 1))
+
+
+HASHERS = {
+    MurmurHasher.name: MurmurHasher,
+    IntHasher.name: IntHasher,
+}
+
+
+def get_hasher(hasher=None):
+    """
+    Resolve the hasher a filter should use.
+    :param hasher: None for the default MurmurHasher, the name of a hasher in
+    HASHERS, or a hasher instance
+    """
+    if hasher is None:
+        return MurmurHasher()
+    if isinstance(hasher, str):
+        try:
+            return HASHERS[hasher]()
+        except KeyError:
+            raise ValueError('Unknown hasher: ' + hasher) from None
+    return hasher
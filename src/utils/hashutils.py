@@ -1,43 +1,181 @@
+import struct
 import mmh3
+import numpy as np
 
 MAX_64_INT = 2 ** 64
 MAX_32_INT = 2 ** 32
+MASK_64 = MAX_64_INT - 1
+
+DEFAULT_SEED = 42
+
+_unpack_digest = struct.Struct('<QQ').unpack
+
+# mmh3 >= 4 hashes any buffer in place; older releases only take bytes
+_digest = getattr(mmh3, 'mmh3_x64_128_digest', None)
+if _digest is None:
+    _digest = lambda data, seed: mmh3.hash_bytes(bytes(data), seed)
+
+
+def _encode(data):
+    """
+    Encode data as bytes so it can be hashed with MurmurHash3.
+    Bytes-like data is passed through without copying.
+    :param data: Data to encode
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+    if isinstance(data, str):
+        return data.encode()
+    if isinstance(data, (int, float, np.integer, np.floating)):
+        return str(data).encode()
+    raise TypeError("Data must be of type str, int, float or bytes-like")
 
 
 def _mmh3_hash(data, seed):
     """
-    Generate MurmurHash3 hash for data in bytes with a given seed
+    Generate an unsigned 64-bit MurmurHash3 hash for data with a given seed.
+    This is the low half of the 128-bit x64 digest.
     :param data: Data to generate MurmurHash3 hash for
     :param seed: Seed for the MurmurHash3 hash function
     """
-    if not isinstance(data, (str, int, float)):
-        raise TypeError("Data must be of type str, int, or float")
-    else:
-        data = str(data).encode()
+    h = _digest(_encode(data), seed)
+    return int.from_bytes(h[:8], byteorder='little')
+
+
+def _mmh3_digests(keys, seed):
+    """
+    Generate the 128-bit MurmurHash3 digest of every key.
+    :param keys: Sequence or NumPy array of keys
+    :param seed: Seed for the MurmurHash3 hash function
+    :return: uint64 array of shape (len(keys), 2) holding the low and high
+    half of each digest
+    """
+    if isinstance(keys, np.ndarray):
+        keys = keys.tolist()
+    digest = _digest
+    digests = b''.join([digest(_encode(key), seed) for key in keys])
+    return np.frombuffer(digests, dtype='<u8').reshape(-1, 2).astype(np.uint64)
+
+
+class HashedKey(object):
+    """
+    128-bit MurmurHash3 digest of a key, split into two 64-bit halves.
+
+    The low half picks bucket indices, the high half gives fingerprints, and
+    together they drive double hashing. The halves are python ints for a
+    single key or uint64 NumPy arrays for a batch of keys; every method works
+    on both.
+    """
+    __slots__ = ('low', 'high')
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def __repr__(self):
+        return '<HashedKey: low=' + str(self.low) + ', high=' + \
+               str(self.high) + '>'
+
+    def __len__(self):
+        return len(self.low)
+
+    def index(self, num_buckets):
+        """
+        Bucket index in range(num_buckets), taken from the low half.
+        :param num_buckets: Number of buckets
+        """
+        return self.low % num_buckets
+
+    def fingerprint(self, size_bits):
+        """
+        Fingerprint of 'size_bits' bits, taken from the high half.
+        :param size_bits: Size in bits to truncate the fingerprint
+        """
+        return self.high & ((1 << size_bits) - 1)
+
+    def nonzero_fingerprint(self, size_bits):
+        """
+        Fingerprint of 'size_bits' bits in range(1, 2^size_bits), for tables
+        that reserve 0 as the empty slot.
+        :param size_bits: Size in bits of the fingerprint
+        """
+        return self.high % ((1 << size_bits) - 1) + 1
+
+    def probe(self, probeno, modulus):
+        """
+        Double hashing position low + probeno * high (mod 2^64), reduced to
+        range(modulus).
+        :param probeno: Number of the probe
+        :param modulus: Size of the range to map the probe into
+        """
+        return ((self.low + probeno * self.high) & MASK_64) % modulus
+
+
+def hash_key(data, seed=DEFAULT_SEED):
+    """
+    Hash a key once into a HashedKey.
+    :param data: Data to hash
+    :param seed: Seed for the MurmurHash3 hash function
+    """
+    low, high = _unpack_digest(_digest(_encode(data), seed))
+    return HashedKey(low, high)
+
+
+def hash_keys(keys, seed=DEFAULT_SEED):
+    """
+    Vectorized counterpart of hash_key.
+    :param keys: Sequence or NumPy array of keys
+    :param seed: Seed for the MurmurHash3 hash function
+    :return: HashedKey holding uint64 arrays
+    """
+    digests = _mmh3_digests(keys, seed)
+    return HashedKey(digests[:, 0].copy(), digests[:, 1].copy())
+
+
+def hash_many(keys, seed):
+    """
+    Vectorized counterpart of _mmh3_hash.
+    :param keys: Sequence or NumPy array of keys
+    :param seed: Seed for the MurmurHash3 hash function
+    :return: uint64 array with the 64-bit hash of every key
+    """
+    return _mmh3_digests(keys, seed)[:, 0]
 
-    h = mmh3.hash_bytes(data, seed=seed)
-    return int.from_bytes(h, byteorder='big', signed=True)
 
 def fingerprint(data, size_bits):
     """
-    Get fingerprint of a string using MurmurHash3 64-bit hash and truncate it to
-    'size_bits' bits.
+    Get fingerprint of a string from the high half of its MurmurHash3 digest
+    and truncate it to 'size_bits' bits.
     :param data: Data to get fingerprint for
     :param size_bits: Size in bits to truncate the fingerprint
     :return: fingerprint of 'size_bits' bits
     """
-    seed = 42  # Arbitrary seed value for MurmurHash3
-    fp = _mmh3_hash(data, seed)
+    return hash_key(data).fingerprint(size_bits)
 
-    # Apply a bitwise AND operation to get the correct number of bits for the fingerprint
-    mask = (1 << size_bits) - 1
-    fp &= mask
 
-    return fp
+def fingerprint_many(keys, size_bits):
+    """
+    Vectorized counterpart of fingerprint.
+    :param keys: Sequence or NumPy array of keys
+    :param size_bits: Size in bits to truncate the fingerprints
+    :return: uint64 array of 'size_bits'-bit fingerprints
+    """
+    return hash_keys(keys).fingerprint(size_bits)
 
 
 def hash_code(data, num_buckets):
-    """Generate hash code using mmh3.hash() function.
+    """Generate hash code from the low half of the MurmurHash3 digest.
     :param data: Data to generate hash code for
+    :param num_buckets: Number of buckets to map the data into
+    """
+    return hash_key(data).index(num_buckets)
+
+
+def hash_code_many(keys, num_buckets):
+    """
+    Vectorized counterpart of hash_code.
+    :param keys: Sequence or NumPy array of keys
+    :param num_buckets: Number of buckets to map the keys into
+    :return: uint64 array of bucket indices
     """
-    return _mmh3_hash(data, seed=97) % num_buckets
\ No newline at end of file
+    return hash_keys(keys).index(num_buckets)
@@ -1,34 +1,87 @@
 """
 Vacuum Filter from https://www.vldb.org/pvldb/vol13/p197-wang.pdf
 """
+import collections
 import os
 import random
 import math
+import numpy as np
 import utils
 from filter import Filter
 
+# Largest fraction of extra buckets the chunked layout may add to round the
+# table up to whole chunks, before the widest alternate range is shrunk
+MAX_CHUNK_PADDING = 0.05
+
 class VacuumFilter(Filter):
     """
     Implements insert, delete, and contains operations for the vacuum filter.
+
+    The table is made of chunks of max(alternate_ranges) buckets, a power of
+    two. A fingerprint's alternate bucket is found by XOR with an offset
+    below its group's alternate range, so both buckets of an item lie in the
+    same chunk, close together in memory. The layout is fixed when the
+    filter is built: the widest range is halved until rounding the table up
+    to whole chunks costs at most MAX_CHUNK_PADDING extra buckets, and only
+    tables smaller than one chunk of the other ranges use one table-wide
+    range.
+
+    Fingerprints are stored in one contiguous BucketArray, 0 marking an empty
+    slot, next to an array with the number of fingerprints in every bucket,
+    so the eviction look-ahead checks buckets for room with one read each.
     """
+    # Number of keys hashed together by the batch operations
+    batch_size = 1 << 16
+    # Longest chain of moves the breadth-first eviction looks for
+    bfs_max_depth = 5
 
-    def __init__(self, max_elements, error_rate=0.05, bucket_size=4, max_displacements=500):
+    def __init__(self, max_elements, error_rate=0.05, bucket_size=4, max_displacements=500, hasher=None,
+                 eviction='random'):
         """
         Initialize the VacuumFilter object.
+
+        :param eviction: 'random' to make room with a random walk of at most
+        max_displacements swaps, or 'bfs' to search for the shortest chain
+        of at most bfs_max_depth moves before moving anything
         """
+        if eviction not in ('random', 'bfs'):
+            raise ValueError('eviction must be random or bfs')
         self.max_elements = max_elements  # n
         self.error_rate = error_rate
         self.bucket_size = bucket_size
         self.num_buckets = math.ceil(self.max_elements / self.bucket_size)  # m
-        self.buckets = [utils.Bucket(size=bucket_size)
-                        for _ in range(self.num_buckets)]
         self.alternate_ranges = self._select_ranges()  # L
+        # Round the table up to whole chunks, shrinking the widest range
+        # while the table is smaller than one chunk or the rounding wastes space
+        min_chunk_size = max(self.alternate_ranges[1:])
+        while self.alternate_ranges[0] > min_chunk_size and \
+                (self.num_buckets < self.alternate_ranges[0] or
+                 math.ceil(self.num_buckets / self.alternate_ranges[0]) * self.alternate_ranges[0] >
+                 (1 + MAX_CHUNK_PADDING) * self.num_buckets):
+            self.alternate_ranges[0] //= 2
+        chunk_size = max(self.alternate_ranges)
+        self.chunked = self.num_buckets >= chunk_size
+        if self.chunked:
+            self.num_buckets = math.ceil(self.num_buckets / chunk_size) * chunk_size
         self.size = 0  # k
 
         self.fingerprint_size = math.ceil(math.log2(self.bucket_size) +
                                           math.log2(1 / self.error_rate) + 1)
-        self.fingerprint = lambda item: utils.fingerprint(item, self.fingerprint_size)  # H'
+        self.buckets = utils.BucketArray(self.num_buckets, bucket_size, self.fingerprint_size)
+        # Number of fingerprints in every bucket
+        self.occupancy = np.zeros(self.num_buckets, dtype=np.uint8)
+        # H'(fingerprint) covers a whole chunk, or the whole table when it is
+        # not chunked, however short the fingerprints
+        self.offset_modulus = chunk_size if self.chunked else self.num_buckets
+        # H'(fingerprint) for every possible fingerprint, so finding the
+        # alternate bucket is one table read instead of hashing the fingerprint
+        self.fingerprint_hashes = utils.alternate_offset_table(self.fingerprint_size,
+                                                               self.offset_modulus)
         self.max_displacements = max_displacements
+        self.eviction = eviction
+        # Number of inserts by number of fingerprints moved to make room
+        self.eviction_path_lengths = collections.Counter()
+        self.hasher = utils.get_hasher(hasher)
 
     def __contains__(self, item):
         return self.contains(item)
@@ -80,48 +133,118 @@ class VacuumFilter(Filter):
         :return: True if insert is successful; VacuumFilterFullException if
         filter is full.
         """
-        fingerprint = self.fingerprint(item)
+        fingerprint, i, j = self._get_fingerprint_and_indices(item)
+        return self._insert(fingerprint, i, j)
+
+    def _insert_into(self, index, fingerprint):
+        if self.occupancy[index] == self.bucket_size:
+            return False
+        self.buckets.insert(index, fingerprint)
+        self.occupancy[index] += 1
+        return True
+
+    def _delete_from(self, index, fingerprint):
+        if not self.buckets.delete(index, fingerprint):
+            return False
+        self.occupancy[index] -= 1
+        return True
+
+    def _insert(self, fingerprint, i, j):
         f = fingerprint
-        i = self._get_index(item)
-        j = self._get_alternate_index(i, fingerprint)
 
-        if self.buckets[i].insert(f) or self.buckets[j].insert(f):
+        if self._insert_into(i, f) or self._insert_into(j, f):
             self.size += 1
+            self.eviction_path_lengths[0] += 1
             return True
 
+        if self.eviction == 'bfs':
+            return self._evict_bfs(fingerprint, i, j)
+
+        buckets = self.buckets
+        occupancy = self.occupancy
         eviction_index = random.choice([i, j])
-        for _ in range(self.max_displacements):
-            for f_prime in self.buckets[eviction_index]:
+        for num_swaps in range(self.max_displacements):
+            # Look ahead for a fingerprint whose alternate bucket has room
+            for f_prime in buckets.bucket(eviction_index):
                 alt_eviction_index = self._get_alternate_index(eviction_index, f_prime)
-                if not self.buckets[alt_eviction_index].is_full():
-                    self.buckets[eviction_index].place(f, f_prime)
-                    if self.buckets[alt_eviction_index].insert(f_prime):
-                        self.size += 1
-                        return True
-            f = self.buckets[eviction_index].swap(f)
+                if occupancy[alt_eviction_index] < self.bucket_size:
+                    buckets.place(eviction_index, f, f_prime)
+                    self._insert_into(alt_eviction_index, f_prime)
+                    self.size += 1
+                    self.eviction_path_lengths[num_swaps + 1] += 1
+                    return True
+            f = buckets.swap(eviction_index, f)
             eviction_index = self._get_alternate_index(eviction_index, f)
 
         raise Exception('Insert operation failed. Filter is full.')
 
-    def _get_index(self, item):
-        index = utils.hash_code(item, self.num_buckets)
-        return index
+    def _evict_bfs(self, fingerprint, i, j):
+        """
+        Search breadth first for the shortest chain of at most bfs_max_depth
+        moves that frees a slot in bucket i or j, then apply it. Nothing is
+        moved if there is no such chain.
+        """
+        occupancy = self.occupancy
+        path = utils.find_eviction_path([i, j], self.buckets.bucket, self._get_alternate_index,
+                                        lambda index: occupancy[index] < self.bucket_size,
+                                        self.bfs_max_depth)
+        if path is None:
+            raise Exception('Insert operation failed. Filter is full.')
+        for index, f, alternate in reversed(path):
+            self._delete_from(index, f)
+            self._insert_into(alternate, f)
+        self._insert_into(path[0][0], fingerprint)
+        self.size += 1
+        self.eviction_path_lengths[len(path)] += 1
+        return True
+
+    def _get_fingerprint_and_indices(self, item):
+        """
+        Hash the item once and derive its fingerprint and both candidate
+        bucket indices from the digest.
+        """
+        hashed_key = self.hasher.hash(item)
+        fingerprint = hashed_key.nonzero_fingerprint(self.fingerprint_size)
+        i = hashed_key.index(self.num_buckets)
+        j = self._get_alternate_index(i, fingerprint)
+        return fingerprint, i, j
 
     def _get_alternate_index(self, index, fingerprint):
-        alt_index = index
-        finger_hash = self.fingerprint(fingerprint)
-        if self.size < 262144:  # 2 ** 18
-            m = self.num_buckets
-            delta = finger_hash % m
-            alt_index = (index - delta) % m
-            # to prevent overflow
-            alt_index = (m - 1 - alt_index + delta) % m
+        if self.fingerprint_hashes is None:
+            finger_hash = utils.alternate_offset(fingerprint, self.offset_modulus)
         else:
+            finger_hash = int(self.fingerprint_hashes[fingerprint])
+        if self.chunked:
+            # Power-of-two range: the XOR stays within the chunk
             curr_range = self.alternate_ranges[fingerprint % 4]
-            alt_index = (index ^ (finger_hash % curr_range))
-            alt_index = alt_index % self.num_buckets  # ?
+            return index ^ (finger_hash % curr_range)
+        m = self.num_buckets
+        delta = finger_hash % m
+        alt_index = (index - delta) % m
+        # to prevent overflow
+        alt_index = (m - 1 - alt_index + delta) % m
         return alt_index
 
+    def _get_fingerprints_and_indices_many(self, items):
+        """
+        Vectorized counterpart of _get_fingerprint_and_indices.
+        :return: uint64 arrays of fingerprints, first and alternate indices
+        """
+        hashed_keys = self.hasher.hash_many(items)
+        fingerprints = hashed_keys.nonzero_fingerprint(self.fingerprint_size)
+        i = hashed_keys.index(self.num_buckets)
+        if self.fingerprint_hashes is None:
+            finger_hashes = utils.alternate_offset_many(fingerprints, self.offset_modulus)
+        else:
+            finger_hashes = self.fingerprint_hashes[fingerprints].astype(np.uint64)
+        if self.chunked:
+            ranges = np.array(self.alternate_ranges, dtype=np.uint64)[fingerprints % 4]
+            return fingerprints, i, i ^ (finger_hashes % ranges)
+        m = np.uint64(self.num_buckets)
+        delta = finger_hashes % m
+        alt_index = (i + m - delta) % m
+        return fingerprints, i, (m - np.uint64(1) - alt_index + delta) % m
+
     def contains(self, item):
         """
         Check if the filter contains the item.
@@ -129,11 +252,9 @@ class VacuumFilter(Filter):
         :param item: Item to check its presence in the filter.
         :return: True, if item is in the filter; False, otherwise.
         """
-        fingerprint = self.fingerprint(item)
-        i = self._get_index(item)
-        j = self._get_alternate_index(i, fingerprint)
+        fingerprint, i, j = self._get_fingerprint_and_indices(item)
 
-        return fingerprint in self.buckets[i] or fingerprint in self.buckets[j]
+        return self.buckets.contains(i, fingerprint) or self.buckets.contains(j, fingerprint)
 
     def delete(self, item):
         """
@@ -146,13 +267,70 @@ class VacuumFilter(Filter):
         :param item: Item to delete from the filter.
         :return: True, if item is found and deleted; False, otherwise.
         """
-        fingerprint = self.fingerprint(item)
-        i = self._get_index(item)
-        j = self._get_alternate_index(i, fingerprint)
+        fingerprint, i, j = self._get_fingerprint_and_indices(item)
 
-        if not self.contains(item):
-            return False
-        if self.buckets[i].delete(fingerprint) or self.buckets[j].delete(fingerprint):
+        if self._delete_from(i, fingerprint) or self._delete_from(j, fingerprint):
             self.size -= 1
             return True
         return False
+
+    def add_many(self, items):
+        """
+        Add a sequence or NumPy array of items into the filter.
+
+        Items whose first or alternate bucket has room are placed in one
+        vectorized pass; only the rest go through the eviction loop.
+        """
+        for batch in utils.batches(items, self.batch_size):
+            fingerprints, i, j = self._get_fingerprints_and_indices_many(batch)
+            inserted = self.buckets.insert_many(i, fingerprints)
+            np.add.at(self.occupancy, i[inserted], 1)
+            rest = np.flatnonzero(~inserted)
+            inserted_alternate = self.buckets.insert_many(j[rest], fingerprints[rest])
+            np.add.at(self.occupancy, j[rest[inserted_alternate]], 1)
+            inserted[rest] = inserted_alternate
+            self.size += int(np.count_nonzero(inserted))
+            self.eviction_path_lengths[0] += int(np.count_nonzero(inserted))
+            rest = np.flatnonzero(~inserted)
+            for f, first, alternate in zip(fingerprints[rest].tolist(), i[rest].tolist(),
+                                           j[rest].tolist()):
+                self._insert(f, first, alternate)
+
+    def contains_many(self, items):
+        """
+        Check a sequence or NumPy array of items for membership.
+
+        :return: Boolean array, true where the item is in the filter.
+        """
+        results = []
+        for batch in utils.batches(items, self.batch_size):
+            fingerprints, i, j = self._get_fingerprints_and_indices_many(batch)
+            found = self.buckets.contains_many(i, fingerprints)
+            rest = np.flatnonzero(~found)
+            found[rest] = self.buckets.contains_many(j[rest], fingerprints[rest])
+            results.append(found)
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    def delete_many(self, items):
+        """
+        Delete a sequence or NumPy array of items from the filter. The same
+        caveat as for delete applies to every item.
+
+        :return: Boolean array, true where the item was found and deleted.
+        """
+        results = []
+        for batch in utils.batches(items, self.batch_size):
+            fingerprints, i, j = self._get_fingerprints_and_indices_many(batch)
+            deleted = self.buckets.delete_many(i, fingerprints)
+            np.subtract.at(self.occupancy, i[deleted], 1)
+            rest = np.flatnonzero(~deleted)
+            deleted_alternate = self.buckets.delete_many(j[rest], fingerprints[rest])
+            np.subtract.at(self.occupancy, j[rest[deleted_alternate]], 1)
+            deleted[rest] = deleted_alternate
+            self.size -= int(np.count_nonzero(deleted))
+            results.append(deleted)
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
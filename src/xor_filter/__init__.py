@@ -1,9 +1,15 @@
 #!/usr/bin/env python
 # coding=utf-8
 
-from .xor_filter import XorFilter
+from .xor_filter import XorFilter, Xor8, Xor16
+from .binary_fuse_filter import BinaryFuseFilter
+from .partitioned_xor_filter import PartitionedXorFilter
 
 __version__ = '1.0.0'
 __all__ = [
-    'XorFilter'
+    'XorFilter',
+    'Xor8',
+    'Xor16',
+    'BinaryFuseFilter',
+    'PartitionedXorFilter'
 ]
@@ -0,0 +1,101 @@
+import math
+import numpy as np
+from .xor_filter import XorFilter, _index_dtype
+
+# Longest segment, so the offsets within a segment fit in 18 hash bits
+MAX_SEGMENT_LENGTH = 1 << 18
+# Hash bits XORed into the slot of the i-th segment after the first, for
+# i = 1, 2, 3
+SEGMENT_SHIFTS = (18, 0, 36)
+
+
+def segment_length(arity, num_keys):
+    """
+    Number of slots per segment, a power of two that grows with the number
+    of keys, from the reference implementation of binary fuse filters.
+    """
+    if num_keys <= 1:
+        return 4
+    if arity == 3:
+        exponent = math.floor(math.log(num_keys) / math.log(3.33) + 2.25)
+    else:
+        exponent = math.floor(math.log(num_keys) / math.log(2.91) - 0.5)
+    return min(1 << max(exponent, 0), MAX_SEGMENT_LENGTH)
+
+
+def size_factor(arity, num_keys):
+    """
+    Number of slots per key, from the reference implementation of binary
+    fuse filters. Small filters need more room to be peeled.
+    """
+    if num_keys <= 1:
+        return 0
+    if arity == 3:
+        return max(1.125, 0.875 + 0.25 * math.log(1000000) / math.log(num_keys))
+    return max(1.075, 0.77 + 0.305 * math.log(600000) / math.log(num_keys))
+
+
+class BinaryFuseFilter(XorFilter):
+    """
+    Binary fuse filter from https://arxiv.org/abs/2201.01174
+
+    A static filter built and queried like XorFilter, with a different
+    layout. The table is cut into segments of a power-of-two length, and
+    the slots of a key lie in arity consecutive segments: the first is
+    picked from the whole table, the others at hashed offsets within their
+    segment. Keys therefore overlap in windows of a few segments, which
+    peels with about 1.125 slots per key for 3-wise filters and 1.075 for
+    4-wise ones, against 1.23 for XorFilter, and keeps the slots of a key
+    close together.
+    """
+
+    def __init__(self, max_elements, error_rate, keys, hasher=None, num_bits=None, arity=3):
+        """
+        :param arity: Number of slots per key, 3 or 4
+        """
+        if arity not in (3, 4):
+            raise ValueError('arity must be 3 or 4')
+        self.arity = arity
+        super().__init__(max_elements, error_rate, keys, hasher=hasher, num_bits=num_bits)
+
+    def _init_layout(self, num_keys):
+        self.segment_length = segment_length(self.arity, num_keys)
+        capacity = round(num_keys * size_factor(self.arity, num_keys))
+        segment_count = math.ceil(capacity / self.segment_length)
+        if segment_count <= self.arity - 1:
+            segment_count = 1
+        else:
+            segment_count -= self.arity - 1
+        self.segment_count = segment_count
+        # Slots the first slot of a key is picked from
+        self.segment_count_length = segment_count * self.segment_length
+        self.size = (segment_count + self.arity - 1) * self.segment_length
+
+    def _slots_many(self, hash64s):
+        mask = np.uint64(self.segment_length - 1)
+        slots = np.empty((len(hash64s), self.arity), dtype=_index_dtype(self.size))
+        first = ((hash64s >> np.uint64(32)) * np.uint64(self.segment_count_length)) >> np.uint64(32)
+        slots[:, 0] = first
+        for segment, shift in zip(range(1, self.arity), SEGMENT_SHIFTS):
+            slots[:, segment] = (first + np.uint64(segment * self.segment_length)) ^ \
+                ((hash64s >> np.uint64(shift)) & mask)
+        return slots
+
+    def _expected_fingerprint(self, hash64):
+        table = self.backend
+        length = self.segment_length
+        mask = length - 1
+        start = ((hash64 >> 32) * self.segment_count_length) >> 32
+        expected = table.item(start)
+        for shift in SEGMENT_SHIFTS[:self.arity - 1]:
+            start += length
+            expected ^= table.item(start ^ ((hash64 >> shift) & mask))
+        return expected
+
+    def __repr__(self):
+        return "<BinaryFuseFilter: n=%d, error_rate=%f, num_bits=%d, arity=%d>" % (
+            self.size,
+            self.error_rate,
+            self.num_bits,
+            self.arity,
+        )
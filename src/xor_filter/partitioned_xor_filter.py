@@ -0,0 +1,219 @@
+import collections
+import concurrent.futures
+import math
+import os
+import tempfile
+import numpy as np
+import utils
+from .xor_filter import XorFilter
+
+
+def read_keys(path):
+    """Keys of a file with one key per line, as bytes without the line ending"""
+    with open(path, 'rb') as key_file:
+        for line in key_file:
+            yield line.rstrip(b'\r\n')
+
+
+def _build_partition(max_elements, error_rate, key_hashes, fingerprints, hasher, num_bits):
+    """Build the XorFilter of one partition, in a worker process if needed"""
+    return XorFilter._from_hashes(max_elements, error_rate, key_hashes, fingerprints,
+                                  hasher=hasher, num_bits=num_bits)
+
+
+class PartitionedXorFilter:
+    """
+    XorFilter built from a stream of keys, for key sets too large to keep in
+    memory.
+
+    The keys are read once and only their hashes are kept: the 64-bit hash
+    and the fingerprint, 9 or 10 bytes per key, in memory for small sets and
+    in memory-mapped files beyond partition_size keys. The top bits of the
+    64-bit hash split the keys into partitions of about partition_size keys,
+    each peeled into its own XorFilter, so building needs the memory of one
+    partition at a time, or of one per worker when partitions are built in
+    parallel. A lookup hashes the key once, picks the partition from the
+    prefix of the hash and checks the key there.
+    """
+    # Number of keys hashed together
+    batch_size = 1 << 16
+    # Expected number of keys per partition
+    partition_size = 1 << 22
+
+    def __init__(self, max_elements, error_rate, keys, hasher=None, num_bits=None, workers=1,
+                 temp_dir=None):
+        """
+        :param max_elements: Expected number of keys, which sets the number
+        of partitions
+        :param keys: Iterable of keys, read once, or the path of a file with
+        one key per line
+        :param num_bits: Size of the fingerprints in bits, derived from
+        error_rate if None
+        :param workers: Number of processes building partitions in parallel
+        :param temp_dir: Directory for the hashes of large key sets, the
+        default temporary directory if None
+        """
+        self.max_elements = max_elements
+        self.error_rate = error_rate
+        if num_bits is None:
+            num_bits = 1 + math.ceil(-math.log2(self.error_rate))
+        self.num_bits = num_bits
+        self.hasher = utils.get_hasher(hasher)
+        self.partition_bits = max(0, math.ceil(math.log2(max(max_elements, 1) / self.partition_size)))
+        self.num_partitions = 1 << self.partition_bits
+        if isinstance(keys, (str, os.PathLike)):
+            keys = read_keys(keys)
+        with tempfile.TemporaryDirectory(dir=temp_dir) as directory:
+            key_hashes, fingerprints = self._hash_keys(keys, directory)
+            self.num_keys = len(key_hashes)
+            bounds, key_hashes, fingerprints = self._partition(key_hashes, fingerprints, directory)
+            self.partitions = self._build_partitions(bounds, key_hashes, fingerprints, workers)
+            del key_hashes, fingerprints
+
+    def _partitions_of(self, key_hashes):
+        """Partition numbers of the uint64 array of 64-bit hashes key_hashes"""
+        if self.partition_bits == 0:
+            return np.zeros(len(key_hashes), dtype=np.int64)
+        return (key_hashes >> np.uint64(64 - self.partition_bits)).astype(np.int64)
+
+    def _hash_keys(self, keys, directory):
+        """
+        Hash the keys in one pass. The hashes stay in memory up to
+        partition_size keys and are appended to files in directory beyond.
+        :return: uint64 array of 64-bit hashes and array of fingerprints,
+        memory-mapped if the keys did not fit in memory
+        """
+        dtype = utils.fingerprint_dtype(self.num_bits)
+        hash_chunks, fingerprint_chunks = [], []
+        num_buffered = 0
+        files = None
+        for batch in utils.batches(keys, self.batch_size):
+            hashed_keys = self.hasher.hash_many(batch)
+            hash_chunks.append(hashed_keys.low)
+            fingerprint_chunks.append(hashed_keys.fingerprint(self.num_bits).astype(dtype))
+            num_buffered += len(batch)
+            if num_buffered >= self.partition_size:
+                if files is None:
+                    files = (open(os.path.join(directory, 'hashes'), 'wb'),
+                             open(os.path.join(directory, 'fingerprints'), 'wb'))
+                for chunks, chunk_file in zip((hash_chunks, fingerprint_chunks), files):
+                    for chunk in chunks:
+                        chunk.tofile(chunk_file)
+                    chunks.clear()
+                num_buffered = 0
+        if files is None:
+            if not hash_chunks:
+                return np.empty(0, dtype=np.uint64), np.empty(0, dtype=dtype)
+            return np.concatenate(hash_chunks), np.concatenate(fingerprint_chunks)
+        for chunks, chunk_file in zip((hash_chunks, fingerprint_chunks), files):
+            for chunk in chunks:
+                chunk.tofile(chunk_file)
+            chunk_file.close()
+        return (np.memmap(files[0].name, dtype=np.uint64, mode='r'),
+                np.memmap(files[1].name, dtype=dtype, mode='r'))
+
+    def _partition(self, key_hashes, fingerprints, directory):
+        """
+        Group the hashes by partition with a counting sort: one pass counts
+        the keys of every partition, a second one copies every batch of keys
+        to the free positions of their partitions.
+        :return: Array of num_partitions + 1 bounds, partition p holding the
+        keys from bounds[p] to bounds[p + 1], and the grouped hashes and
+        fingerprints, memory-mapped if the input is
+        """
+        counts = np.zeros(self.num_partitions, dtype=np.int64)
+        for start in range(0, len(key_hashes), self.batch_size):
+            counts += np.bincount(self._partitions_of(key_hashes[start:start + self.batch_size]),
+                                  minlength=self.num_partitions)
+        bounds = np.zeros(self.num_partitions + 1, dtype=np.int64)
+        np.cumsum(counts, out=bounds[1:])
+        if isinstance(key_hashes, np.memmap):
+            grouped_hashes = np.memmap(os.path.join(directory, 'grouped_hashes'), dtype=np.uint64,
+                                       mode='w+', shape=len(key_hashes))
+            grouped_fingerprints = np.memmap(os.path.join(directory, 'grouped_fingerprints'),
+                                             dtype=fingerprints.dtype, mode='w+',
+                                             shape=len(fingerprints))
+        else:
+            grouped_hashes = np.empty_like(key_hashes)
+            grouped_fingerprints = np.empty_like(fingerprints)
+        # Next free position of every partition
+        cursors = bounds[:-1].copy()
+        for start in range(0, len(key_hashes), self.batch_size):
+            batch_hashes = np.asarray(key_hashes[start:start + self.batch_size])
+            partitions = self._partitions_of(batch_hashes)
+            order = np.argsort(partitions, kind='stable')
+            batch_counts = np.bincount(partitions, minlength=self.num_partitions)
+            # Rank of every key within its partition in this batch
+            first = np.cumsum(batch_counts) - batch_counts
+            ranks = np.arange(len(order)) - np.repeat(first, batch_counts)
+            positions = np.repeat(cursors, batch_counts) + ranks
+            grouped_hashes[positions] = batch_hashes[order]
+            grouped_fingerprints[positions] = fingerprints[start:start + self.batch_size][order]
+            cursors += batch_counts
+        return bounds, grouped_hashes, grouped_fingerprints
+
+    def _build_partitions(self, bounds, key_hashes, fingerprints, workers):
+        """
+        Build one XorFilter per partition, in order. With several workers, at
+        most workers partitions are loaded and built at a time.
+        """
+        def arguments(partition):
+            start, stop = bounds[partition], bounds[partition + 1]
+            return (self.max_elements / self.num_partitions, self.error_rate,
+                    np.array(key_hashes[start:stop]), np.array(fingerprints[start:stop]),
+                    self.hasher, self.num_bits)
+
+        if workers <= 1:
+            return [_build_partition(*arguments(partition))
+                    for partition in range(self.num_partitions)]
+        partitions = []
+        pending = collections.deque()
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for partition in range(self.num_partitions):
+                pending.append(executor.submit(_build_partition, *arguments(partition)))
+                if len(pending) >= workers:
+                    partitions.append(pending.popleft().result())
+            partitions.extend(future.result() for future in pending)
+        return partitions
+
+    def __contains__(self, key):
+        hashed_key = self.hasher.hash(key)
+        partition = hashed_key.low >> (64 - self.partition_bits) if self.partition_bits else 0
+        return self.partitions[partition]._contains_hashed(hashed_key)
+
+    def contains_many(self, keys):
+        """
+        Batch counterpart of __contains__, checking the keys of every
+        partition together.
+        :return: Boolean NumPy array telling for every key whether it may be
+        in the filter
+        """
+        results = []
+        for batch in utils.batches(keys, self.batch_size):
+            hashed_keys = self.hasher.hash_many(batch)
+            partitions = self._partitions_of(hashed_keys.low)
+            found = np.empty(len(partitions), dtype=bool)
+            for partition in np.unique(partitions):
+                selected = partitions == partition
+                found[selected] = self.partitions[partition]._contains_many_hashed(
+                    utils.HashedKey(hashed_keys.low[selected], hashed_keys.high[selected]))
+            results.append(found)
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+    @property
+    def bits_per_key(self):
+        """Bits of table per key"""
+        return 8 * sum(partition.backend.nbytes for partition in self.partitions) / max(self.num_keys, 1)
+
+    def __len__(self):
+        return sum(len(partition) for partition in self.partitions)
+
+    def __repr__(self):
+        return "<PartitionedXorFilter: n=%d, error_rate=%f, num_bits=%d, partitions=%d>" % (
+            len(self),
+            self.error_rate,
+            self.num_bits,
+            self.num_partitions,
+        )
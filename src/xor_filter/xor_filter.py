@@ -2,118 +2,250 @@ import array
 import math
 import os
 import random
-import mmh3
 import numpy as np
+import utils
 
-def _mmh3_hash(data, seed):
-    """
-    Generate MurmurHash3 hash for data in bytes with a given seed
-    :param data: Data to generate MurmurHash3 hash for
-    :param seed: Seed for the MurmurHash3 hash function
-    """
-    if not isinstance(data, (str, int, float)):
-        raise TypeError("Data must be of type str, int, or float")
-    else:
-        data = str(data).encode()
+MASK_32 = (1 << 32) - 1
 
-    h = mmh3.hash_bytes(data, seed=seed)
-    return int.from_bytes(h, byteorder='big', signed=True)
+def _rotl64(x, r):
+    """Rotate the 64-bit integer x left by r bits"""
+    return ((x << r) | (x >> (64 - r))) & utils.hashutils.MASK_64
 
-def get_fingerprint(seed, size_bits):
-    """
-    Generate a [2 ** size_bits]-valued hash function using the given seed.
-    """
-    def h(data):
-        hash = _mmh3_hash(data, seed)
-        mask = (1 << size_bits) - 1
-        return hash & mask
-    return h
+def _reduce(hash32, length):
+    """Map the 32-bit hash32 to [0, length) by multiplying and shifting"""
+    return (hash32 * length) >> 32
 
-def get_hash_funcs(seeds, size):
+def get_hash_funcs(size):
     """
-    Generate three independent hash functions with different ranges.
+    Generate three hash functions with different ranges. Each maps 32 bits
+    of a 64-bit hash, rotated by a different amount, into its own third of
+    the table. Reducing with a multiplication instead of a modulo keeps the
+    thirds independent: x % L and rotl(x, r) % L are related whenever L
+    shares a factor with 2^64 - 1, such as 3, 5 or 17.
     """
     c1 = math.floor(size / 3)
     c2 = math.floor(2 * size / 3)
-    h0 = lambda data: (_mmh3_hash(data, seeds[0]) % c1)
-    h1 = lambda data: c1 + (_mmh3_hash(data, seeds[1]) % (c2 - c1))
-    h2 = lambda data: c2 + (_mmh3_hash(data, seeds[2]) % (size - c2))
+    h0 = lambda hash64: _reduce(hash64 & MASK_32, c1)
+    h1 = lambda hash64: c1 + _reduce(_rotl64(hash64, 21) & MASK_32, c2 - c1)
+    h2 = lambda hash64: c2 + _reduce(_rotl64(hash64, 42) & MASK_32, size - c2)
     return h0, h1, h2
 
+def _index_dtype(size):
+    """Narrowest integer dtype for slot and key numbers below size"""
+    return np.dtype(np.uint32 if size <= 1 << 32 else np.int64)
+
+def _rotl64_many(x, r):
+    """Rotate every value of the uint64 array x left by r bits"""
+    return (x << np.uint64(r)) | (x >> np.uint64(64 - r))
+
+def get_slots_many(low, size):
+    """
+    Vectorized counterpart of the functions from get_hash_funcs.
+    :param low: uint64 array of 64-bit hashes
+    :param size: Number of slots in the table
+    :return: Array of shape (len(low), 3) with the three slots of every key
+    """
+    c1 = math.floor(size / 3)
+    c2 = math.floor(2 * size / 3)
+    slots = np.empty((len(low), 3), dtype=_index_dtype(size))
+    mask = np.uint64(MASK_32)
+    slots[:, 0] = _reduce(low & mask, np.uint64(c1))
+    slots[:, 1] = c1 + _reduce(_rotl64_many(low, 21) & mask, np.uint64(c2 - c1))
+    slots[:, 2] = c2 + _reduce(_rotl64_many(low, 42) & mask, np.uint64(size - c2))
+    return slots
 
 
 class XorFilter:
     """
     Approximate membership query for large immutable sets
     from https://dl.acm.org/doi/fullHtml/10.1145/3376122
+
+    The table is built by peeling: a slot used by a single remaining key is
+    assigned to that key, which is then removed from its other slots.
+    Every slot keeps the number of keys using it and the XOR of their
+    numbers, so the key of a slot with count 1 is read off directly. All
+    slots with count 1 are peeled together, in rounds of array operations.
+
+    Keys are hashed once: the low half of the digest is kept as a 64-bit
+    value and the high half gives the fingerprint. Every attempt at peeling
+    draws a seed and mixes the 64-bit values with an IntHasher of that seed
+    to place the keys, so a failed attempt is retried without rehashing the
+    keys.
     """
+    # Number of keys hashed together while building the filter
+    batch_size = 1 << 16
+
+    def __init__(self, max_elements, error_rate, keys, hasher=None, num_bits=None):
+        """
+        :param num_bits: Size of the fingerprints in bits, derived from
+        error_rate if None
+        """
+        self._setup(max_elements, error_rate, len(keys), hasher, num_bits)
+        self._build(*self._hash_keys(keys))
 
-    def __init__(self, max_elements, error_rate, keys):
+    @classmethod
+    def _from_hashes(cls, max_elements, error_rate, key_hashes, fingerprints, hasher=None,
+                     num_bits=None):
+        """
+        Build a filter from keys already hashed with hasher, as returned by
+        _hash_keys.
+        """
+        xor = cls.__new__(cls)
+        xor._setup(max_elements, error_rate, len(key_hashes), hasher, num_bits)
+        xor._build(key_hashes, fingerprints)
+        return xor
+
+    def _setup(self, max_elements, error_rate, num_keys, hasher, num_bits):
         self.max_elements = max_elements
         self.error_rate = error_rate  # eps
-        self.size = math.floor(1.23 * len(keys)) + 32  # c
-        self.num_bits = 1 + math.ceil(-math.log2(self.error_rate))  # k
+        self.num_keys = num_keys
+        self._init_layout(num_keys)
+        if num_bits is None:
+            num_bits = 1 + math.ceil(-math.log2(self.error_rate))
+        self.num_bits = num_bits  # k
         # 2^{-k} < eps, or k > -log_2(eps)
 
-        fingerprint_seed = 123
-        self.fingerprint = get_fingerprint(fingerprint_seed, self.num_bits)
-
-        h0, h1, h2 = None, None, None
-        success, stack = False, []
-        while not success:
-            seeds = random.sample(range(1 << 31), 3)
-            if fingerprint_seed in seeds:
-                continue
-            h0, h1, h2 = get_hash_funcs(seeds, self.size)
-            success, stack = self._map_keys(keys, h0, h1, h2)
-
-        self.h0, self.h1, self.h2 = h0, h1, h2
-        # self.backend = array.array('I', [0] * self.size)
-        self.backend = np.empty(self.size, dtype=int)
-        self._assign_values(stack)
-
-    def _map_keys(self, keys, h0, h1, h2):
-        hash_keys = [set() for _ in range(self.size)]
-        for key in keys:
-            hash_keys[h0(key)].add(key)
-            hash_keys[h1(key)].add(key)
-            hash_keys[h2(key)].add(key)
-        queue = []
-        for i in range(self.size):
-            if len(hash_keys[i]) == 1:
-                queue.append(i)
+        self.hasher = utils.get_hasher(hasher)
+        # Narrowest unsigned dtype for the fingerprints: uint8 for Xor8,
+        # uint16 for Xor16
+        self.backend = np.zeros(self.size, dtype=utils.fingerprint_dtype(self.num_bits))
+
+    def _build(self, key_hashes, fingerprints):
+        """Peel the hashed keys, retrying with new seeds, and fill the table"""
+        deduplicated = False
+        stack = None
+        while stack is None:
+            self.seed_hasher = utils.IntHasher(seed=random.randrange(1 << 63))
+            stack = self._map_keys(key_hashes)
+            if stack is None and not deduplicated:
+                # Equal keys share their slots under every seed
+                key_hashes, first = np.unique(key_hashes, return_index=True)
+                fingerprints = fingerprints[first]
+                deduplicated = True
+        self._assign_values(key_hashes, fingerprints, stack)
+
+    def _init_layout(self, num_keys):
+        """Size the table for num_keys keys and set up the slot functions"""
+        self.size = math.floor(1.23 * num_keys) + 32  # c
+        self.h0, self.h1, self.h2 = get_hash_funcs(self.size)
+
+    def __getstate__(self):
+        # The slot functions are closures, rebuilt when unpickling
+        state = self.__dict__.copy()
+        for name in ('h0', 'h1', 'h2'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_layout(self.num_keys)
+
+    def _slots_many(self, hash64s):
+        """
+        Slots of the keys with the mixed 64-bit hashes hash64s.
+        :return: Array with one row of slots per key
+        """
+        return get_slots_many(hash64s, self.size)
+
+    def fingerprint(self, hashed_key):
+        return hashed_key.fingerprint(self.num_bits)
+
+    def _hash_keys(self, keys):
+        """
+        Hash all keys, batch by batch.
+        :return: uint64 array of 64-bit hashes and array of fingerprints
+        """
+        key_hashes = np.empty(len(keys), dtype=np.uint64)
+        fingerprints = np.empty(len(keys), dtype=self.backend.dtype)
+        start = 0
+        for batch in utils.batches(keys, self.batch_size):
+            hashed_keys = self.hasher.hash_many(batch)
+            key_hashes[start:start + len(batch)] = hashed_keys.low
+            fingerprints[start:start + len(batch)] = self.fingerprint(hashed_keys)
+            start += len(batch)
+        return key_hashes, fingerprints
+
+    def _map_keys(self, key_hashes):
+        """
+        Peel the keys off the table. Slots are recomputed from the hashes
+        when needed instead of being stored for every key.
+        :param key_hashes: uint64 array with the 64-bit hash of every key
+        :return: List of (key numbers, slots) array pairs, one per round, or
+        None if some keys cannot be peeled
+        """
+        seed_hasher = self.seed_hasher
+        num_keys = len(key_hashes)
+        index_dtype = _index_dtype(max(self.size, num_keys))
+        counts = np.zeros(self.size, dtype=np.uint32)
+        # XOR of the numbers of the keys using every slot
+        xors = np.zeros(self.size, dtype=index_dtype)
+        for start in range(0, num_keys, self.batch_size):
+            slots = self._slots_many(seed_hasher.hash64_many(key_hashes[start:start + self.batch_size]))
+            keynos = np.arange(start, start + len(slots), dtype=index_dtype)
+            for column in range(slots.shape[1]):
+                np.add.at(counts, slots[:, column], np.uint32(1))
+                np.bitwise_xor.at(xors, slots[:, column], keynos)
+        # Position of every key among the singles of a round, to peel it
+        # once when it is alone in two slots or a slot is listed twice
+        positions = np.empty(num_keys, dtype=index_dtype)
+
         stack = []
-        while queue:
-            index = queue.pop(0)
-            if len(hash_keys[index]) == 1:
-                key = next(iter(hash_keys[index]))
-                stack.append((key, index))
-                hash_keys[h0(key)].remove(key)
-                if len(hash_keys[h0(key)]) == 1:
-                    queue.append(h0(key))
-                hash_keys[h1(key)].remove(key)
-                if len(hash_keys[h1(key)]) == 1:
-                    queue.append(h1(key))
-                hash_keys[h2(key)].remove(key)
-                if len(hash_keys[h2(key)]) == 1:
-                    queue.append(h2(key))
-        if len(stack) == len(keys):
-            return True, stack
-        return False, []
-
-    def _assign_values(self, stack):
-        for key, index in reversed(stack):
-            self.backend[index] = 0
-            self.backend[index] = self.fingerprint(key) ^ self._expected_fingerprint(key)
-
-    def _expected_fingerprint(self, key):
-        return self.backend[self.h0(key)] ^ self.backend[self.h1(key)] ^ self.backend[self.h2(key)]
+        num_peeled = 0
+        singles = np.flatnonzero(counts == 1).astype(index_dtype)
+        while len(singles):
+            peeled = xors[singles]
+            order = np.arange(len(peeled), dtype=index_dtype)
+            positions[peeled] = order
+            first = positions[peeled] == order
+            peeled, singles = peeled[first], singles[first]
+            stack.append((peeled, singles))
+            num_peeled += len(peeled)
+            slots = self._slots_many(seed_hasher.hash64_many(key_hashes[peeled]))
+            for column in range(slots.shape[1]):
+                np.subtract.at(counts, slots[:, column], np.uint32(1))
+                np.bitwise_xor.at(xors, slots[:, column], peeled)
+            slots = slots.ravel()
+            singles = slots[counts[slots] == 1]
+        if num_peeled == num_keys:
+            return stack
+        return None
+
+    def _assign_values(self, key_hashes, fingerprints, stack):
+        """
+        Fill the table in reverse peeling order, so the fingerprint of every
+        key is the XOR of its slots. The slots peeled in one round are
+        not used by any other key of that round, so each round is assigned
+        at once.
+        """
+        for keynos, indices in reversed(stack):
+            key_slots = self._slots_many(self.seed_hasher.hash64_many(key_hashes[keynos]))
+            self.backend[indices] = fingerprints[keynos] ^ self._expected_fingerprints(key_slots)
+
+    def _expected_fingerprint(self, hash64):
+        table = self.backend
+        return table.item(self.h0(hash64)) ^ table.item(self.h1(hash64)) ^ table.item(self.h2(hash64))
+
+    def _expected_fingerprints(self, slots):
+        """Vectorized counterpart of _expected_fingerprint, from the slots of every key"""
+        expected = self.backend[slots[:, 0]]
+        for column in range(1, slots.shape[1]):
+            expected ^= self.backend[slots[:, column]]
+        return expected
 
     def __len__(self):
         return self.size
 
+    @property
+    def bits_per_key(self):
+        """
+        Bits of table per key. Close to 1.23 * num_bits for large filters,
+        since the table has 1.23 slots per key plus 32.
+        """
+        return self.backend.nbytes * 8 / max(self.num_keys, 1)
+
     def __repr__(self):
-        return "<XorFilter: n=%d, error_rate=%f, num_bits=%d>" % (
+        return "<%s: n=%d, error_rate=%f, num_bits=%d>" % (
+            type(self).__name__,
             self.size,
             self.error_rate,
             self.num_bits,
@@ -126,4 +258,48 @@ class XorFilter:
         return key in self
 
     def __contains__(self, key):
-        return self.fingerprint(key) == self._expected_fingerprint(key)
+        return self._contains_hashed(self.hasher.hash(key))
+
+    def _contains_hashed(self, hashed_key):
+        # One digest gives the fingerprint and, mixed with the seed, the slots
+        hash64 = self.seed_hasher.hash64(hashed_key.low)
+        return self.fingerprint(hashed_key) == self._expected_fingerprint(hash64)
+
+    def _contains_many_hashed(self, hashed_keys):
+        """Vectorized counterpart of _contains_hashed"""
+        slots = self._slots_many(self.seed_hasher.hash64_many(hashed_keys.low))
+        fingerprints = self.fingerprint(hashed_keys).astype(self.backend.dtype)
+        return self._expected_fingerprints(slots) == fingerprints
+
+    def contains_many(self, keys):
+        """
+        Check a sequence or NumPy array of keys for membership.
+
+        :return: Boolean array, true where the key is in the filter.
+        """
+        results = []
+        for batch in utils.batches(keys, self.batch_size):
+            results.append(self._contains_many_hashed(self.hasher.hash_many(batch)))
+        if not results:
+            return np.zeros(0, dtype=bool)
+        return np.concatenate(results)
+
+
+class Xor8(XorFilter):
+    """
+    XorFilter with 8-bit fingerprints, stored one byte per slot, for a false
+    positive rate of about 0.4%.
+    """
+
+    def __init__(self, max_elements, keys, hasher=None):
+        super().__init__(max_elements, 2 ** -8, keys, hasher=hasher, num_bits=8)
+
+
+class Xor16(XorFilter):
+    """
+    XorFilter with 16-bit fingerprints, stored two bytes per slot, for a
+    false positive rate of about 0.0015%.
+    """
+
+    def __init__(self, max_elements, keys, hasher=None):
+        super().__init__(max_elements, 2 ** -16, keys, hasher=hasher, num_bits=16)
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""Unit tests for binary_fuse_filter"""
+
+import functools
+import numpy as np
+from xor_filter import XorFilter, BinaryFuseFilter
+from testutils import *
+
+class TestBinaryFuseFilter(unittest.TestCase):
+    def test_states(self):
+        test_filter_states(BinaryFuseFilter)
+
+    def test_random(self):
+        test_filter_random(BinaryFuseFilter)
+
+    def test_four_wise(self):
+        test_filter_random(functools.partial(BinaryFuseFilter, arity=4))
+        with self.assertRaises(ValueError):
+            BinaryFuseFilter(10, 0.01, [], arity=5)
+
+    def test_slots_in_consecutive_segments(self):
+        keys = np.arange(100000)
+        for arity in [3, 4]:
+            fuse = BinaryFuseFilter(len(keys), 0.01, keys, hasher='int', arity=arity)
+            self.assertEqual(fuse.size, (fuse.segment_count + arity - 1) * fuse.segment_length)
+            slots = fuse._slots_many(fuse.seed_hasher.hash64_many(fuse.hasher.hash_many(keys).low))
+            segments = slots // fuse.segment_length
+            self.assertTrue((np.diff(segments, axis=1) == 1).all())
+            self.assertTrue((segments[:, 0] < fuse.segment_count).all())
+
+    def test_contains_many(self):
+        keys = np.arange(100000)
+        for arity in [3, 4]:
+            fuse = BinaryFuseFilter(len(keys), 0.01, keys, hasher='int', arity=arity)
+            self.assertTrue(fuse.contains_many(keys).all())
+            others = np.arange(100000, 120000)
+            found = fuse.contains_many(others)
+            self.assertEqual(found.tolist(), [key in fuse for key in others.tolist()])
+            self.assertLess(found.mean(), 0.01)
+
+    def test_smaller_than_xor_filter(self):
+        keys = np.arange(1000000)
+        xor = XorFilter(len(keys), 0.01, keys, hasher='int')
+        self.assertLess(BinaryFuseFilter(len(keys), 0.01, keys, hasher='int').bits_per_key,
+                        0.93 * xor.bits_per_key)
+        self.assertLess(BinaryFuseFilter(len(keys), 0.01, keys, hasher='int', arity=4).bits_per_key,
+                        0.89 * xor.bits_per_key)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_comparison(self):
+        """Build time, lookup time and bits per key against XorFilter"""
+        compare_static_filters("binary-fuse-filter", [
+            ('xor-filter', functools.partial(XorFilter, hasher='int')),
+            ('binary-fuse-filter 3-wise', functools.partial(BinaryFuseFilter, hasher='int')),
+            ('binary-fuse-filter 4-wise', functools.partial(BinaryFuseFilter, hasher='int', arity=4)),
+        ], range(4, 8))
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_performance(self):
+        test_filter_performance(BinaryFuseFilter, "binary-fuse-filter")
+
+if __name__ == '__main__':
+    unittest.main()
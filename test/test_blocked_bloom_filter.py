@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# pylint: disable=superfluous-parens
+# superfluous-parens: Parentheses are good for clarity and portability
+
+"""Unit tests for blocked_bloom_filter"""
+
+import functools
+import numpy as np
+from bloom_filter import BloomFilter, BlockedBloomFilter, Numpy_backend
+from bloom_filter.blocked_bloom_filter import BLOCK_BITS
+from testutils import *
+
+class TestBlockedBloomFilter(unittest.TestCase):
+    def test_states(self):
+        test_filter_states(BlockedBloomFilter)
+
+    def test_random(self):
+        test_filter_random(BlockedBloomFilter)
+
+    def test_numpy_backend(self):
+        test_filter_random(functools.partial(BlockedBloomFilter, backend=Numpy_backend))
+
+    def test_probes_in_one_block(self):
+        bloom = BlockedBloomFilter(max_elements=10000, error_rate=0.001)
+        self.assertEqual(bloom.num_bits_m % BLOCK_BITS, 0)
+        for state in States():
+            blocks = {bitno // BLOCK_BITS for bitno in bloom.probe_bitnoer(bloom, state)}
+            self.assertEqual(len(blocks), 1)
+
+    def test_sizing(self):
+        classic = BloomFilter(max_elements=100000, error_rate=0.01)
+        blocked = BlockedBloomFilter(max_elements=100000, error_rate=0.01)
+        self.assertGreaterEqual(blocked.num_bits_m, classic.num_bits_m)
+        self.assertLess(blocked.num_bits_m, 1.2 * classic.num_bits_m)
+
+    def test_add_many_contains_many(self):
+        bloom = BlockedBloomFilter(max_elements=10000, error_rate=0.01,
+                                   hasher='int', backend=Numpy_backend)
+        keys = np.arange(0, 20000, 2)
+        bloom.add_many(keys)
+        self.assertTrue(bloom.contains_many(keys).all())
+        self.assertLess(bloom.contains_many(keys + 1).mean(), 0.02)
+        self.assertEqual(bloom.contains_many(keys[:100] + 1).tolist(),
+                         [int(key) in bloom for key in keys[:100] + 1])
+
+    def test_and_or(self):
+        abc = BlockedBloomFilter(max_elements=100, error_rate=0.01)
+        bcd = BlockedBloomFilter(max_elements=100, error_rate=0.01)
+        for character in ['a', 'b', 'c']:
+            abc += character
+        for character in ['b', 'c', 'd']:
+            bcd += character
+
+        union = BlockedBloomFilter(max_elements=100, error_rate=0.01)
+        union |= abc
+        union |= bcd
+        for character in ['a', 'b', 'c', 'd']:
+            self.assertIn(character, union)
+
+        abc &= bcd
+        self.assertNotIn('a', abc)
+        self.assertIn('b', abc)
+        self.assertIn('c', abc)
+        self.assertNotIn('d', abc)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_performance(self):
+        test_filter_performance(BlockedBloomFilter, "blocked-bloom-filter")
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_layout(self):
+        """Batch throughput of the blocked layout against the classic one"""
+        lines = []
+        for exponent in range(5, 8):
+            elements = 10 ** exponent
+            members = np.arange(elements)
+            non_members = np.arange(elements, 2 * elements)
+            for filter_class in [BloomFilter, BlockedBloomFilter]:
+                bloom = filter_class(max_elements=elements, error_rate=0.01,
+                                     hasher='int', backend=Numpy_backend)
+                add_time = time_call(bloom.add_many, members, repeat=1)
+                contains_time = time_call(bloom.contains_many, members)
+                miss_time = time_call(bloom.contains_many, non_members)
+                error_rate = bloom.contains_many(non_members).mean()
+                lines.append(
+                    f"{filter_class.__name__} with {elements} elements, error rate 0.01: "
+                    f"bits/key {bloom.num_bits_m / elements:.2f}, k {bloom.num_probes_k}, "
+                    f"add_many {add_time:.3f}s, contains_many hits {contains_time:.3f}s, "
+                    f"misses {miss_time:.3f}s, false positive rate {error_rate:.4f}"
+                )
+        write_benchmark("blocked-bloom-filter", "layout", lines)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,7 +6,10 @@
 
 """Unit tests for bloom_filter"""
 
-from bloom_filter import BloomFilter
+import functools
+import tempfile
+import numpy as np
+from bloom_filter import BloomFilter, BlockedBloomFilter, Array_backend, Numpy_backend
 from testutils import *
 
 class TestBloomFilter(unittest.TestCase):
@@ -16,6 +19,69 @@ class TestBloomFilter(unittest.TestCase):
     def test_random(self):
         test_filter_random(BloomFilter)
 
+    def test_numpy_backend(self):
+        test_filter_states(functools.partial(BloomFilter, backend=Numpy_backend))
+
+    def test_add_many_contains_many(self):
+        for backend in [Array_backend, Numpy_backend]:
+            bloom = BloomFilter(max_elements=2000, error_rate=0.01, backend=backend)
+            bloom.add_many(Random_content())
+            self.assertTrue(all(value in bloom for value in Random_content()))
+            self.assertTrue(bloom.contains_many(Random_content()).all())
+            candidates = [''.join(random.sample(CHARACTERS, 5)) for _ in range(1000)]
+            self.assertEqual(bloom.contains_many(candidates).tolist(),
+                             [candidate in bloom for candidate in candidates])
+            self.assertEqual(len(bloom.contains_many([])), 0)
+
+    def test_add_many_int_keys(self):
+        bloom = BloomFilter(max_elements=10000, error_rate=0.01,
+                            hasher='int', backend=Numpy_backend)
+        keys = np.arange(0, 20000, 2)
+        bloom.add_many(keys)
+        self.assertTrue(bloom.contains_many(keys).all())
+        self.assertLess(bloom.contains_many(keys + 1).mean(), 0.02)
+        self.assertIn(int(keys[5]), bloom)
+
+    def test_file_backed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'states.bloom')
+            with BloomFilter(max_elements=1000, error_rate=0.01, hasher='int',
+                             filename=filename) as bloom:
+                bloom.add_many(range(0, 2000, 2))
+
+            reader = BloomFilter.open(filename)
+            self.assertEqual(reader.num_bits_m, bloom.num_bits_m)
+            self.assertEqual(reader.num_probes_k, bloom.num_probes_k)
+            self.assertEqual(reader.hasher, bloom.hasher)
+            self.assertTrue(reader.contains_many(range(0, 2000, 2)).all())
+            self.assertNotIn(1, reader)
+            with self.assertRaises(ValueError):
+                reader.add(1)
+
+            # Both mappings share the same pages
+            writer = BloomFilter.open(filename, mode='r+')
+            writer.add(1)
+            self.assertIn(1, reader)
+            writer.close()
+            reader.close()
+
+            with self.assertRaises(ValueError):
+                BlockedBloomFilter.open(filename)
+            # A file-backed filter always uses Mmap_backend
+            with self.assertRaises(ValueError):
+                BloomFilter(max_elements=1000, error_rate=0.01, backend=Numpy_backend,
+                            filename=filename)
+
+    def test_file_backed_blocked(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'states.bloom')
+            with BlockedBloomFilter(max_elements=100, error_rate=0.01,
+                                    filename=filename) as bloom:
+                for state in States():
+                    bloom.add(state)
+            with BlockedBloomFilter.open(filename) as reader:
+                self.assertTrue(all(state in reader for state in States()))
+
     def test_and(self):
         """Test the & operator"""
 
@@ -53,11 +119,87 @@ class TestBloomFilter(unittest.TestCase):
         self.assertIn('d', abc)
         self.assertNotIn('e', abc)
 
+    def test_merge(self):
+        for backend in [Array_backend, Numpy_backend]:
+            shards = [BloomFilter(max_elements=1000, error_rate=0.01, backend=backend)
+                      for _ in range(5)]
+            for valueno, value in enumerate(Random_content()):
+                shards[valueno % 5].add(value)
+            merged = BloomFilter.merge(shards)
+            self.assertTrue(all(value in merged for value in Random_content()))
+            self.assertEqual(merged.fill_ratio(),
+                             BloomFilter.merge(reversed(shards)).fill_ratio())
+            # The shards are left alone
+            self.assertNotIn(Random_content.random_content[1], shards[0])
+
+    def test_mismatched_templates(self):
+        small = BloomFilter(max_elements=100, error_rate=0.01)
+        with self.assertRaises(ValueError):
+            small |= BloomFilter(max_elements=1000, error_rate=0.01)
+        with self.assertRaises(ValueError):
+            small &= BloomFilter(max_elements=100, error_rate=0.01, hasher='int')
+        with self.assertRaises(ValueError):
+            small |= BloomFilter(max_elements=100, error_rate=0.01, backend=Numpy_backend)
+        with self.assertRaises(ValueError):
+            BloomFilter.merge([small, BloomFilter(max_elements=1000, error_rate=0.01)])
+        with self.assertRaises(ValueError):
+            BloomFilter.merge([])
+
+    def test_approx_len(self):
+        for backend in [Array_backend, Numpy_backend]:
+            bloom = BloomFilter(max_elements=20000, error_rate=0.01, backend=backend)
+            self.assertEqual(bloom.approx_len(), 0)
+            self.assertEqual(bloom.fill_ratio(), 0)
+            bloom.add_many(Evens(20000))
+            self.assertAlmostEqual(bloom.approx_len(), 10000, delta=300)
+            self.assertGreater(bloom.fill_ratio(), 0.1)
+            self.assertLess(bloom.fill_ratio(), 0.5)
+
     def test_probe_count(self):
         # test prob count ok
         bloom = BloomFilter(1000000, error_rate=.99)
         self.assertEqual(bloom.num_probes_k, 1)
 
+    def test_int_hasher(self):
+        bloom = BloomFilter(max_elements=1000, error_rate=0.01, hasher='int')
+        for value in range(0, 2000, 2):
+            bloom.add(value)
+        self.assertTrue(all(value in bloom for value in range(0, 2000, 2)))
+        false_positives = sum(value in bloom for value in range(1, 20000, 2))
+        self.assertLess(false_positives, 0.02 * 10000)
+
+    def test_bytes_keys(self):
+        bloom = BloomFilter(max_elements=100, error_rate=0.01)
+        bloom.add(b'abc')
+        self.assertIn(bytearray(b'abc'), bloom)
+        self.assertNotIn(b'abd', bloom)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_batch(self):
+        """Bulk load of 10^7 keys with add_many against add, for both backends"""
+        lines = []
+        elements = 10 ** 7
+        keys = np.arange(elements)
+        # Scalar calls are timed on a sample, at the same load
+        sample = keys[:10 ** 6].tolist()
+        for backend in [Array_backend, Numpy_backend]:
+            bloom = BloomFilter(max_elements=elements, error_rate=0.01, hasher='int', backend=backend)
+            add_many_time = time_call(bloom.add_many, keys, repeat=1)
+            contains_many_time = time_call(bloom.contains_many, keys, repeat=1)
+            scalar = BloomFilter(max_elements=elements, error_rate=0.01, hasher='int', backend=backend)
+            add_time = time_call(lambda: [scalar.add(key) for key in sample], repeat=1)
+            contains_time = time_call(lambda: [key in scalar for key in sample], repeat=1)
+            lines.append(
+                f"bloom-filter with {elements} elements, {backend.__name__}: "
+                f"add {add_time / len(sample) * 1e9:.0f}ns/key, "
+                f"add_many {add_many_time / elements * 1e9:.0f}ns/key "
+                f"({add_time / len(sample) / (add_many_time / elements):.1f}x), "
+                f"contains {contains_time / len(sample) * 1e9:.0f}ns/key, "
+                f"contains_many {contains_many_time / elements * 1e9:.0f}ns/key "
+                f"({contains_time / len(sample) / (contains_many_time / elements):.1f}x)"
+            )
+        write_benchmark("bloom-filter", "batch", lines)
+
     @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
     def test_performance(self):
         test_filter_performance(BloomFilter, "bloom-filter")
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# pylint: disable=superfluous-parens
+# superfluous-parens: Parentheses are good for clarity and portability
+
+"""Unit tests for counting_bloom_filter"""
+
+import numpy as np
+from bloom_filter import BloomFilter, CountingBloomFilter
+from bloom_filter.counting_bloom_filter import Counter_backend, MAX_COUNT
+from testutils import *
+
+class TestCountingBloomFilter(unittest.TestCase):
+    def test_states(self):
+        test_filter_states(CountingBloomFilter)
+
+    def test_random(self):
+        test_filter_random(CountingBloomFilter)
+
+    def test_delete(self):
+        counting = CountingBloomFilter(max_elements=100, error_rate=0.01)
+        for state in States():
+            counting.add(state)
+        for state in States.states[:25]:
+            self.assertTrue(counting.delete(state))
+        for state in States.states[25:]:
+            self.assertIn(state, counting)
+        self.assertLessEqual(sum(state in counting for state in States.states[:25]), 1)
+        self.assertFalse(counting.delete('Atlantis'))
+
+    def test_add_twice_delete_once(self):
+        counting = CountingBloomFilter(max_elements=100, error_rate=0.01)
+        counting.add('Ohio')
+        counting.add('Ohio')
+        counting.delete('Ohio')
+        self.assertIn('Ohio', counting)
+        counting.delete('Ohio')
+        self.assertNotIn('Ohio', counting)
+
+    def test_batch(self):
+        counting = CountingBloomFilter(max_elements=10000, error_rate=0.01, hasher='int')
+        keys = np.arange(10000)
+        counting.add_many(keys)
+        self.assertTrue(counting.contains_many(keys).all())
+        self.assertTrue(counting.delete_many(keys[:5000]).all())
+        self.assertTrue(counting.contains_many(keys[5000:]).all())
+        self.assertLess(counting.contains_many(keys[:5000]).mean(), 0.02)
+        self.assertEqual(counting.contains_many(keys[:100]).tolist(),
+                         [int(key) in counting for key in keys[:100]])
+
+    def test_batch_duplicates(self):
+        counting = CountingBloomFilter(max_elements=100, error_rate=0.01)
+        counting.add('a')
+        self.assertEqual(counting.delete_many(['a', 'a']).tolist(), [True, False])
+        self.assertFalse(counting.backend.counts().any())
+        batch = CountingBloomFilter(max_elements=100, error_rate=0.01)
+        scalar = CountingBloomFilter(max_elements=100, error_rate=0.01)
+        for state in ['Ohio', 'Ohio', 'Utah'] + States.states:
+            batch.add(state)
+            scalar.add(state)
+        keys = ['Ohio', 'Utah', 'Ohio', 'Ohio', 'Utah', 'Iowa']
+        expected = [scalar.delete(key) for key in keys]
+        self.assertEqual(batch.delete_many(keys).tolist(), expected)
+        self.assertTrue(np.array_equal(batch.backend.counts(), scalar.backend.counts()))
+
+    def test_counters(self):
+        backend = Counter_backend(5)
+        for _ in range(20):
+            backend.increment(3)
+        backend.increment_many(np.array([0, 1, 1, 4, 4, 4], dtype=np.uint64))
+        self.assertEqual(backend.counts().tolist(), [1, 2, 0, MAX_COUNT, 3])
+        backend.decrement_many(np.array([1, 3, 4, 2], dtype=np.uint64))
+        backend.decrement(0)
+        backend.decrement(0)
+        self.assertEqual(backend.counts().tolist(), [0, 1, 0, MAX_COUNT, 2])
+        backend.increment_many(np.full(40, 1, dtype=np.uint64))
+        self.assertEqual(backend.counts().tolist(), [0, MAX_COUNT, 0, MAX_COUNT, 2])
+
+    def test_to_bloom_filter(self):
+        counting = CountingBloomFilter(max_elements=1000, error_rate=0.01)
+        for value in Random_content():
+            counting.add(value)
+        bloom = counting.to_bloom_filter()
+        self.assertIsInstance(bloom, BloomFilter)
+        self.assertEqual(bloom.num_bits_m, counting.num_bits_m)
+        candidates = list(Random_content()) + [random_string() for _ in range(1000)]
+        self.assertEqual(bloom.contains_many(candidates).tolist(),
+                         counting.contains_many(candidates).tolist())
+
+    def test_file_backed(self):
+        with self.assertRaises(NotImplementedError):
+            CountingBloomFilter(max_elements=100, error_rate=0.01, filename='counting.bloom')
+        with self.assertRaises(NotImplementedError):
+            CountingBloomFilter.open('counting.bloom')
+        self.assertFalse(os.path.exists('counting.bloom'))
+
+    def test_and_or(self):
+        abc = CountingBloomFilter(max_elements=100, error_rate=0.01)
+        bcd = CountingBloomFilter(max_elements=100, error_rate=0.01)
+        for character in ['a', 'b', 'c']:
+            abc += character
+        for character in ['b', 'c', 'd']:
+            bcd += character
+        abc |= bcd
+        for character in ['a', 'b', 'c', 'd']:
+            self.assertIn(character, abc)
+        # 'b' was counted by both filters
+        abc.delete('b')
+        self.assertIn('b', abc)
+        abc &= bcd
+        self.assertNotIn('a', abc)
+        self.assertIn('b', abc)
+        self.assertIn('c', abc)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_performance(self):
+        test_filter_performance(CountingBloomFilter, "counting-bloom-filter")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,9 @@
 
 """Unit tests for cuckoo_filter"""
 
+import functools
+import numpy as np
+import utils
 from cuckoo_filter import CuckooFilter
 from testutils import *
 
@@ -21,6 +24,316 @@ class TestCuckooFilter(unittest.TestCase):
         cuckoo = CuckooFilter(1000000, error_rate=.99)
         assert cuckoo.fingerprint_size >= 1
 
+    def test_delete(self):
+        cuckoo = CuckooFilter(1000, error_rate=0.01)
+        for state in States():
+            cuckoo.add(state)
+        for state in States():
+            self.assertTrue(cuckoo.delete(state))
+        self.assertEqual(len(cuckoo), 0)
+        self.assertNotIn('Ohio', cuckoo)
+
+    def test_alternate_index(self):
+        cuckoo = CuckooFilter(1000, error_rate=0.01)
+        for fingerprint in range(1 << cuckoo.fingerprint_size):
+            j = cuckoo._get_alternate_index(3, fingerprint)
+            self.assertLess(j, cuckoo.num_buckets)
+            self.assertEqual(cuckoo._get_alternate_index(j, fingerprint), 3)
+
+    def test_batch(self):
+        cuckoo = CuckooFilter(10000, error_rate=0.01)
+        cuckoo.add_many(range(9000))
+        self.assertEqual(len(cuckoo), 9000)
+        self.assertTrue(cuckoo.contains_many(np.arange(9000)).all())
+        expected = [key in cuckoo for key in range(9000, 20000)]
+        self.assertEqual(cuckoo.contains_many(range(9000, 20000)).tolist(), expected)
+        self.assertTrue(cuckoo.delete_many(list(range(0, 9000, 2))).all())
+        self.assertEqual(len(cuckoo), 4500)
+        self.assertTrue(cuckoo.contains_many(range(1, 9000, 2)).all())
+        self.assertEqual(len(cuckoo.contains_many([])), 0)
+
+    def test_batch_matches_scalar(self):
+        for semi_sort in [False, True]:
+            batch = CuckooFilter(1000, error_rate=0.001, semi_sort=semi_sort)
+            scalar = CuckooFilter(1000, error_rate=0.001, semi_sort=semi_sort)
+            keys = [state for state in States()] * 2
+            batch.add_many(keys)
+            for key in keys:
+                scalar.add(key)
+            self.assertEqual(len(batch), len(scalar))
+            for index in range(batch.num_buckets):
+                self.assertEqual(sorted(batch.buckets.bucket(index)),
+                                 sorted(scalar.buckets.bucket(index)))
+            # Every key was added twice, so it survives one delete
+            self.assertTrue(batch.delete_many(list(States())).all())
+            self.assertTrue(batch.contains_many(list(States())).all())
+            self.assertTrue(batch.delete_many(list(States())).all())
+            self.assertFalse(batch.delete_many(['Ohio']).any())
+            self.assertEqual(len(batch), 0)
+
+    def test_batch_overflow(self):
+        cuckoo = CuckooFilter(1000, error_rate=0.01, hasher='int')
+        cuckoo.add_many(np.arange(int(0.9 * cuckoo.num_buckets * cuckoo.bucket_size)))
+        self.assertTrue(cuckoo.contains_many(np.arange(len(cuckoo))).all())
+
+    def test_stash(self):
+        cuckoo = CuckooFilter(1000, error_rate=0.01, max_displacements=20)
+        added = []
+        with self.assertRaises(Exception):
+            for key in range(10000):
+                cuckoo.add(key)
+                added.append(key)
+        # Inserts only fail once the stash is full, and nothing is lost
+        self.assertEqual(len(cuckoo.stash), cuckoo.stash_size)
+        self.assertEqual(len(cuckoo), len(added))
+        self.assertTrue(all(key in cuckoo for key in added))
+        self.assertTrue(cuckoo.contains_many(added).all())
+        self.assertTrue(cuckoo.delete_many(added[::2]).all())
+        self.assertEqual(cuckoo.stash, [])
+        for key in added[1::2]:
+            self.assertTrue(cuckoo.delete(key))
+        self.assertEqual(len(cuckoo), 0)
+        self.assertEqual(np.count_nonzero(cuckoo.buckets.table), 0)
+
+    def test_auto_grow(self):
+        for semi_sort in [False, True]:
+            cuckoo = CuckooFilter(1000, error_rate=0.001, auto_grow=True, semi_sort=semi_sort)
+            for key in range(10000):
+                cuckoo.add(key)
+                if key % 1009 == 0:
+                    # Keys stay visible while buckets move to the doubled table
+                    self.assertTrue(all(k in cuckoo for k in range(0, key + 1, 13)))
+            self.assertEqual(len(cuckoo), 10000)
+            self.assertEqual(cuckoo.num_buckets, cuckoo.initial_num_buckets << cuckoo.num_doublings)
+            self.assertGreaterEqual(cuckoo.num_doublings, 3)
+            self.assertTrue(cuckoo.contains_many(range(10000)).all())
+            for key in range(0, 10000, 2):
+                self.assertTrue(cuckoo.delete(key))
+            self.assertTrue(all(key in cuckoo for key in range(1, 10000, 2)))
+
+    def test_grow(self):
+        cuckoo = CuckooFilter(1000, error_rate=0.001)
+        for state in States():
+            cuckoo.add(state)
+        cuckoo.grow()
+        cuckoo.grow()
+        self.assertEqual(cuckoo.num_buckets, 4 * cuckoo.initial_num_buckets)
+        self.assertTrue(all(state in cuckoo for state in States()))
+        self.assertNotIn('Atlantis', cuckoo)
+        cuckoo.add('Atlantis')
+        self.assertIn('Atlantis', cuckoo)
+
+    def test_auto_grow_batch(self):
+        cuckoo = CuckooFilter(1000, error_rate=0.001, auto_grow=True, hasher='int')
+        cuckoo.add_many(np.arange(50000))
+        self.assertEqual(len(cuckoo), 50000)
+        self.assertTrue(cuckoo.contains_many(np.arange(50000)).all())
+
+    def test_batch_while_growing(self):
+        for semi_sort in [False, True]:
+            cuckoo = CuckooFilter(1000, error_rate=0.001, auto_grow=True, semi_sort=semi_sort)
+            key = 0
+            while cuckoo._next_buckets is None:
+                cuckoo.add(key)
+                key += 1
+            for _ in range(10):
+                cuckoo.add(key)
+                key += 1
+            num_migrated = cuckoo._num_migrated
+            self.assertGreater(num_migrated, 0)
+            self.assertLess(num_migrated, cuckoo.num_buckets)
+            # Batch lookups and deletes read both tables without finishing the doubling
+            found = cuckoo.contains_many(range(2 * key))
+            self.assertEqual(found.tolist(), [k in cuckoo for k in range(2 * key)])
+            self.assertTrue(found[:key].all())
+            self.assertTrue(cuckoo.delete_many(list(range(0, key, 2))).all())
+            self.assertEqual(cuckoo._num_migrated, num_migrated)
+            self.assertIsNotNone(cuckoo._next_buckets)
+            self.assertEqual(len(cuckoo), key - len(range(0, key, 2)))
+            self.assertTrue(cuckoo.contains_many(range(1, key, 2)).all())
+            # A small batch moves as many buckets as the same number of adds
+            cuckoo.add_many(range(key, key + 2))
+            self.assertEqual(cuckoo._num_migrated, num_migrated + 2 * cuckoo.growth_step)
+            self.assertTrue(cuckoo.contains_many(range(key, key + 2)).all())
+            cuckoo.grow()
+            self.assertTrue(all(k in cuckoo for k in range(1, key + 2, 2)))
+
+    def test_bfs_eviction(self):
+        cuckoo = CuckooFilter(4000, error_rate=0.001, eviction='bfs')
+        capacity = cuckoo.num_buckets * cuckoo.bucket_size
+        for key in range(int(0.95 * capacity)):
+            cuckoo.add(key)
+        self.assertTrue(all(key in cuckoo for key in range(int(0.95 * capacity))))
+        self.assertGreater(sum(cuckoo.eviction_path_lengths.values()) -
+                           cuckoo.eviction_path_lengths[0], 0)
+        self.assertLessEqual(max(cuckoo.eviction_path_lengths), cuckoo.bfs_max_depth)
+        with self.assertRaises(ValueError):
+            CuckooFilter(1000, eviction='dfs')
+
+    def test_find_eviction_path(self):
+        # Buckets 0 and 1 are full; 'a' in bucket 1 can move to bucket 2
+        contents = {0: ['x', 'y'], 1: ['z', 'a'], 2: ['b'], 3: ['c', 'd']}
+        alternates = {'x': 3, 'y': 1, 'z': 3, 'a': 2, 'c': 0, 'd': 1}
+        path = utils.find_eviction_path([0], contents.get, lambda index, f: alternates[f],
+                                        lambda index: len(contents[index]) < 2, max_depth=2)
+        self.assertEqual(path, [(0, 'y', 1), (1, 'a', 2)])
+        self.assertIsNone(utils.find_eviction_path([0], contents.get,
+                                                   lambda index, f: alternates[f],
+                                                   lambda index: len(contents[index]) < 2,
+                                                   max_depth=1))
+
+    def test_packed_storage(self):
+        cuckoo = CuckooFilter(1000, error_rate=0.01)
+        self.assertEqual(cuckoo.buckets.table.shape, (cuckoo.num_buckets, 4))
+        self.assertEqual(cuckoo.buckets.table.dtype, np.uint16)
+        self.assertEqual(CuckooFilter(1000, error_rate=0.2).buckets.table.dtype, np.uint8)
+        for state in States():
+            cuckoo.add(state)
+        self.assertEqual(np.count_nonzero(cuckoo.buckets.table), len(cuckoo))
+
+    def test_bucket_array(self):
+        buckets = utils.BucketArray(2, 2, 8)
+        self.assertTrue(buckets.insert(1, 5))
+        self.assertTrue(buckets.insert(1, 5))
+        self.assertFalse(buckets.insert(1, 7))
+        self.assertTrue(buckets.is_full(1))
+        self.assertTrue(buckets.contains(1, 5))
+        self.assertFalse(buckets.contains(0, 5))
+        self.assertEqual(buckets.swap(1, 7), 5)
+        self.assertEqual(sorted(buckets.bucket(1)), [5, 7])
+        self.assertTrue(buckets.place(1, 9, 7))
+        self.assertFalse(buckets.place(1, 9, 7))
+        self.assertEqual(sorted(buckets.bucket(1)), [5, 9])
+        self.assertTrue(buckets.delete(1, 5))
+        self.assertFalse(buckets.delete(1, 5))
+        self.assertEqual(buckets.count(1), 1)
+
+    def test_nonzero_fingerprint(self):
+        hashed_keys = utils.HashedKey(np.zeros(3, dtype=np.uint64),
+                                      np.array([0, 255, 256], dtype=np.uint64))
+        self.assertEqual(hashed_keys.nonzero_fingerprint(8).tolist(), [1, 1, 2])
+        self.assertEqual(utils.hash_key('Ohio').nonzero_fingerprint(1), 1)
+
+    def test_semi_sort_tables(self):
+        decode = utils.bucket_array.SEMI_SORT_DECODE
+        encode = utils.bucket_array.SEMI_SORT_ENCODE
+        self.assertEqual(len(decode), 3876)
+        for index, prefixes in enumerate(decode.tolist()):
+            self.assertEqual(prefixes, sorted(prefixes))
+            packed = prefixes[0] << 12 | prefixes[1] << 8 | prefixes[2] << 4 | prefixes[3]
+            self.assertEqual(encode[packed], index)
+
+    def test_semi_sorted_bucket_array(self):
+        buckets = utils.SemiSortedBucketArray(50, 4, 9)
+        self.assertEqual(buckets.bits_per_bucket, 32)
+        expected = [[] for _ in range(50)]
+        rng = random.Random(0)
+        for _ in range(2000):
+            index = rng.randrange(50)
+            fingerprint = rng.randrange(1, 1 << 9)
+            if rng.random() < 0.6:
+                self.assertEqual(buckets.insert(index, fingerprint), len(expected[index]) < 4)
+                if len(expected[index]) < 4:
+                    expected[index].append(fingerprint)
+            else:
+                self.assertEqual(buckets.delete(index, fingerprint),
+                                 fingerprint in expected[index])
+                if fingerprint in expected[index]:
+                    expected[index].remove(fingerprint)
+            self.assertEqual(sorted(buckets.bucket(index)), sorted(expected[index]))
+        index = next(index for index, fingerprints in enumerate(expected) if fingerprints)
+        self.assertTrue(buckets.place(index, 3, expected[index][0]))
+        expected[index][0] = 3
+        self.assertEqual(sorted(buckets.bucket(index)), sorted(expected[index]))
+        with self.assertRaises(ValueError):
+            utils.SemiSortedBucketArray(50, 2, 9)
+
+    def test_semi_sort(self):
+        test_filter_states(functools.partial(CuckooFilter, semi_sort=True))
+        cuckoo = CuckooFilter(1000, error_rate=0.01, semi_sort=True)
+        for state in States():
+            cuckoo.add(state)
+        for state in States():
+            self.assertTrue(cuckoo.delete(state))
+        self.assertEqual(len(cuckoo), 0)
+        with self.assertRaises(ValueError):
+            CuckooFilter(1000, bucket_size=2, semi_sort=True)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_batch(self):
+        """Batch operations against one call per key"""
+        lines = []
+        for exponent in range(4, 7):
+            elements = 10 ** exponent
+            keys = np.arange(elements)
+            for hasher in ['murmur', 'int']:
+                scalar = CuckooFilter(elements / 0.9, error_rate=0.01, hasher=hasher)
+                add_time = time_call(lambda: [scalar.add(key) for key in keys.tolist()], repeat=1)
+                contains_time = time_call(lambda: [key in scalar for key in keys.tolist()])
+                batch = CuckooFilter(elements / 0.9, error_rate=0.01, hasher=hasher)
+                add_many_time = time_call(batch.add_many, keys, repeat=1)
+                contains_many_time = time_call(batch.contains_many, keys)
+                lines.append(
+                    f"cuckoo-filter with {elements} elements, hasher {hasher}: "
+                    f"add {add_time:.3f}s, add_many {add_many_time:.3f}s, "
+                    f"contains {contains_time:.3f}s, contains_many {contains_many_time:.3f}s"
+                )
+        write_benchmark("cuckoo-filter", "batch", lines)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_growth(self):
+        """Insert latency of auto-growing filters, amortized against all at once"""
+        lines = []
+        elements = 10 ** 6
+        for growth_step in [CuckooFilter.growth_step, elements]:
+            cuckoo = CuckooFilter(10000, error_rate=0.0001, auto_grow=True, hasher='int')
+            cuckoo.growth_step = growth_step
+            latencies = []
+            for key in range(elements):
+                time0 = time.perf_counter()
+                cuckoo.add(key)
+                latencies.append(time.perf_counter() - time0)
+            latencies = np.array(latencies) * 1e6
+            lines.append(
+                f"cuckoo-filter growing from 10000 to {elements} elements, "
+                f"growth_step {growth_step}: doublings {cuckoo.num_doublings}, "
+                f"insert latency median {np.median(latencies):.1f}us, "
+                f"p99 {np.percentile(latencies, 99):.1f}us, "
+                f"p99.99 {np.percentile(latencies, 99.99):.1f}us, max {latencies.max():.1f}us, "
+                f"total {latencies.sum() / 1e6:.2f}s, false positive rate "
+                f"{cuckoo.contains_many(np.arange(elements, 2 * elements)).mean():.5f}"
+            )
+        write_benchmark("cuckoo-filter", "growth", lines)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_eviction(self):
+        test_eviction_performance(CuckooFilter, "cuckoo-filter")
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_semi_sort(self):
+        """Bits per item and lookup cost of semi-sorted buckets"""
+        lines = []
+        elements = 10 ** 5
+        for error_rate in [0.05, 0.01, 0.001, 0.0001]:
+            for semi_sort in [False, True]:
+                cuckoo = CuckooFilter(elements / 0.95, error_rate=error_rate,
+                                      semi_sort=semi_sort)
+                for element in range(elements):
+                    cuckoo.add(element)
+                hit_time = time_call(lambda: [element in cuckoo for element in range(elements)])
+                miss_time = time_call(lambda: [element in cuckoo
+                                               for element in range(elements, 2 * elements)])
+                num_slots = cuckoo.num_buckets * cuckoo.bucket_size
+                lines.append(
+                    f"cuckoo-filter with {elements} elements, error rate {error_rate}, "
+                    f"semi_sort {semi_sort}: fingerprint bits {cuckoo.fingerprint_size}, "
+                    f"bits/slot {cuckoo.buckets.nbytes * 8 / num_slots:.2f}, "
+                    f"bits/item {cuckoo.buckets.nbytes * 8 / len(cuckoo):.2f}, "
+                    f"contains hits {hit_time / elements * 1e6:.2f}us, "
+                    f"misses {miss_time / elements * 1e6:.2f}us"
+                )
+        write_benchmark("cuckoo-filter", "semi-sort", lines)
+
     @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
     def test_performance(self):
         test_filter_performance(CuckooFilter, "cuckoo-filter")
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""Unit tests for utils.hashutils"""
+
+import numpy as np
+import utils
+from testutils import *
+
+class TestHashUtils(unittest.TestCase):
+    def test_hash_many_matches_scalar(self):
+        keys = list(States()) + [0, 17, 2 ** 40, 1.5]
+        fingerprints = utils.fingerprint_many(keys, 12)
+        hash_codes = utils.hash_code_many(keys, 1000)
+        self.assertEqual(fingerprints.dtype, np.uint64)
+        self.assertEqual(hash_codes.dtype, np.uint64)
+        for key, fp, index in zip(keys, fingerprints, hash_codes):
+            self.assertEqual(utils.fingerprint(key, 12), fp)
+            self.assertEqual(utils.hash_code(key, 1000), index)
+
+    def test_hashed_key_matches_scalar(self):
+        keys = list(States())
+        hashed_keys = utils.hash_keys(keys)
+        for keyno, key in enumerate(keys):
+            hashed_key = utils.hash_key(key)
+            self.assertEqual(hashed_key.low, hashed_keys.low[keyno])
+            self.assertEqual(hashed_key.high, hashed_keys.high[keyno])
+            for probeno in range(1, 8):
+                self.assertEqual(hashed_key.probe(probeno, 1000003),
+                                 hashed_keys.probe(probeno, 1000003)[keyno])
+
+    def test_hash_many_numpy_keys(self):
+        keys = np.arange(100)
+        self.assertTrue(np.array_equal(utils.hash_many(keys, 7),
+                                       utils.hash_many(keys.tolist(), 7)))
+
+    def test_hash_many_empty(self):
+        self.assertEqual(len(utils.hash_many([], 7)), 0)
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            utils.hash_many([object()], 7)
+
+class TestHashers(unittest.TestCase):
+    def test_bytes_like_keys(self):
+        hasher = utils.MurmurHasher()
+        expected = hasher.hash(b'Ohio')
+        for key in [bytearray(b'Ohio'), memoryview(b'xOhio')[1:], 'Ohio']:
+            hashed_key = hasher.hash(key)
+            self.assertEqual(hashed_key.low, expected.low)
+            self.assertEqual(hashed_key.high, expected.high)
+
+    def test_murmur_str_fallback(self):
+        hasher = utils.MurmurHasher()
+        self.assertEqual(hasher.hash(17).low, hasher.hash('17').low)
+
+    def test_int_hasher_matches_scalar(self):
+        hasher = utils.IntHasher(seed=5)
+        keys = [0, 1, -1, 2 ** 63, 2 ** 64 - 1, 123456789]
+        hashed_keys = hasher.hash_many(keys)
+        unsigned_keys = np.array([key % 2 ** 64 for key in keys], dtype=np.uint64)
+        self.assertTrue(np.array_equal(hashed_keys.low,
+                                       hasher.hash_many(unsigned_keys).low))
+        self.assertEqual(hasher.hash_many(np.array([-1])).low[0],
+                         hasher.hash(-1).low)
+        for keyno, key in enumerate(keys):
+            hashed_key = hasher.hash(key)
+            self.assertEqual(hashed_key.low, hashed_keys.low[keyno])
+            self.assertEqual(hashed_key.high, hashed_keys.high[keyno])
+            self.assertEqual(hasher.hash64(key), hashed_key.low)
+        self.assertTrue(np.array_equal(hasher.hash64_many(keys), hashed_keys.low))
+
+    def test_int_hasher_rejects_str(self):
+        with self.assertRaises(TypeError):
+            utils.IntHasher().hash('1')
+        with self.assertRaises(TypeError):
+            utils.IntHasher().hash_many(['1'])
+
+    def test_alternate_offset_table(self):
+        table = utils.alternate_offset_table(10, 300)
+        self.assertEqual(len(table), 1024)
+        self.assertEqual(table.dtype, np.uint16)
+        for fingerprint in range(1024):
+            self.assertEqual(table[fingerprint],
+                             utils.alternate_offset(fingerprint, 300))
+        self.assertIsNone(utils.alternate_offset_table(64, 300))
+
+    def test_get_hasher(self):
+        self.assertEqual(utils.get_hasher(), utils.MurmurHasher())
+        self.assertEqual(utils.get_hasher('int'), utils.IntHasher())
+        self.assertNotEqual(utils.IntHasher(1), utils.IntHasher(2))
+        self.assertNotEqual(utils.IntHasher(1), utils.MurmurHasher(1))
+        with self.assertRaises(ValueError):
+            utils.get_hasher('md5')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""Unit tests for partitioned_xor_filter"""
+
+import tempfile
+import tracemalloc
+import numpy as np
+from xor_filter import XorFilter, PartitionedXorFilter
+from testutils import *
+
+class SmallPartitions(PartitionedXorFilter):
+    """Partitions of a few thousand keys, so small key sets are spilled and split"""
+    batch_size = 1000
+    partition_size = 1 << 12
+
+class TestPartitionedXorFilter(unittest.TestCase):
+    def test_states(self):
+        test_filter_states(PartitionedXorFilter)
+
+    def test_random(self):
+        test_filter_random(PartitionedXorFilter)
+
+    def test_partitions(self):
+        keys = [str(key) for key in range(20000)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            xor = SmallPartitions(len(keys), 0.01, iter(keys), temp_dir=temp_dir)
+            self.assertEqual(os.listdir(temp_dir), [])
+        self.assertEqual(xor.num_partitions, 8)
+        self.assertEqual(xor.num_keys, len(keys))
+        self.assertEqual(sum(partition.num_keys for partition in xor.partitions), len(keys))
+        self.assertTrue(all(key in xor for key in keys))
+        self.assertTrue(xor.contains_many(keys).all())
+        others = [str(key) for key in range(20000, 40000)]
+        self.assertEqual(xor.contains_many(others).tolist(), [key in xor for key in others])
+        self.assertLess(xor.contains_many(others).mean(), 0.01)
+        self.assertEqual(len(xor.contains_many([])), 0)
+
+    def test_key_file(self):
+        keys = [str(key) for key in range(10000)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'keys.txt')
+            with open(path, 'w', newline='') as key_file:
+                key_file.write('\r\n'.join(keys[:5000]) + '\r\n' + '\n'.join(keys[5000:]))
+            xor = SmallPartitions(len(keys), 0.01, path)
+        self.assertEqual(xor.num_keys, len(keys))
+        self.assertTrue(xor.contains_many(keys).all())
+
+    def test_parallel_build(self):
+        keys = np.arange(20000)
+        xor = SmallPartitions(len(keys), 0.01, keys, hasher='int', workers=2)
+        self.assertEqual(len(xor.partitions), 8)
+        self.assertTrue(xor.contains_many(keys).all())
+        self.assertTrue(all(key in xor for key in range(0, 20000, 7)))
+
+    def test_empty(self):
+        xor = PartitionedXorFilter(10, 0.01, iter([]))
+        self.assertEqual(xor.num_keys, 0)
+        self.assertFalse('Ohio' in xor)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_streaming(self):
+        """Build time and peak traced memory against XorFilter"""
+        def peak_memory(function):
+            # Tracing slows the build down, so it is timed separately
+            tracemalloc.start()
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak / 2 ** 20
+
+        lines = []
+        for exponent in range(6, 9):
+            num_keys = 10 ** exponent
+            builds = [
+                ("partitioned-xor-filter from a generator",
+                 lambda: PartitionedXorFilter(num_keys, 0.01, iter(range(num_keys)), hasher='int')),
+            ]
+            if exponent < 8:
+                builds.insert(0, ("xor-filter from an array",
+                                  lambda: XorFilter(num_keys, 0.01, np.arange(num_keys), hasher='int')))
+            for name, build in builds:
+                build_time = time_call(build, repeat=1)
+                lines.append(
+                    f"{name} with {num_keys} keys: construction {build_time:.3f}s, "
+                    f"peak memory {peak_memory(build):.0f}MB"
+                )
+        write_benchmark("partitioned-xor-filter", "streaming", lines)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""Unit tests for quotient_filter"""
+
+import numpy as np
+from quotient_filter import QuotientFilter
+from testutils import *
+
+class TestQuotientFilter(unittest.TestCase):
+    def test_states(self):
+        test_filter_states(QuotientFilter)
+
+    def test_random(self):
+        test_filter_random(QuotientFilter)
+
+    def test_delete(self):
+        quotient = QuotientFilter(1000, error_rate=0.01)
+        for state in States():
+            quotient.add(state)
+        quotient.add('Ohio')
+        for state in States():
+            self.assertTrue(quotient.delete(state))
+        # Duplicates are stored twice, and deleted one at a time
+        self.assertEqual(len(quotient), 1)
+        self.assertIn('Ohio', quotient)
+        self.assertTrue(quotient.delete('Ohio'))
+        self.assertFalse(quotient.delete('Ohio'))
+        self.assertFalse(quotient.slots.any())
+
+    def test_sorted_slots(self):
+        quotient = QuotientFilter(100, error_rate=0.01)
+        for key in range(70):
+            quotient.add(key)
+        expected = np.sort(quotient._get_fingerprints_many(list(range(70))))
+        self.assertEqual(quotient._fingerprints().tolist(), expected.tolist())
+        # Rebuilding from the sorted fingerprints gives back the same slots
+        slots = quotient.slots.copy()
+        quotient._store(expected)
+        self.assertTrue((quotient.slots == slots).all())
+
+    def test_full(self):
+        # Keys pushed past the last slot wrap around to the first ones
+        quotient = QuotientFilter(12, error_rate=0.01)
+        keys = [str(key) for key in range(quotient.num_slots)]
+        for key in keys:
+            quotient.add(key)
+        self.assertTrue(all(key in quotient for key in keys))
+        with self.assertRaises(Exception):
+            quotient.add('Atlantis')
+        for key in keys[::2]:
+            self.assertTrue(quotient.delete(key))
+        self.assertTrue(all(key in quotient for key in keys[1::2]))
+        with self.assertRaises(Exception):
+            quotient.add_many(keys * 2)
+
+    def test_batch(self):
+        batch = QuotientFilter(10000, error_rate=0.001)
+        scalar = QuotientFilter(10000, error_rate=0.001)
+        batch.add_many(range(5000))
+        batch.add_many(range(5000, 6000))
+        batch.add_many([6000])
+        for key in range(6001):
+            scalar.add(key)
+        self.assertEqual(len(batch), 6001)
+        self.assertTrue((batch.slots == scalar.slots).all())
+        self.assertTrue(batch.contains_many(range(6001)).all())
+        expected = [key in batch for key in range(6001, 20000)]
+        self.assertEqual(batch.contains_many(range(6001, 20000)).tolist(), expected)
+        self.assertEqual(len(batch.contains_many([])), 0)
+
+    def test_grow(self):
+        quotient = QuotientFilter(1000, error_rate=0.001)
+        for state in States():
+            quotient.add(state)
+        fingerprints = quotient._fingerprints()
+        quotient.grow()
+        quotient.grow()
+        self.assertEqual(quotient.num_slots, 8 << 10)
+        self.assertEqual(quotient.remainder_bits, 8)
+        self.assertEqual(quotient._fingerprints().tolist(), fingerprints.tolist())
+        self.assertTrue(all(state in quotient for state in States()))
+        self.assertNotIn('Atlantis', quotient)
+        quotient.add('Atlantis')
+        self.assertIn('Atlantis', quotient)
+        with self.assertRaises(ValueError):
+            QuotientFilter(1000, error_rate=0.5).grow()
+
+    def test_auto_grow(self):
+        quotient = QuotientFilter(1000, error_rate=0.0001, auto_grow=True, hasher='int')
+        for key in range(10000):
+            quotient.add(key)
+        self.assertEqual(quotient.num_slots, 16 << 10)
+        self.assertEqual(quotient.fingerprint_size, 11 + 14)
+        self.assertTrue(quotient.contains_many(range(10000)).all())
+        batch = QuotientFilter(1000, error_rate=0.0001, auto_grow=True, hasher='int')
+        batch.add_many(np.arange(10000))
+        self.assertTrue((batch.slots == quotient.slots).all())
+
+    def test_merge(self):
+        # Segments of different sizes sharing a fingerprint size
+        segments = [QuotientFilter(max_elements, error_rate=0.01, fingerprint_size=24)
+                    for max_elements in [100, 1000, 3000]]
+        for segment, keys in zip(segments, [range(100), range(100, 1100), range(1100, 3100)]):
+            segment.add_many(keys)
+        merged = QuotientFilter.merge(segments)
+        self.assertEqual(len(merged), 3100)
+        self.assertEqual(merged.fingerprint_size, 24)
+        self.assertLessEqual(len(merged), merged.growth_load_factor * merged.num_slots)
+        self.assertTrue(merged.contains_many(range(3100)).all())
+        self.assertEqual([len(segment) for segment in segments], [100, 1000, 2000])
+        scalar = QuotientFilter(merged.max_elements, error_rate=0.01, fingerprint_size=24)
+        for key in range(3100):
+            scalar.add(key)
+        self.assertTrue((merged.slots == scalar.slots).all())
+        with self.assertRaises(ValueError):
+            QuotientFilter.merge([])
+        with self.assertRaises(ValueError):
+            QuotientFilter.merge([segments[0], QuotientFilter(100, error_rate=0.01)])
+        with self.assertRaises(ValueError):
+            QuotientFilter.merge([segments[0], QuotientFilter(100, fingerprint_size=24, hasher='int')])
+        with self.assertRaises(ValueError):
+            QuotientFilter(1000, fingerprint_size=10)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_compaction(self):
+        """Merging per-segment filters against inserting their keys again"""
+        lines = []
+        for exponent in range(4, 7):
+            elements = 10 ** exponent
+            # Sized so the merged filter meets the error rate
+            fingerprint_size = QuotientFilter(elements, error_rate=0.001).fingerprint_size
+            segments = []
+            for start in range(0, elements, elements // 8):
+                segment = QuotientFilter(elements // 8, hasher='int', fingerprint_size=fingerprint_size)
+                segment.add_many(np.arange(start, start + elements // 8))
+                segments.append(segment)
+            merge_time = time_call(QuotientFilter.merge, segments)
+
+            def rebuild():
+                quotient = QuotientFilter(elements, hasher='int', fingerprint_size=fingerprint_size)
+                quotient.add_many(np.arange(elements))
+
+            rebuild_time = time_call(rebuild)
+            merged = QuotientFilter.merge(segments)
+            grow_time = time_call(lambda: merged.copy().grow())
+            sample = list(range(elements, elements + 10000))
+            lines.append(
+                f"quotient-filter with {elements} elements in 8 segments: "
+                f"merge {merge_time / elements * 1e9:.0f}ns/key, "
+                f"add_many from the keys {rebuild_time / elements * 1e9:.0f}ns/key, "
+                f"grow {grow_time / elements * 1e9:.0f}ns/key, "
+                f"contains {time_call(lambda: [key in merged for key in sample]) / len(sample) * 1e9:.0f}ns/key, "
+                f"contains_many "
+                f"{time_call(merged.contains_many, np.arange(elements, 2 * elements)) / elements * 1e9:.0f}ns/key, "
+                f"false positive rate {merged.contains_many(np.arange(elements, 2 * elements)).mean():.5f}"
+            )
+        write_benchmark("quotient-filter", "compaction", lines)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_performance(self):
+        test_filter_performance(QuotientFilter, "quotient-filter")
+
+if __name__ == '__main__':
+    unittest.main()
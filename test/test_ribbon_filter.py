@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# coding=utf-8
+
+"""Unit tests for ribbon_filter"""
+
+import functools
+import numpy as np
+from xor_filter import XorFilter
+from ribbon_filter import RibbonFilter
+from testutils import *
+
+class TestRibbonFilter(unittest.TestCase):
+    def test_states(self):
+        test_filter_states(RibbonFilter)
+
+    def test_random(self):
+        test_filter_random(RibbonFilter)
+
+    def test_band_widths(self):
+        keys = [str(key) for key in range(10000)]
+        others = [str(key) for key in range(10000, 30000)]
+        for band_width in [32, 64, 100, 128]:
+            ribbon = RibbonFilter(len(keys), 0.01, keys, band_width=band_width)
+            self.assertTrue(ribbon.contains_many(keys).all())
+            self.assertTrue(all(key in ribbon for key in keys[:1000]))
+            found = ribbon.contains_many(others)
+            self.assertEqual(found.tolist(), [key in ribbon for key in others])
+            self.assertLess(found.mean(), 0.01)
+        for band_width in [16, 129]:
+            with self.assertRaises(ValueError):
+                RibbonFilter(len(keys), 0.01, keys, band_width=band_width)
+
+    def test_fingerprint_sizes(self):
+        keys = np.arange(10000)
+        for num_bits in [1, 13, 64]:
+            ribbon = RibbonFilter(len(keys), 0.01, keys, hasher='int', num_bits=num_bits)
+            self.assertEqual(ribbon.solution.shape[1], num_bits)
+            self.assertTrue(ribbon.contains_many(keys).all())
+            self.assertTrue(all(key in ribbon for key in range(0, 10000, 7)))
+
+    def test_overhead(self):
+        keys = np.arange(100000)
+        xor = XorFilter(len(keys), 0.01, keys, hasher='int')
+        ribbon = RibbonFilter(len(keys), 0.01, keys, hasher='int', band_width=128, overhead=0.05)
+        self.assertEqual(ribbon.num_starts, 105000)
+        self.assertLess(ribbon.bits_per_key, 0.9 * xor.bits_per_key)
+        self.assertTrue(ribbon.contains_many(keys).all())
+        # Fewer slots than keys cannot hold them all
+        with self.assertRaises(ValueError):
+            RibbonFilter(10000, 0.01, np.arange(10000), hasher='int', overhead=-0.1)
+
+    def test_duplicates(self):
+        keys = ['Ohio', 'Utah', 'Ohio'] + [str(key) for key in range(1000)]
+        ribbon = RibbonFilter(len(keys), 0.01, keys)
+        self.assertTrue(all(key in ribbon for key in keys))
+        self.assertEqual(len(RibbonFilter(10, 0.01, [])), 64)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_comparison(self):
+        """Build time, lookup time and bits per key against XorFilter"""
+        filters = [('xor-filter', functools.partial(XorFilter, hasher='int'))] + [
+            (f'ribbon-filter band width {band_width}',
+             functools.partial(RibbonFilter, hasher='int', band_width=band_width))
+            for band_width in [32, 64, 128]]
+        compare_static_filters("ribbon-filter", filters, range(4, 7))
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_performance(self):
+        test_filter_performance(RibbonFilter, "ribbon-filter")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# pylint: disable=superfluous-parens
+# superfluous-parens: Parentheses are good for clarity and portability
+
+"""Unit tests for scalable_bloom_filter"""
+
+import numpy as np
+from bloom_filter import ScalableBloomFilter, Numpy_backend
+from testutils import *
+
+class TestScalableBloomFilter(unittest.TestCase):
+    def test_states(self):
+        test_filter_states(ScalableBloomFilter)
+
+    def test_random(self):
+        test_filter_random(ScalableBloomFilter)
+
+    def test_growth(self):
+        """Start far too small and check the error rate holds as it grows"""
+        scalable = ScalableBloomFilter(max_elements=100, error_rate=0.01)
+        values = Evens(20000)
+        for value in values:
+            scalable.add(value)
+        self.assertGreater(len(scalable.filters), 5)
+        # Keys that look present already (false positives) are not counted
+        self.assertLessEqual(len(scalable), values.length())
+        self.assertGreater(len(scalable), 0.99 * values.length())
+        self.assertLess(scalable.compound_error_rate(), 0.01)
+        self.assertTrue(all(value in scalable for value in values))
+        false_positives = sum(str(value) in scalable for value in range(1, 20000, 2))
+        self.assertLess(false_positives / 10000, 0.01)
+
+    def test_stage_growth(self):
+        scalable = ScalableBloomFilter(max_elements=100, error_rate=0.01,
+                                       growth_factor=2, tightening_ratio=0.5)
+        scalable.add_many(range(1000))
+        capacities = [stage.ideal_num_elements_n for stage in scalable.filters]
+        self.assertEqual(capacities, [100, 200, 400, 800])
+        self.assertEqual(scalable.stage_counts, [100, 200, 400, 300])
+        error_rates = [stage.error_rate_p for stage in scalable.filters]
+        for previous, current in zip(error_rates, error_rates[1:]):
+            self.assertAlmostEqual(current, previous / 2)
+
+    def test_add_existing(self):
+        scalable = ScalableBloomFilter(max_elements=10, error_rate=0.01)
+        self.assertTrue(scalable.add('Ohio'))
+        self.assertFalse(scalable.add('Ohio'))
+        self.assertEqual(len(scalable), 1)
+
+    def test_batch(self):
+        scalable = ScalableBloomFilter(max_elements=1000, error_rate=0.01,
+                                       hasher='int', backend=Numpy_backend)
+        keys = np.arange(0, 100000, 2)
+        scalable.add_many(keys)
+        self.assertEqual(len(scalable), len(keys))
+        self.assertTrue(scalable.contains_many(keys).all())
+        self.assertLess(scalable.contains_many(keys + 1).mean(), 0.01)
+        self.assertEqual(scalable.contains_many(keys[:200] + 1).tolist(),
+                         [int(key) in scalable for key in keys[:200] + 1])
+        scalable.add_many(keys[:1000])
+        self.assertEqual(len(scalable), len(keys))
+
+    def test_batch_duplicates(self):
+        batch = ScalableBloomFilter(max_elements=10, error_rate=0.01)
+        batch.add_many(['x', 'x', 'x'])
+        self.assertEqual(len(batch), 1)
+        keys = [str(key % 15) for key in range(60)]
+        batch = ScalableBloomFilter(max_elements=10, error_rate=0.01)
+        scalar = ScalableBloomFilter(max_elements=10, error_rate=0.01)
+        batch.add_many(keys)
+        for key in keys:
+            scalar.add(key)
+        self.assertEqual(len(batch), 15)
+        self.assertEqual(batch.stage_counts, scalar.stage_counts)
+        self.assertTrue(batch.contains_many(keys).all())
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_performance(self):
+        test_filter_performance(ScalableBloomFilter, "scalable-bloom-filter")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,8 @@
 
 """Unit tests for vacuum_filter"""
 
+import numpy as np
+import utils
 from vacuum_filter import VacuumFilter
 from testutils import *
 
@@ -21,6 +23,101 @@ class TestVacuumFilter(unittest.TestCase):
         vacuum = VacuumFilter(1000000, error_rate=.99)
         assert vacuum.fingerprint_size >= 1
 
+    def test_batch(self):
+        vacuum = VacuumFilter(10000, error_rate=0.01)
+        vacuum.add_many(range(9000))
+        self.assertEqual(len(vacuum), 9000)
+        self.assertTrue(vacuum.contains_many(np.arange(9000)).all())
+        expected = [key in vacuum for key in range(9000, 20000)]
+        self.assertEqual(vacuum.contains_many(range(9000, 20000)).tolist(), expected)
+        self.assertTrue(vacuum.delete_many(list(range(0, 9000, 2))).all())
+        self.assertEqual(len(vacuum), 4500)
+        self.assertTrue(vacuum.contains_many(range(1, 9000, 2)).all())
+
+    def test_packed_storage(self):
+        vacuum = VacuumFilter(2000, error_rate=0.01)
+        self.assertIsInstance(vacuum.buckets, utils.BucketArray)
+        num_keys = int(0.9 * vacuum.num_buckets * vacuum.bucket_size)
+        for key in range(num_keys // 2):
+            vacuum.add(key)
+        vacuum.add_many(range(num_keys // 2, num_keys))
+        vacuum.delete_many(range(0, num_keys, 3))
+        for key in range(1, num_keys, 3):
+            vacuum.delete(key)
+        # Occupancy counts follow the table through evictions and deletes
+        table = vacuum.buckets.table
+        self.assertEqual(vacuum.occupancy.tolist(), np.count_nonzero(table, axis=1).tolist())
+        self.assertEqual(int(vacuum.occupancy.sum()), len(vacuum))
+        self.assertTrue(vacuum.contains_many(range(2, num_keys, 3)).all())
+
+    def test_chunked_layout(self):
+        vacuum = VacuumFilter(1000000, error_rate=0.01)
+        self.assertTrue(vacuum.chunked)
+        chunk_size = max(vacuum.alternate_ranges)
+        self.assertEqual(vacuum.num_buckets % chunk_size, 0)
+        for fingerprint in range(1, 1 << vacuum.fingerprint_size, 7):
+            i = (fingerprint * 7919) % vacuum.num_buckets
+            j = vacuum._get_alternate_index(i, fingerprint)
+            self.assertEqual(i // chunk_size, j // chunk_size)
+            self.assertEqual(vacuum._get_alternate_index(j, fingerprint), i)
+        # Mid-size filters shrink the widest range to fit whole chunks
+        for max_elements in [10000, 100000, 300000]:
+            vacuum = VacuumFilter(max_elements, error_rate=0.01)
+            self.assertTrue(vacuum.chunked)
+            self.assertLessEqual(vacuum.num_buckets * vacuum.bucket_size, 1.05 * max_elements)
+            self.assertEqual(vacuum.num_buckets % max(vacuum.alternate_ranges), 0)
+        # Only tables smaller than one chunk use a table-wide range
+        self.assertFalse(VacuumFilter(50, error_rate=0.01).chunked)
+        # Short fingerprints still reach across the widest alternate range
+        vacuum = VacuumFilter(1000000, error_rate=0.05)
+        self.assertEqual(vacuum.fingerprint_size, 8)
+        distances = [vacuum._get_alternate_index(0, f) for f in range(1, 256)]
+        self.assertGreater(max(distances), 1 << vacuum.fingerprint_size)
+
+    def test_layout_fixed_at_construction(self):
+        # Alternate buckets must not change as the filter fills up
+        vacuum = VacuumFilter(320000, error_rate=0.01, hasher='int')
+        vacuum.add_many(np.arange(300000))
+        self.assertTrue(vacuum.contains_many(np.arange(300000)).all())
+
+    def test_bfs_eviction(self):
+        vacuum = VacuumFilter(4000, error_rate=0.001, eviction='bfs')
+        num_keys = int(0.9 * vacuum.num_buckets * vacuum.bucket_size)
+        for key in range(num_keys):
+            vacuum.add(key)
+        self.assertTrue(all(key in vacuum for key in range(num_keys)))
+        self.assertLessEqual(max(vacuum.eviction_path_lengths), vacuum.bfs_max_depth)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_eviction(self):
+        test_eviction_performance(VacuumFilter, "vacuum-filter")
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_layout(self):
+        """Distance between the two buckets of a key, chunked against table-wide"""
+        lines = []
+        keys = np.arange(10 ** 6)
+        for exponent in range(6, 8):
+            elements = 10 ** exponent
+            vacuum = VacuumFilter(elements, error_rate=0.01, hasher='int')
+            # Packed table of the same shape, read bucket i then bucket j of every key
+            table = np.zeros((vacuum.num_buckets, vacuum.bucket_size),
+                             dtype=utils.fingerprint_dtype(vacuum.fingerprint_size))
+            for chunked in [True, False]:
+                vacuum.chunked = chunked
+                _, i, j = vacuum._get_fingerprints_and_indices_many(keys)
+                distances = np.abs(i.astype(np.int64) - j.astype(np.int64)) * table[0].nbytes
+                buckets_per_page = 4096 // table[0].nbytes
+                probes = np.stack((i, j), axis=1).ravel()
+                gather_time = time_call(lambda: table[probes])
+                lines.append(
+                    f"vacuum-filter with {elements} elements, {vacuum.num_buckets} buckets, "
+                    f"chunked {chunked}: median bucket distance {np.median(distances) / 1024:.1f}KiB, "
+                    f"same 4KiB page {np.mean(i // buckets_per_page == j // buckets_per_page):.3f}, "
+                    f"lookup gather {gather_time / len(keys) * 1e9:.1f}ns/key"
+                )
+        write_benchmark("vacuum-filter", "layout", lines)
+
     @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
     def test_performance(self):
         test_filter_performance(VacuumFilter, "vacuum-filter")
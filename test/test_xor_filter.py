@@ -3,7 +3,10 @@
 
 """Unit tests for xor_filter"""
 
-from xor_filter import XorFilter
+import pickle
+import numpy as np
+import utils
+from xor_filter import XorFilter, Xor8, Xor16, BinaryFuseFilter
 from testutils import *
 
 class TestXorFilter(unittest.TestCase):
@@ -12,7 +15,94 @@ class TestXorFilter(unittest.TestCase):
 
     def test_random(self):
         test_filter_random(XorFilter)
-        
+
+    def test_table_sizes(self):
+        # A third of the table holds 1050 slots, a multiple of 3 and 5, which
+        # divide 2^64 - 1
+        keys = [str(key) for key in range(2535)]
+        xor = XorFilter(len(keys), 0.01, keys)
+        self.assertEqual(xor.size // 3, 1050)
+        self.assertTrue(all(key in xor for key in keys))
+
+    def test_construction(self):
+        keys = np.arange(100000)
+        xor = XorFilter(len(keys), 0.01, keys, hasher='int')
+        self.assertTrue(all(key in xor for key in range(0, 100000, 7)))
+        false_positives = sum(key in xor for key in range(100000, 120000))
+        self.assertLess(false_positives / 20000, 0.01)
+        self.assertEqual(len(XorFilter(10, 0.01, [])), 32)
+
+    def test_retry_without_rehashing(self):
+        class CountingHasher(utils.MurmurHasher):
+            num_hashed = 0
+
+            def hash_many(self, keys):
+                CountingHasher.num_hashed += len(keys)
+                return super().hash_many(keys)
+
+        # Duplicate keys make the first attempt fail
+        keys = ['Ohio', 'Utah', 'Ohio'] + [str(key) for key in range(1000)]
+        xor = XorFilter(len(keys), 0.01, keys, hasher=CountingHasher())
+        self.assertEqual(CountingHasher.num_hashed, len(keys))
+        self.assertTrue(all(key in xor for key in keys))
+
+    def test_compact_storage(self):
+        keys = np.arange(100000)
+        self.assertEqual(XorFilter(len(keys), 0.01, keys, hasher='int').backend.dtype, np.uint8)
+        self.assertEqual(XorFilter(len(keys), 1e-9, keys, hasher='int').backend.dtype, np.uint32)
+        for xor_class, num_bits, dtype in [(Xor8, 8, np.uint8), (Xor16, 16, np.uint16)]:
+            xor = xor_class(len(keys), keys, hasher='int')
+            self.assertEqual(xor.num_bits, num_bits)
+            self.assertEqual(xor.backend.dtype, dtype)
+            self.assertAlmostEqual(xor.bits_per_key, 1.23 * num_bits, delta=0.01)
+            self.assertTrue(all(key in xor for key in range(0, 100000, 7)))
+        false_positives = sum(key in xor for key in range(100000, 200000))
+        self.assertLess(false_positives, 10)
+
+    def test_pickle(self):
+        keys = [str(key) for key in range(1000)]
+        for xor in [XorFilter(len(keys), 0.01, keys), BinaryFuseFilter(len(keys), 0.01, keys)]:
+            copy = pickle.loads(pickle.dumps(xor))
+            self.assertTrue(all(key in copy for key in keys))
+            self.assertTrue(np.array_equal(copy.backend, xor.backend))
+
+    def test_contains_many(self):
+        keys = [str(key) for key in range(10000)]
+        xor = XorFilter(len(keys), 0.01, keys)
+        self.assertTrue(xor.contains_many(keys).all())
+        others = [str(key) for key in range(10000, 30000)]
+        self.assertEqual(xor.contains_many(others).tolist(), [key in xor for key in others])
+        self.assertEqual(len(xor.contains_many([])), 0)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_construction(self):
+        lines = []
+        for exponent in range(3, 9):
+            keys = np.arange(10 ** exponent)
+            build_time = time_call(lambda: XorFilter(len(keys), 0.01, keys, hasher='int'), repeat=1)
+            lines.append(
+                f"xor-filter with {len(keys)} keys: construction {build_time:.3f}s, "
+                f"{build_time / len(keys) * 1e9:.0f}ns/key"
+            )
+        write_benchmark("xor-filter", "construction", lines)
+
+    @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
+    def test_benchmark_batch(self):
+        """Batch lookups against one call per key"""
+        lines = []
+        for exponent in range(4, 7):
+            elements = 10 ** exponent
+            keys = np.arange(elements)
+            for hasher in ['murmur', 'int']:
+                xor = XorFilter(elements, 0.01, keys, hasher=hasher)
+                contains_time = time_call(lambda: [key in xor for key in keys.tolist()])
+                contains_many_time = time_call(xor.contains_many, keys)
+                lines.append(
+                    f"xor-filter with {elements} elements, hasher {hasher}: "
+                    f"contains {contains_time:.3f}s, contains_many {contains_many_time:.3f}s"
+                )
+        write_benchmark("xor-filter", "batch", lines)
+
     @unittest.skipUnless(os.environ.get('TEST_PERF', ''), "disabled")
     def test_performance(self):
         test_filter_performance(XorFilter, "xor-filter")
@@ -7,11 +7,15 @@ import time
 import unittest
 import math
 import random
+import numpy as np
 from pympler import asizeof
-from xor_filter import XorFilter
+from xor_filter import XorFilter, PartitionedXorFilter
+from ribbon_filter import RibbonFilter
 
 CHARACTERS = 'abcdefghijklmnopqrstuvwxyz1234567890'
 
+STATIC_FILTERS = (XorFilter, PartitionedXorFilter, RibbonFilter)
+
 class States(object):
     """Generate the USA's state names"""
 
@@ -141,7 +145,8 @@ def test_filter(
     divisor = 100000
 
     filter_instance = None
-    if filter_class != XorFilter:
+    # Static filters are built from all their keys at once
+    if not issubclass(getattr(filter_class, 'func', filter_class), STATIC_FILTERS):
         filter_instance = filter_class(
             max_elements=values.length() * max_elements_multiple,
             error_rate=error_rate
@@ -202,6 +207,94 @@ def test_filter_random(filter_class):
     test_filter('random', Random_content(), trials=100000, error_rate=1E-3, filter_class=filter_class)
     test_filter('random', Random_content(), trials=100000, error_rate=1E-4, filter_class=filter_class)
 
+def time_call(function, *args, repeat=3):
+    """Best wall-clock time in seconds of function(*args) over repeat runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        time0 = time.time()
+        function(*args)
+        best = min(best, time.time() - time0)
+    return best
+
+def write_benchmark(filter_name, benchmark_name, lines):
+    """Write benchmark results to performance/<filter_name>/<benchmark_name>.txt"""
+    path = f'performance/{filter_name}/'
+
+    # Create path if it doesn't exist
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    with open(path + benchmark_name + '.txt', 'w') as output:
+        for line in lines:
+            print(line)
+            output.write(line + '\n')
+
+def compare_static_filters(filter_name, filters, exponents):
+    """
+    Build static filters over 10**exponent int keys and write their build
+    time, lookup time, bits per key and false positive rate to
+    performance/<filter_name>/comparison.txt
+
+    :param filters: (name, filter_class) pairs, filter_class called as
+    filter_class(max_elements, error_rate, keys)
+    """
+    lines = []
+    for exponent in exponents:
+        elements = 10 ** exponent
+        keys = np.arange(elements)
+        others = np.arange(elements, 2 * elements)
+        for name, filter_class in filters:
+            build_time = time_call(lambda: filter_class(elements, 0.01, keys), repeat=1)
+            amq = filter_class(elements, 0.01, keys)
+            contains_many_time = time_call(amq.contains_many, others)
+            sample = others[:10000].tolist()
+            contains_time = time_call(lambda: [key in amq for key in sample])
+            lines.append(
+                f"{name} with {elements} elements: build {build_time / elements * 1e9:.0f}ns/key, "
+                f"contains {contains_time / len(sample) * 1e9:.0f}ns/key, "
+                f"contains_many {contains_many_time / elements * 1e9:.0f}ns/key, "
+                f"bits per key {amq.bits_per_key:.2f}, "
+                f"false positive rate {amq.contains_many(others).mean():.4f}"
+            )
+    write_benchmark(filter_name, "comparison", lines)
+
+def test_eviction_performance(filter_class, filter_name, num_slots=1 << 18):
+    """
+    Fill cuckoo-style filters with each eviction strategy until an insert
+    fails, and report the load reached, the eviction path lengths and the
+    insert latency above 90% load.
+    """
+    lines = []
+    for eviction in ['random', 'bfs']:
+        cuckoo_filter = filter_class(num_slots, error_rate=0.001, hasher='int', eviction=eviction)
+        capacity = cuckoo_filter.num_buckets * cuckoo_filter.bucket_size
+        latencies = []
+        key = 0
+        try:
+            # A stash, if the filter has one, only fills once evictions fail
+            while not getattr(cuckoo_filter, 'stash', None):
+                time0 = time.perf_counter()
+                cuckoo_filter.add(key)
+                if key >= 0.9 * capacity:
+                    latencies.append(time.perf_counter() - time0)
+                key += 1
+        except Exception:
+            pass
+        lengths = sorted(cuckoo_filter.eviction_path_lengths.elements())
+        evictions = [length for length in lengths if length]
+        latencies = sorted(latencies)
+        lines.append(
+            f"{filter_name} with {capacity} slots, eviction {eviction}: "
+            f"load reached {key / capacity:.4f}, evictions {len(evictions)}, "
+            f"path length median {evictions[len(evictions) // 2]}, "
+            f"p99 {evictions[int(len(evictions) * 0.99)]}, max {evictions[-1]}; "
+            f"insert latency above 0.9 load median {latencies[len(latencies) // 2] * 1e6:.1f}us, "
+            f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f}us, "
+            f"p99.9 {latencies[int(len(latencies) * 0.999)] * 1e6:.1f}us, "
+            f"max {latencies[-1] * 1e6:.1f}us"
+        )
+    write_benchmark(filter_name, "eviction", lines)
+
 def test_filter_performance(filter_class, filter_name):
         """Performance tests for a general class"""
         path = f'performance/{filter_name}/'